@@ -1,10 +1,49 @@
 import os
+import io
+import re
 import base64
-from flask import Flask, request, jsonify, send_from_directory
+import hashlib
+import heapq
+import hmac
+import json
+import math
+import mimetypes
+import atexit
+import sqlite3
+import queue
+import threading
+import time
+import unicodedata
+import bisect
+from collections import OrderedDict
+from contextlib import closing
+from concurrent.futures import ThreadPoolExecutor, Future, as_completed
+from functools import wraps
+import urllib.request
+import urllib.error
+from urllib.parse import quote, urlencode
+from flask import Flask, Response, request, jsonify, send_file, make_response, abort, g, stream_with_context
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import select, func, literal, literal_column, cast, event, inspect, case, distinct, text, table, column, bindparam
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.dialects.postgresql import insert as pg_insert, aggregate_order_by
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import joinedload, selectinload, load_only, with_loader_criteria, Session
 from datetime import datetime, timedelta
 from flask_cors import CORS
-from werkzeug.utils import secure_filename
+from werkzeug.utils import secure_filename, safe_join
+
+# Pillow é opcional: sem ele os uploads são gravados como vieram (só com nome por hash)
+try:
+    from PIL import Image, ImageOps
+except ImportError:
+    Image = None
+
+# orjson é opcional: acelera a serialização das listagens em stream
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 app = Flask(__name__)
 # Habilita CORS para qualquer origem (necessário para rodar client.html localmente)
@@ -19,6 +58,16 @@ if not os.path.exists(UPLOAD_FOLDER):
 
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 
+# O Procfile usa o worker gevent (por causa do /api/stream); nele o psycopg2 precisa do
+# psycogreen para ceder a vez enquanto espera o banco em vez de travar o worker inteiro.
+try:
+    from gevent import monkey
+    if monkey.is_module_patched('socket'):
+        from psycogreen.gevent import patch_psycopg
+        patch_psycopg()
+except ImportError:
+    pass
+
 # Database Config - Supports SQLite (local) and PostgreSQL (production)
 database_url = os.environ.get('DATABASE_URL', 'sqlite:///igreja.db')
 if database_url and database_url.startswith("postgres://"):
@@ -32,40 +81,142 @@ db = SQLAlchemy(app)
 with app.app_context():
     db.create_all()
 
+# --- ENTREGA DE ARQUIVOS ---
+# Sem offload o Flask envia o arquivo com suporte a Range/If-None-Match (o gunicorn usa
+# sendfile() no wrapper de arquivo). Com ARQUIVOS_OFFLOAD o worker só devolve os headers
+# e o proxy da frente transfere o arquivo:
+#   accel    -> X-Accel-Redirect (nginx), caminho relativo à pasta do app sob ARQUIVOS_ACCEL_PREFIXO
+#               location /_arquivos/ { internal; alias /caminho/do/app/; }
+#   sendfile -> X-Sendfile com caminho absoluto (Apache mod_xsendfile, lighttpd)
+RAIZ_APP = os.getcwd()
+ARQUIVOS_OFFLOAD = os.environ.get('ARQUIVOS_OFFLOAD', '').lower()
+ARQUIVOS_ACCEL_PREFIXO = os.environ.get('ARQUIVOS_ACCEL_PREFIXO', '/_arquivos').rstrip('/')
+CACHE_IMUTAVEL = 'public, max-age=31536000, immutable' # Nome por hash: o conteúdo nunca muda
+CACHE_ESTATICO = f"public, max-age={int(os.environ.get('ARQUIVOS_MAX_AGE', '86400'))}"
+CACHE_REVALIDAR = 'no-cache' # HTML, manifest e service worker: sempre revalida (304 via ETag)
+
+def entregar_arquivo(diretorio, nome, cache_control=CACHE_ESTATICO, mimetype=None):
+    caminho = safe_join(diretorio, nome)
+    if caminho is None or not os.path.isfile(caminho):
+        abort(404)
+
+    if ARQUIVOS_OFFLOAD in ('accel', 'sendfile'):
+        resposta = Response(mimetype=mimetype or mimetypes.guess_type(caminho)[0] or 'application/octet-stream')
+        if ARQUIVOS_OFFLOAD == 'accel':
+            relativo = os.path.relpath(caminho, RAIZ_APP).replace(os.sep, '/')
+            resposta.headers['X-Accel-Redirect'] = f"{ARQUIVOS_ACCEL_PREFIXO}/{quote(relativo)}"
+        else:
+            resposta.headers['X-Sendfile'] = os.path.abspath(caminho)
+    else:
+        resposta = send_file(caminho, mimetype=mimetype, conditional=True, etag=True)
+
+    resposta.headers['Cache-Control'] = cache_control
+    return resposta
+
 # Rota para servir imagens de upload
+# ?tamanho=64|256|1080|1280 escolhe a variante gerada no upload (ver resolver_variante)
 @app.route('/uploads/<filename>')
 def uploaded_file(filename):
-    return send_from_directory(app.config['UPLOAD_FOLDER'], filename)
+    nome, mimetype, definitivo = resolver_variante(filename, request.args.get('tamanho'))
+    resposta = entregar_arquivo(app.config['UPLOAD_FOLDER'], nome,
+        cache_control=CACHE_IMUTAVEL if definitivo else CACHE_REVALIDAR, mimetype=mimetype)
+    if nome != filename:
+        resposta.vary.add('Accept')
+    return resposta
 
 # Rota para servir imagens estáticas gerais (logo, etc)
 @app.route('/imagens/<path:filename>')
 def serve_imagens(filename):
-    return send_from_directory(os.path.join(os.getcwd(), 'imagens'), filename)
+    return entregar_arquivo(os.path.join(RAIZ_APP, 'imagens'), filename)
 
 # Rotas do Frontend
 @app.route('/')
 def serve_client():
-    return send_from_directory(os.getcwd(), 'client.html')
+    return entregar_arquivo(RAIZ_APP, 'client.html', CACHE_REVALIDAR)
 
 @app.route('/manifest.json')
 def serve_manifest():
-    return send_from_directory(os.getcwd(), 'manifest.json')
+    return entregar_arquivo(RAIZ_APP, 'manifest.json', CACHE_REVALIDAR)
 
 @app.route('/sw.js')
 def serve_sw():
-    return send_from_directory(os.getcwd(), 'sw.js')
+    return entregar_arquivo(RAIZ_APP, 'sw.js', CACHE_REVALIDAR)
 
 @app.route('/app_icon.png')
 def serve_app_icon():
-    return send_from_directory(os.getcwd(), 'app_icon.png')
+    return entregar_arquivo(RAIZ_APP, 'app_icon.png')
 
 @app.route('/admin')
 def serve_admin():
-    return send_from_directory(os.getcwd(), 'admin.html')
+    return entregar_arquivo(RAIZ_APP, 'admin.html', CACHE_REVALIDAR)
+
+# --- PROJEÇÃO DE CAMPOS (?fields=) ---
+# O to_json de cada modelo sai de CAMPOS_JSON {campo: lambda obj: valor}. Com ?fields= só os
+# campos pedidos são montados e aplicar_campos() restringe o SELECT (load_only) às colunas
+# que eles usam. COLUNAS_JSON lista as colunas de campos calculados (ex.: "data" ->
+# data_criacao); campos com nome de coluna não precisam constar. CAMPOS_EXTRAS são campos
+# montados fora do dicionário (dependem de argumentos, ex.: curtido_por_mim).
+# Campos aninhados usam ponto: ?fields=id,nome,membros.id,membros.nome
+
+class Projetavel:
+    CAMPOS_JSON = {}
+    COLUNAS_JSON = {}
+    CAMPOS_EXTRAS = ()
+
+    def projetar(self, campos=None):
+        return {nome: valor(self) for nome, valor in self.CAMPOS_JSON.items() if campos is None or nome in campos}
+
+    @classmethod
+    def validar_campos(cls, campos):
+        invalidos = set(campos) - set(cls.CAMPOS_JSON) - set(cls.CAMPOS_EXTRAS)
+        if invalidos:
+            disponiveis = ', '.join(list(cls.CAMPOS_JSON) + list(cls.CAMPOS_EXTRAS))
+            raise ParametroInvalido(f"Campos invalidos: {', '.join(sorted(invalidos))}. Disponiveis: {disponiveis}")
+
+    @classmethod
+    def colunas_json(cls, campos):
+        colunas = cls.__mapper__.column_attrs
+        nomes = {coluna for campo in campos for coluna in cls.COLUNAS_JSON.get(campo, (campo,))}
+        return [getattr(cls, nome) for nome in sorted(nomes) if nome in colunas]
+
+def quer(campos, nome):
+    return campos is None or nome in campos
+
+def subcampos(campos, nome):
+    # Campos do objeto aninhado (None = todos)
+    return None if campos is None else campos.get(nome)
+
+def parametro_fields(modelo=None):
+    """Lê ?fields=a,b,c.d como {"a": None, "b": None, "c": {"d": None}}; None sem o parâmetro.
+    Com modelo, valida os nomes do primeiro nível."""
+    valor = request.args.get('fields')
+    if valor is None:
+        return None
+    campos = {}
+    for caminho in valor.split(','):
+        partes = [p.strip() for p in caminho.split('.')]
+        if not all(partes):
+            continue
+        atual = campos
+        for parte in partes[:-1]:
+            if parte in atual and atual[parte] is None:
+                break # O objeto inteiro já foi pedido
+            atual = atual.setdefault(parte, {})
+        else:
+            atual[partes[-1]] = None
+    if modelo is not None:
+        modelo.validar_campos(campos)
+    return campos
+
+def aplicar_campos(query, modelo, campos, *sempre):
+    # sempre: colunas usadas pela própria consulta (ex.: cursor da paginação)
+    if campos is None:
+        return query
+    return query.options(load_only(modelo.id, *sempre, *modelo.colunas_json(campos)))
 
 # --- MODELOS DO BANCO DE DADOS ---
 
-class Rede(db.Model):
+class Rede(Projetavel, db.Model):
     id = db.Column(db.Integer, primary_key=True)
     nome = db.Column(db.String(100), nullable=False)
     lider_nome = db.Column(db.String(100))
@@ -74,49 +225,60 @@ class Rede(db.Model):
     # Relacionamento com Gerações
     geracoes = db.relationship('Geracao', backref='rede', lazy=True)
 
-    def to_json(self):
-        return {
-            "id": self.id,
-            "nome": self.nome,
-            "lider_nome": self.lider_nome,
-            "lider_telefone": self.lider_telefone
-        }
+    CAMPOS_JSON = {
+        "id": lambda s: s.id,
+        "nome": lambda s: s.nome,
+        "lider_nome": lambda s: s.lider_nome,
+        "lider_telefone": lambda s: s.lider_telefone
+    }
 
-class Geracao(db.Model):
+    def to_json(self, campos=None):
+        return self.projetar(campos)
+
+class Geracao(Projetavel, db.Model):
     id = db.Column(db.Integer, primary_key=True)
     nome = db.Column(db.String(100), nullable=False)
-    rede_id = db.Column(db.Integer, db.ForeignKey('rede.id'), nullable=True)
+    rede_id = db.Column(db.Integer, db.ForeignKey('rede.id'), nullable=True, index=True)
     lider_nome = db.Column(db.String(100))
     lider_telefone = db.Column(db.String(20))
     
     # Relacionamento com Células
     celulas = db.relationship('Celula', backref='geracao', lazy=True)
 
-    def to_json(self):
-        return {
-            "id": self.id,
-            "nome": self.nome,
-            "rede_id": self.rede_id,
-            "lider_nome": self.lider_nome,
-            "lider_telefone": self.lider_telefone,
-            "rede_nome": self.rede.nome if self.rede else None,
-            "celulas": [{
+    CAMPOS_JSON = {
+        "id": lambda s: s.id,
+        "nome": lambda s: s.nome,
+        "rede_id": lambda s: s.rede_id,
+        "lider_nome": lambda s: s.lider_nome,
+        "lider_telefone": lambda s: s.lider_telefone,
+        "rede_nome": lambda s: s.rede.nome if s.rede else None
+    }
+    COLUNAS_JSON = {"rede_nome": ("rede_id",)}
+    CAMPOS_EXTRAS = ("celulas",)
+
+    def to_json(self, contagens=None, campos=None):
+        data = self.projetar(campos)
+        if quer(campos, "celulas"):
+            # contagens: {celula_id: {...}} de contagem_membros(); sem ele conta só as células desta geração
+            if contagens is None:
+                contagens = contagem_membros([c.id for c in self.celulas])
+            data["celulas"] = [{
                 "id": c.id,
                 "nome": c.nome,
                 "lider": c.lider,
-                "total_membros": len(c.membros)
+                "total_membros": contagens.get(c.id, {}).get("total", 0)
             } for c in self.celulas]
-        }
+        return data
 
-class Celula(db.Model):
+class Celula(Projetavel, db.Model):
     id = db.Column(db.Integer, primary_key=True)
     nome = db.Column(db.String(100), nullable=False)
     lider = db.Column(db.String(100))
     lider_treinamento = db.Column(db.String(100)) # Novo campo
     
     # Hierarquia
-    rede_id = db.Column(db.Integer, db.ForeignKey('rede.id'), nullable=True)
-    geracao_id = db.Column(db.Integer, db.ForeignKey('geracao.id'), nullable=True)
+    rede_id = db.Column(db.Integer, db.ForeignKey('rede.id'), nullable=True, index=True)
+    geracao_id = db.Column(db.Integer, db.ForeignKey('geracao.id'), nullable=True, index=True)
     rede_str = db.Column("rede", db.String(100)) 
     
     # Relacionamento explícito com Rede (para evitar conflito com coluna 'rede')
@@ -130,39 +292,52 @@ class Celula(db.Model):
     cep = db.Column(db.String(10))
     latitude = db.Column(db.Float)
     longitude = db.Column(db.Float)
+    geohash = db.Column(db.String(12), index=True) # Preenchido a partir de latitude/longitude (busca por proximidade)
+    excluido_em = db.Column(db.DateTime, index=True) # Exclusão lógica (ver EXCLUSÃO LÓGICA)
     dia_reuniao = db.Column(db.String(50))
+    dia_reuniao_busca = db.Column(db.String(50)) # dia_reuniao sem acento/caixa (filtro ?dia= de /api/celulas/proximas)
     horario_reuniao = db.Column(db.String(50))
     
     # Relacionamentos
-    membros = db.relationship('Membro', backref='celula', lazy=True)
+    membros = db.relationship('Membro', backref='celula', lazy=True, order_by='Membro.id')
     reunioes = db.relationship('Reuniao', backref='celula', lazy=True)
 
-    def to_json(self):
-        membros_objs = Membro.query.filter_by(celula_id=self.id).all()
-        return {
-            "id": self.id, 
-            "nome": self.nome, 
-            "lider": self.lider,
-            "lider_treinamento": self.lider_treinamento,
-            "rede": self.rede_obj.nome if self.rede_obj else (self.rede_str or "Sem Rede"),
-            "rede_id": self.rede_id,
-            "geracao": self.geracao.nome if self.geracao else "Sem Geração",
-            "geracao_id": self.geracao_id,
-            "endereco": self.endereco,
-            "numero": self.numero,
-            "bairro": self.bairro,
-            "cidade": self.cidade,
-            "estado": self.estado,
-            "cep": self.cep,
-            "formatted_address": f"{self.endereco}, {self.numero} - {self.bairro}, {self.cidade}/{self.estado}",
-            "latitude": self.latitude,
-            "longitude": self.longitude,
-            "dia_reuniao": self.dia_reuniao,
-            "horario_reuniao": self.horario_reuniao,
-            "membros": [m.to_json() for m in membros_objs]
-        }
-
-class Membro(db.Model):
+    CAMPOS_JSON = {
+        "id": lambda s: s.id,
+        "nome": lambda s: s.nome,
+        "lider": lambda s: s.lider,
+        "lider_treinamento": lambda s: s.lider_treinamento,
+        "rede": lambda s: s.rede_obj.nome if s.rede_obj else (s.rede_str or "Sem Rede"),
+        "rede_id": lambda s: s.rede_id,
+        "geracao": lambda s: s.geracao.nome if s.geracao else "Sem Geração",
+        "geracao_id": lambda s: s.geracao_id,
+        "endereco": lambda s: s.endereco,
+        "numero": lambda s: s.numero,
+        "bairro": lambda s: s.bairro,
+        "cidade": lambda s: s.cidade,
+        "estado": lambda s: s.estado,
+        "cep": lambda s: s.cep,
+        "formatted_address": lambda s: f"{s.endereco}, {s.numero} - {s.bairro}, {s.cidade}/{s.estado}",
+        "latitude": lambda s: s.latitude,
+        "longitude": lambda s: s.longitude,
+        "dia_reuniao": lambda s: s.dia_reuniao,
+        "horario_reuniao": lambda s: s.horario_reuniao
+    }
+    COLUNAS_JSON = {
+        "rede": ("rede_id", "rede_str"),
+        "geracao": ("geracao_id",),
+        "formatted_address": ("endereco", "numero", "bairro", "cidade", "estado"),
+    }
+    CAMPOS_EXTRAS = ("membros",)
+
+    def to_json(self, incluir_membros=True, campos=None):
+        data = self.projetar(campos)
+        if incluir_membros and quer(campos, "membros"):
+            # Usa o relacionamento (pré-carregado via selectinload nas listagens)
+            data["membros"] = [m.to_json(subcampos(campos, "membros")) for m in self.membros]
+        return data
+
+class Membro(Projetavel, db.Model):
     id = db.Column(db.Integer, primary_key=True)
     nome = db.Column(db.String(100), nullable=False)
     # Permite membro sem célula (nullable=True)
@@ -191,104 +366,150 @@ class Membro(db.Model):
     # Campo novo: Encontro com Deus
     fez_encontro = db.Column(db.Boolean, default=False)
 
+    # Coordenadas do endereço (geocodificação em lote); não saem no to_json
+    latitude = db.Column(db.Float)
+    longitude = db.Column(db.Float)
+
     # Novos Campos: Biografia e Foto
     biografia = db.Column(db.String(500))
     foto_url = db.Column(db.String(200))
+
+    excluido_em = db.Column(db.DateTime, index=True) # Exclusão lógica (ver EXCLUSÃO LÓGICA)
     
-    def to_json(self):
-        return {
-            "id": self.id, 
-            "nome": self.nome, 
-            "celula_id": self.celula_id,
-            "rede_id": self.rede_id,
-            "geracao_id": self.geracao_id,
-            "telefone": self.telefone,
-            "data_nascimento": self.data_nascimento.isoformat() if self.data_nascimento else None,
-            "endereco": self.endereco,
-            "tipo": self.tipo,
-            "data_conversao": self.data_conversao.isoformat() if self.data_conversao else None,
-            "email": self.email,
-            "fez_encontro": self.fez_encontro,
-            "biografia": self.biografia,
-            "foto_url": self.foto_url
-        }
-
-class Evento(db.Model):
+    CAMPOS_JSON = {
+        "id": lambda s: s.id,
+        "nome": lambda s: s.nome,
+        "celula_id": lambda s: s.celula_id,
+        "rede_id": lambda s: s.rede_id,
+        "geracao_id": lambda s: s.geracao_id,
+        "telefone": lambda s: s.telefone,
+        "data_nascimento": lambda s: s.data_nascimento.isoformat() if s.data_nascimento else None,
+        "endereco": lambda s: s.endereco,
+        "tipo": lambda s: s.tipo,
+        "data_conversao": lambda s: s.data_conversao.isoformat() if s.data_conversao else None,
+        "email": lambda s: s.email,
+        "fez_encontro": lambda s: s.fez_encontro,
+        "biografia": lambda s: s.biografia,
+        "foto_url": lambda s: s.foto_url
+    }
+
+    def to_json(self, campos=None):
+        return self.projetar(campos)
+
+class Evento(Projetavel, db.Model):
     id = db.Column(db.Integer, primary_key=True)
     titulo = db.Column(db.String(100), nullable=False)
     descricao = db.Column(db.String(500))
     data_evento = db.Column(db.DateTime) 
     local = db.Column(db.String(200))
     foto_url = db.Column(db.String(200))
+    excluido_em = db.Column(db.DateTime, index=True) # Exclusão lógica (ver EXCLUSÃO LÓGICA)
+
+    # Contadores desnormalizados (atualizados com UPDATE ... SET n = n + 1)
+    total_curtidas = db.Column(db.Integer, default=0, nullable=False, server_default='0')
+    total_comentarios = db.Column(db.Integer, default=0, nullable=False, server_default='0')
 
     # Relacionamentos
     curtidas = db.relationship('Curtida', backref='evento', lazy=True)
     comentarios = db.relationship('Comentario', backref='evento', lazy=True)
 
-    def to_json(self, current_user_id=None):
-        data = {
-            "id": self.id,
-            "titulo": self.titulo,
-            "descricao": self.descricao,
-            "data_evento": self.data_evento.isoformat() if self.data_evento else None,
-            "local": self.local,
-            "foto_url": self.foto_url,
-            "total_curtidas": len(self.curtidas),
-            "total_comentarios": len(self.comentarios)
-        }
-        if current_user_id:
-            msg_curtida = next((c for c in self.curtidas if c.membro_id == current_user_id), None)
-            data["curtido_por_mim"] = True if msg_curtida else False
+    CAMPOS_JSON = {
+        "id": lambda s: s.id,
+        "titulo": lambda s: s.titulo,
+        "descricao": lambda s: s.descricao,
+        "data_evento": lambda s: s.data_evento.isoformat() if s.data_evento else None,
+        "local": lambda s: s.local,
+        "foto_url": lambda s: s.foto_url,
+        "total_curtidas": lambda s: s.total_curtidas or 0,
+        "total_comentarios": lambda s: s.total_comentarios or 0
+    }
+    CAMPOS_EXTRAS = ("curtido_por_mim",)
+
+    def to_json(self, current_user_id=None, curtidos=None, campos=None):
+        # curtidos: ids já curtidos pelo usuário (resolvidos em lote por ids_curtidos)
+        data = self.projetar(campos)
+        if current_user_id and quer(campos, "curtido_por_mim"):
+            if curtidos is None:
+                curtidos = ids_curtidos(Curtida.evento_id, current_user_id, [self.id])
+            data["curtido_por_mim"] = self.id in curtidos
         return data
 
 class Curtida(db.Model):
+    __table_args__ = (
+        # Impede curtida duplicada em toques simultâneos
+        db.Index('uq_curtida_evento_membro', 'evento_id', 'membro_id', unique=True),
+        db.Index('uq_curtida_aviso_membro', 'aviso_id', 'membro_id', unique=True),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     evento_id = db.Column(db.Integer, db.ForeignKey('evento.id'), nullable=True)
     aviso_id = db.Column(db.Integer, db.ForeignKey('aviso.id'), nullable=True)
     membro_id = db.Column(db.Integer, db.ForeignKey('membro.id'), nullable=False)
 
-class Comentario(db.Model):
+class Comentario(Projetavel, db.Model):
     id = db.Column(db.Integer, primary_key=True)
     texto = db.Column(db.String(500), nullable=False)
     data_criacao = db.Column(db.DateTime, default=datetime.utcnow)
-    evento_id = db.Column(db.Integer, db.ForeignKey('evento.id'), nullable=True)
-    aviso_id = db.Column(db.Integer, db.ForeignKey('aviso.id'), nullable=True)
+    evento_id = db.Column(db.Integer, db.ForeignKey('evento.id'), nullable=True, index=True)
+    aviso_id = db.Column(db.Integer, db.ForeignKey('aviso.id'), nullable=True, index=True)
     membro_id = db.Column(db.Integer, db.ForeignKey('membro.id'), nullable=False)
     
     # Campo para respostas (aninhamento)
-    parent_id = db.Column(db.Integer, db.ForeignKey('comentario.id'), nullable=True)
+    parent_id = db.Column(db.Integer, db.ForeignKey('comentario.id'), nullable=True, index=True)
     respostas = db.relationship('Comentario', backref=db.backref('parent', remote_side=[id]), lazy=True)
+    excluido_em = db.Column(db.DateTime, index=True) # Marcado junto com o autor/evento (ver EXCLUSÃO LÓGICA)
+
+    total_curtidas = db.Column(db.Integer, default=0, nullable=False, server_default='0')
+    total_respostas = db.Column(db.Integer, default=0, nullable=False, server_default='0')
 
     # Relacionamento para acessar dados do autor
     autor = db.relationship('Membro', backref='meus_comentarios', lazy=True)
     curtidas = db.relationship('CurtidaComentario', backref='comentario', lazy=True)
 
-    def to_json(self, current_user_id=None):
-        data = {
-            "id": self.id,
-            "texto": self.texto,
-            "data": self.data_criacao.strftime('%d/%m %H:%M'),
-            "autor_nome": self.autor.nome,
-            "autor_foto": self.autor.foto_url,
-            "total_curtidas": len(self.curtidas),
-            "respostas": [r.to_json(current_user_id) for r in self.respostas]
-        }
-        if current_user_id:
-             msg_curtida = next((c for c in self.curtidas if c.membro_id == current_user_id), None)
-             data["curtido_por_mim"] = True if msg_curtida else False
+    CAMPOS_JSON = {
+        "id": lambda s: s.id,
+        "texto": lambda s: s.texto,
+        "data": lambda s: s.data_criacao.strftime('%d/%m %H:%M'),
+        "autor_nome": lambda s: s.autor.nome,
+        "autor_foto": lambda s: s.autor.foto_url,
+        "total_curtidas": lambda s: s.total_curtidas or 0,
+        "total_respostas": lambda s: s.total_respostas or 0
+    }
+    COLUNAS_JSON = {"data": ("data_criacao",), "autor_nome": ("membro_id",), "autor_foto": ("membro_id",)}
+    CAMPOS_EXTRAS = ("respostas", "curtido_por_mim")
+
+    def to_json(self, current_user_id=None, respostas=None, curtidos=None, campos=None):
+        # respostas/curtidos podem vir pré-calculados (ver carregar_thread)
+        data = self.projetar(campos)
+        if quer(campos, "respostas"):
+            data["respostas"] = [r.to_json(current_user_id, campos=campos) for r in self.respostas] if respostas is None else respostas
+        if current_user_id and quer(campos, "curtido_por_mim"):
+            if curtidos is None:
+                curtidos = ids_curtidos(CurtidaComentario.comentario_id, current_user_id, [self.id])
+            data["curtido_por_mim"] = self.id in curtidos
         return data
 
 class CurtidaComentario(db.Model):
+    __table_args__ = (
+        db.Index('uq_curtida_comentario_membro', 'comentario_id', 'membro_id', unique=True),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     comentario_id = db.Column(db.Integer, db.ForeignKey('comentario.id'), nullable=False)
     membro_id = db.Column(db.Integer, db.ForeignKey('membro.id'), nullable=False)
 
-class Story(db.Model):
+STORY_DURACAO = timedelta(hours=24)
+
+class Story(Projetavel, db.Model):
+    __table_args__ = (
+        db.Index('ix_story_expira_em', 'expira_em'),
+        db.Index('ix_story_rede_geracao_criado', 'rede_id', 'geracao_id', 'criado_em'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     foto_url = db.Column(db.String(200), nullable=False)
     legenda = db.Column(db.String(100))
     criado_em = db.Column(db.DateTime, default=datetime.utcnow)
-    expira_em = db.Column(db.DateTime) 
+    expira_em = db.Column(db.DateTime, default=lambda: datetime.utcnow() + STORY_DURACAO)
     
     # Novos campos para gestão
     autor_id = db.Column(db.Integer, db.ForeignKey('membro.id'), nullable=True)
@@ -298,20 +519,28 @@ class Story(db.Model):
     
     autor = db.relationship('Membro', backref='meus_stories')
 
-    def to_json(self):
-        return {
-            "id": self.id,
-            "foto_url": self.foto_url,
-            "legenda": self.legenda,
-            "criado_em": self.criado_em.isoformat(),
-            "autor_id": self.autor_id,
-            "autor_nome": self.autor.nome if self.autor else "Admin",
-            "celula_id": self.celula_id,
-            "rede_id": self.rede_id,
-            "geracao_id": self.geracao_id
-        }
-
-class Aviso(db.Model):
+    CAMPOS_JSON = {
+        "id": lambda s: s.id,
+        "foto_url": lambda s: s.foto_url,
+        "legenda": lambda s: s.legenda,
+        "criado_em": lambda s: s.criado_em.isoformat(),
+        "expira_em": lambda s: s.expira_em.isoformat() if s.expira_em else None,
+        "autor_id": lambda s: s.autor_id,
+        "autor_nome": lambda s: s.autor.nome if s.autor else "Admin",
+        "celula_id": lambda s: s.celula_id,
+        "rede_id": lambda s: s.rede_id,
+        "geracao_id": lambda s: s.geracao_id
+    }
+    COLUNAS_JSON = {"autor_nome": ("autor_id",)}
+
+    def to_json(self, campos=None):
+        return self.projetar(campos)
+
+class Aviso(Projetavel, db.Model):
+    __table_args__ = (
+        db.Index('ix_aviso_data_criacao_id', 'data_criacao', 'id'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     celula_id = db.Column(db.Integer, db.ForeignKey('celula.id'), nullable=True) # Agora opcional
     rede_id = db.Column(db.Integer, db.ForeignKey('rede.id'), nullable=True)     # Novo
@@ -321,31 +550,45 @@ class Aviso(db.Model):
     mensagem = db.Column(db.String(500), nullable=False)
     data_criacao = db.Column(db.DateTime, default=datetime.utcnow)
     autor_id = db.Column(db.Integer, db.ForeignKey('membro.id'), nullable=False)
+
+    total_curtidas = db.Column(db.Integer, default=0, nullable=False, server_default='0')
+    total_comentarios = db.Column(db.Integer, default=0, nullable=False, server_default='0')
     
     autor = db.relationship('Membro', backref='avisos_criados')
     curtidas = db.relationship('Curtida', backref='aviso', lazy=True)
     comentarios = db.relationship('Comentario', backref='aviso', lazy=True)
 
-    def to_json(self, current_user_id=None):
-        data = {
-            "id": self.id,
-            "titulo": self.titulo,
-            "mensagem": self.mensagem,
-            "data": self.data_criacao.strftime('%d/%m %H:%M'),
-            "autor_id": self.autor_id,
-            "autor_nome": self.autor.nome,
-            "celula_id": self.celula_id,
-            "rede_id": self.rede_id,
-            "geracao_id": self.geracao_id,
-            "total_curtidas": len(self.curtidas),
-            "total_comentarios": len(self.comentarios)
-        }
-        if current_user_id:
-            msg_curtida = next((c for c in self.curtidas if c.membro_id == current_user_id), None)
-            data["curtido_por_mim"] = True if msg_curtida else False
+    CAMPOS_JSON = {
+        "id": lambda s: s.id,
+        "titulo": lambda s: s.titulo,
+        "mensagem": lambda s: s.mensagem,
+        "data": lambda s: s.data_criacao.strftime('%d/%m %H:%M'),
+        "autor_id": lambda s: s.autor_id,
+        "autor_nome": lambda s: s.autor.nome,
+        "celula_id": lambda s: s.celula_id,
+        "rede_id": lambda s: s.rede_id,
+        "geracao_id": lambda s: s.geracao_id,
+        "total_curtidas": lambda s: s.total_curtidas or 0,
+        "total_comentarios": lambda s: s.total_comentarios or 0
+    }
+    COLUNAS_JSON = {"data": ("data_criacao",), "autor_nome": ("autor_id",)}
+    CAMPOS_EXTRAS = ("curtido_por_mim",)
+
+    def to_json(self, current_user_id=None, curtidos=None, campos=None):
+        data = self.projetar(campos)
+        if current_user_id and quer(campos, "curtido_por_mim"):
+            if curtidos is None:
+                curtidos = ids_curtidos(Curtida.aviso_id, current_user_id, [self.id])
+            data["curtido_por_mim"] = self.id in curtidos
         return data
 
-class PedidoOracao(db.Model):
+class PedidoOracao(Projetavel, db.Model):
+    __table_args__ = (
+        # Índices para paginação keyset do feed (data_criacao, id)
+        db.Index('ix_pedido_oracao_data_criacao_id', 'data_criacao', 'id'),
+        db.Index('ix_pedido_oracao_celula_data_criacao_id', 'celula_id', 'data_criacao', 'id'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     celula_id = db.Column(db.Integer, db.ForeignKey('celula.id'), nullable=False)
     membro_id = db.Column(db.Integer, db.ForeignKey('membro.id'), nullable=False)
@@ -355,17 +598,25 @@ class PedidoOracao(db.Model):
     
     autor = db.relationship('Membro', backref='meus_pedidos')
 
-    def to_json(self):
-        return {
-            "id": self.id,
-            "pedido": self.pedido,
-            "data": self.data_criacao.strftime('%d/%m %H:%M'),
-            "autor_nome": self.autor.nome,
-            "autor_foto": self.autor.foto_url,
-            "resolvido": self.resolvido
-        }
-
-class Testemunho(db.Model):
+    CAMPOS_JSON = {
+        "id": lambda s: s.id,
+        "pedido": lambda s: s.pedido,
+        "data": lambda s: s.data_criacao.strftime('%d/%m %H:%M'),
+        "autor_nome": lambda s: s.autor.nome,
+        "autor_foto": lambda s: s.autor.foto_url,
+        "resolvido": lambda s: s.resolvido
+    }
+    COLUNAS_JSON = {"data": ("data_criacao",), "autor_nome": ("membro_id",), "autor_foto": ("membro_id",)}
+
+    def to_json(self, campos=None):
+        return self.projetar(campos)
+
+class Testemunho(Projetavel, db.Model):
+    __table_args__ = (
+        db.Index('ix_testemunho_data_criacao_id', 'data_criacao', 'id'),
+        db.Index('ix_testemunho_celula_data_criacao_id', 'celula_id', 'data_criacao', 'id'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     celula_id = db.Column(db.Integer, db.ForeignKey('celula.id'), nullable=False)
     membro_id = db.Column(db.Integer, db.ForeignKey('membro.id'), nullable=False)
@@ -374,31 +625,39 @@ class Testemunho(db.Model):
     
     autor = db.relationship('Membro', backref='meus_testemunhos')
     
-    def to_json(self):
-        return {
-            "id": self.id,
-            "texto": self.texto,
-            "data": self.data_criacao.strftime('%d/%m %H:%M'),
-            "autor_nome": self.autor.nome,
-            "autor_foto": self.autor.foto_url
-        }
-class Escola(db.Model):
+    CAMPOS_JSON = {
+        "id": lambda s: s.id,
+        "texto": lambda s: s.texto,
+        "data": lambda s: s.data_criacao.strftime('%d/%m %H:%M'),
+        "autor_nome": lambda s: s.autor.nome,
+        "autor_foto": lambda s: s.autor.foto_url
+    }
+    COLUNAS_JSON = {"data": ("data_criacao",), "autor_nome": ("membro_id",), "autor_foto": ("membro_id",)}
+
+    def to_json(self, campos=None):
+        return self.projetar(campos)
+class Escola(Projetavel, db.Model):
     id = db.Column(db.Integer, primary_key=True)
     nome = db.Column(db.String(100), nullable=False)
     descricao = db.Column(db.String(500))
     foto_url = db.Column(db.String(200))
     dia_horario = db.Column(db.String(100))
     
-    def to_json(self):
-        return {
-            "id": self.id,
-            "nome": self.nome,
-            "descricao": self.descricao,
-            "foto_url": self.foto_url,
-            "dia_horario": self.dia_horario
-        }
-
-class Reuniao(db.Model):
+    CAMPOS_JSON = {
+        "id": lambda s: s.id,
+        "nome": lambda s: s.nome,
+        "descricao": lambda s: s.descricao,
+        "foto_url": lambda s: s.foto_url,
+        "dia_horario": lambda s: s.dia_horario
+    }
+
+    def to_json(self, campos=None):
+        return self.projetar(campos)
+
+class Reuniao(Projetavel, db.Model):
+    __table_args__ = (
+        db.Index('ix_reuniao_celula_data', 'celula_id', 'data'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     celula_id = db.Column(db.Integer, db.ForeignKey('celula.id'), nullable=False)
     data = db.Column(db.DateTime, default=datetime.utcnow)
@@ -408,41 +667,1551 @@ class Reuniao(db.Model):
     # Relacionamento com frequencia
     frequencias = db.relationship('Frequencia', backref='reuniao', lazy=True)
 
-    def to_json(self):
-        return {
-            "id": self.id,
-            "celula_id": self.celula_id,
-            "data": self.data.isoformat(),
-            "tema": self.tema,
-            "observacoes": self.observacoes
-        }
-
-class Frequencia(db.Model):
+    CAMPOS_JSON = {
+        "id": lambda s: s.id,
+        "celula_id": lambda s: s.celula_id,
+        "data": lambda s: s.data.isoformat(),
+        "tema": lambda s: s.tema,
+        "observacoes": lambda s: s.observacoes
+    }
+
+    def to_json(self, campos=None):
+        return self.projetar(campos)
+
+class Frequencia(Projetavel, db.Model):
+    __table_args__ = (
+        # Uma linha por membro por reunião (presente ou ausente); alvo do upsert em lote
+        db.Index('uq_frequencia_reuniao_membro', 'reuniao_id', 'membro_id', unique=True),
+    )
     id = db.Column(db.Integer, primary_key=True)
     reuniao_id = db.Column(db.Integer, db.ForeignKey('reuniao.id'), nullable=False)
     membro_id = db.Column(db.Integer, db.ForeignKey('membro.id'), nullable=False)
     presente = db.Column(db.Boolean, default=False)
 
-    def to_json(self):
-        return {
-            "reuniao_id": self.reuniao_id,
-            "membro_id": self.membro_id,
-            "presente": self.presente
-        }
-
-class Estudo(db.Model):
+    CAMPOS_JSON = {
+        "reuniao_id": lambda s: s.reuniao_id,
+        "membro_id": lambda s: s.membro_id,
+        "presente": lambda s: s.presente
+    }
+
+    def to_json(self, campos=None):
+        return self.projetar(campos)
+
+class FrequenciaSemanal(db.Model):
+    # Consolidado por célula por semana ISO (semana = segunda-feira), recalculado a cada
+    # gravação de frequência/reunião e quando um membro muda de tipo (visitantes); os
+    # relatórios leem só daqui
+    __tablename__ = 'frequencia_semanal'
+    celula_id = db.Column(db.Integer, primary_key=True)
+    semana = db.Column(db.Date, primary_key=True)
+    reunioes = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    presencas = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    participantes = db.Column(db.Integer, nullable=False, default=0, server_default='0') # membros distintos presentes
+    visitantes = db.Column(db.Integer, nullable=False, default=0, server_default='0')    # visitantes distintos presentes
+    atualizado_em = db.Column(db.DateTime, default=datetime.utcnow)
+
+class Estudo(Projetavel, db.Model):
     id = db.Column(db.Integer, primary_key=True)
     titulo = db.Column(db.String(100), nullable=False)
     conteudo_link = db.Column(db.String(200)) # Link para PDF ou texto
     data_publicacao = db.Column(db.DateTime, default=datetime.utcnow)
 
-    def to_json(self):
-        return {
-            "id": self.id,
-            "titulo": self.titulo,
-            "conteudo_link": self.conteudo_link,
-            "data_publicacao": self.data_publicacao.isoformat()
-        }
+    CAMPOS_JSON = {
+        "id": lambda s: s.id,
+        "titulo": lambda s: s.titulo,
+        "conteudo_link": lambda s: s.conteudo_link,
+        "data_publicacao": lambda s: s.data_publicacao.isoformat()
+    }
+
+    def to_json(self, campos=None):
+        return self.projetar(campos)
+
+class HierarquiaCelula(db.Model):
+    # Índice de fechamento rede/geração -> célula (uma linha por ancestral de cada célula).
+    # Mantido por atualizar_hierarquia a cada escrita em Celula/Geracao.
+    __tablename__ = 'hierarquia_celula'
+    ancestral_tipo = db.Column(db.String(10), primary_key=True) # 'rede' ou 'geracao'
+    ancestral_id = db.Column(db.Integer, primary_key=True)
+    celula_id = db.Column(db.Integer, primary_key=True, index=True) # Sem FK: a linha é removida depois da célula
+
+class VersaoTabela(db.Model):
+    # Carimbo de versão por tabela, incrementado a cada commit que a altera.
+    # Base dos ETags/Last-Modified das listagens (ver condicional).
+    __tablename__ = 'versao_tabela'
+    tabela = db.Column(db.String(50), primary_key=True)
+    versao = db.Column(db.Integer, nullable=False, default=0)
+    atualizado_em = db.Column(db.DateTime, default=datetime.utcnow)
+
+class EventoStream(db.Model):
+    # Log curto de eventos publicados para /api/stream. Cada processo lê as linhas novas
+    # e repassa às conexões SSE abertas nele (funciona entre workers/processos).
+    __tablename__ = 'evento_stream'
+    id = db.Column(db.Integer, primary_key=True)
+    tipo = db.Column(db.String(30), nullable=False) # aviso, comentario, curtida, story
+    dados = db.Column(db.Text, nullable=False)      # JSON pequeno (ids e contadores)
+    celula_id = db.Column(db.Integer)
+    geracao_id = db.Column(db.Integer)
+    rede_id = db.Column(db.Integer)
+    criado_em = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+
+class GeoCache(db.Model):
+    # Respostas dos serviços de CEP/geocodificação (ver /api/geo). dados = JSON da resposta
+    # normalizada; NULL = não encontrado (cache negativo, com TTL menor).
+    __tablename__ = 'geo_cache'
+    __table_args__ = (
+        db.Index('uq_geo_cache_tipo_chave', 'tipo', 'chave', unique=True),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    tipo = db.Column(db.String(10), nullable=False) # cep, geocode
+    chave = db.Column(db.String(300), nullable=False)
+    dados = db.Column(db.Text)
+    criado_em = db.Column(db.DateTime, default=datetime.utcnow)
+    expira_em = db.Column(db.DateTime, nullable=False, index=True)
+
+# --- HIERARQUIA (rede -> geração -> célula) ---
+
+def atualizar_hierarquia(celula_ids=None, conn=None):
+    """Recalcula as linhas de HierarquiaCelula das células informadas (None = todas).
+    A rede de uma célula é a dela própria e/ou a da sua geração."""
+    conn = conn if conn is not None else db.session
+    h = HierarquiaCelula.__table__
+    cel = Celula.__table__
+    ger = Geracao.__table__
+
+    apagar = h.delete()
+    if celula_ids is not None:
+        celula_ids = list(celula_ids)
+        if not celula_ids:
+            return
+        apagar = apagar.where(h.c.celula_id.in_(celula_ids))
+    conn.execute(apagar)
+
+    def filtrar(consulta):
+        # Célula excluída (exclusão lógica) sai do índice na hora
+        consulta = consulta.where(cel.c.excluido_em.is_(None))
+        return consulta.where(cel.c.id.in_(celula_ids)) if celula_ids is not None else consulta
+
+    redes = db.union(
+        filtrar(select(literal('rede'), cel.c.rede_id, cel.c.id).where(cel.c.rede_id.isnot(None))),
+        filtrar(select(literal('rede'), ger.c.rede_id, cel.c.id)
+            .join(ger, ger.c.id == cel.c.geracao_id).where(ger.c.rede_id.isnot(None)))
+    )
+    geracoes = filtrar(select(literal('geracao'), cel.c.geracao_id, cel.c.id).where(cel.c.geracao_id.isnot(None)))
+    colunas = [h.c.ancestral_tipo, h.c.ancestral_id, h.c.celula_id]
+    conn.execute(h.insert().from_select(colunas, redes))
+    conn.execute(h.insert().from_select(colunas, geracoes))
+
+def reconstruir_hierarquia():
+    atualizar_hierarquia()
+    db.session.commit()
+
+@event.listens_for(Session, 'after_flush')
+def _manter_hierarquia(session, flush_context):
+    # Mantém o índice na mesma transação da escrita em Celula/Geracao
+    def mudou(obj, *campos):
+        estado = inspect(obj)
+        return any(estado.attrs[c].history.has_changes() for c in campos)
+
+    celula_ids, geracao_ids = set(), set()
+    for obj in session.new:
+        if isinstance(obj, Celula): celula_ids.add(obj.id)
+    for obj in session.dirty:
+        if isinstance(obj, Celula) and mudou(obj, 'rede_id', 'geracao_id', 'excluido_em'): celula_ids.add(obj.id)
+        if isinstance(obj, Geracao) and mudou(obj, 'rede_id'): geracao_ids.add(obj.id)
+    for obj in session.deleted:
+        if isinstance(obj, Celula): celula_ids.add(obj.id)
+        if isinstance(obj, Geracao): geracao_ids.add(obj.id)
+
+    if not celula_ids and not geracao_ids:
+        return
+    conn = session.connection()
+    if geracao_ids:
+        celula_ids |= {cid for (cid,) in conn.execute(select(Celula.id).where(Celula.geracao_id.in_(geracao_ids)))}
+    atualizar_hierarquia(celula_ids, conn=conn)
+
+def celulas_do_escopo(rede_id=None, geracao_id=None):
+    """Subquery com os ids das células sob a rede ou geração (uma busca indexada)."""
+    tipo, ancestral_id = ('rede', rede_id) if rede_id else ('geracao', geracao_id)
+    return select(HierarquiaCelula.celula_id).where(
+        HierarquiaCelula.ancestral_tipo == tipo,
+        HierarquiaCelula.ancestral_id == ancestral_id
+    )
+
+def ancestrais_da_celula(celula_id, tipo):
+    """Subquery com as redes (ou gerações) às quais a célula pertence."""
+    return select(HierarquiaCelula.ancestral_id).where(
+        HierarquiaCelula.celula_id == celula_id,
+        HierarquiaCelula.ancestral_tipo == tipo
+    )
+
+def geracoes_da_rede(rede_id):
+    return select(Geracao.id).where(Geracao.rede_id == rede_id)
+
+def celulas_fora_do_escopo(claims, celula_ids):
+    """Das células pedidas, as que quem tem estas claims não pode alterar: Admin altera todas;
+    líder de rede/geração as que estão abaixo dele; os demais só a própria célula."""
+    celula_ids = set(celula_ids)
+    if claims['tipo'] == 'Admin' or not celula_ids:
+        return set()
+    permitidas = {claims['c']} if claims['c'] else set()
+    escopo = None
+    if claims['tipo'] == 'LiderRede' and claims['r']:
+        escopo = celulas_do_escopo(rede_id=claims['r'])
+    elif claims['tipo'] == 'LiderGeracao' and claims['g']:
+        escopo = celulas_do_escopo(geracao_id=claims['g'])
+    if escopo is not None:
+        permitidas |= set(db.session.scalars(escopo.where(HierarquiaCelula.celula_id.in_(celula_ids))))
+    return celula_ids - permitidas
+
+# --- EXCLUSÃO LÓGICA ---
+# DELETE de membro, célula ou evento só preenche excluido_em. Um filtro global (do_orm_execute +
+# with_loader_criteria) tira essas linhas de toda consulta do ORM, junto com o conteúdo listado
+# que depende delas (avisos, pedidos, testemunhos e stories do autor ou da célula). Os comentários
+# do membro ou do evento, com as respostas, ganham excluido_em na mesma hora e os contadores de
+# curtidas/comentários/respostas são recalculados sem eles. Curtidas, reuniões e frequências não
+# são filtradas: só aparecem por contadores ou relatórios, e somem na purga.
+# A remoção de fato é feita por purgar_excluidos em lotes curtos, numa thread do app acordada a
+# cada exclusão ou por purgar_excluidos.py (cron).
+# Consultas que precisam ver as linhas ocultas usam .execution_options(incluir_excluidos=True).
+EXCLUSAO_PURGA_MIN = int(os.environ.get('EXCLUSAO_PURGA_MIN', '5'))
+EXCLUSAO_PURGA_LOTE = int(os.environ.get('EXCLUSAO_PURGA_LOTE', '500'))
+
+MODELOS_EXCLUSAO = (Membro, Celula, Evento)
+
+# Modelo -> colunas que apontam para linhas com exclusão lógica (somem junto até a purga)
+DEPENDENTES_EXCLUSAO = {
+    Aviso: (('autor_id', Membro), ('celula_id', Celula)),
+    PedidoOracao: (('membro_id', Membro), ('celula_id', Celula)),
+    Testemunho: (('membro_id', Membro), ('celula_id', Celula)),
+    Story: (('autor_id', Membro), ('celula_id', Celula)),
+}
+
+def ids_excluidos(modelo):
+    # Pela tabela (Core), para o próprio filtro global não se aplicar à subquery
+    t = modelo.__table__
+    return select(t.c.id).where(t.c.excluido_em.isnot(None))
+
+def criterio_dependente(modelo, colunas):
+    condicoes = []
+    for nome, alvo in colunas:
+        coluna = getattr(modelo, nome)
+        condicao = coluna.not_in(ids_excluidos(alvo))
+        condicoes.append(db.or_(coluna.is_(None), condicao) if coluna.nullable else condicao)
+    return db.and_(*condicoes)
+
+# Aplicados pelo listener também nos carregamentos de relacionamento (propagate_to_loaders=False
+# evita repetir o critério). O dos modelos com exclusão vale sempre, inclusive em subqueries; os
+# dependentes, mais caros de montar a cada execução, só quando o modelo está na consulta.
+CRITERIOS_EXCLUSAO = [with_loader_criteria(m, m.excluido_em.is_(None), include_aliases=True, propagate_to_loaders=False)
+                      for m in MODELOS_EXCLUSAO + (Comentario,)]
+CRITERIOS_DEPENDENTES = {inspect(m): with_loader_criteria(m, criterio_dependente(m, colunas), include_aliases=True,
+                                                          propagate_to_loaders=False)
+                         for m, colunas in DEPENDENTES_EXCLUSAO.items()}
+
+@event.listens_for(Session, 'do_orm_execute')
+def _ocultar_excluidos(orm_execute_state):
+    if orm_execute_state.is_select and not orm_execute_state.is_column_load \
+            and not orm_execute_state.execution_options.get('incluir_excluidos', False):
+        dependentes = [CRITERIOS_DEPENDENTES[m] for m in orm_execute_state.all_mappers if m in CRITERIOS_DEPENDENTES]
+        orm_execute_state.statement = orm_execute_state.statement.options(*CRITERIOS_EXCLUSAO, *dependentes)
+
+def excluir_logicamente(obj):
+    """Marca a linha como excluída. No commit ela e o que depende dela somem das consultas
+    (e as versões dessas tabelas mudam, invalidando ETags e cache); chamar agendar_purga depois.
+    Comentários do membro/evento (com as respostas) são marcados junto e os contadores de quem
+    continua visível são recalculados."""
+    agora = datetime.utcnow()
+    obj.excluido_em = agora
+    _registrar_tabelas(db.session, {m.__tablename__ for m, colunas in DEPENDENTES_EXCLUSAO.items()
+                                    if any(alvo is type(obj) for _, alvo in colunas)})
+    db.session.flush()
+    if isinstance(obj, Evento):
+        # As respostas também levam evento_id
+        marcar = Comentario.evento_id == obj.id
+    elif isinstance(obj, Membro):
+        arvore = arvore_comentarios(select(Comentario.id).where(Comentario.membro_id == obj.id))
+        marcar = Comentario.id.in_(select(arvore.c.id))
+    else:
+        return # Avisos da célula somem inteiros, com os comentários
+
+    afetados = _todas(select(Comentario.evento_id, Comentario.aviso_id, Comentario.parent_id)
+                      .where(marcar, Comentario.excluido_em.is_(None)).distinct())
+    db.session.execute(db.update(Comentario).where(marcar, Comentario.excluido_em.is_(None))
+                       .values(excluido_em=agora).execution_options(synchronize_session=False))
+    if isinstance(obj, Evento):
+        return
+
+    curtidas = _todas(select(Curtida.evento_id, Curtida.aviso_id).where(Curtida.membro_id == obj.id))
+    comentarios_curtidos = _todas(select(CurtidaComentario.comentario_id).where(CurtidaComentario.membro_id == obj.id))
+    recontar_contadores({l.evento_id for l in afetados + curtidas if l.evento_id},
+                        {l.aviso_id for l in afetados + curtidas if l.aviso_id},
+                        {l.parent_id for l in afetados if l.parent_id} | {l.comentario_id for l in comentarios_curtidos})
+
+def _todas(consulta):
+    # A purga enxerga as linhas ocultas pelo filtro global
+    return db.session.execute(consulta.execution_options(incluir_excluidos=True)).all()
+
+def _apagar(modelo, condicao):
+    db.session.execute(db.delete(modelo).where(condicao).execution_options(synchronize_session=False))
+
+def apagar_em_lotes(modelo, condicao, lote, colunas=(), depois=None):
+    """DELETE das linhas de `modelo` que atendem `condicao`, `lote` por vez e com um commit por
+    lote (transações curtas). depois(linhas) roda antes de cada commit com id + `colunas` das
+    linhas apagadas (ex: recalcular contadores)."""
+    total = 0
+    while True:
+        linhas = _todas(select(modelo.id, *colunas).where(condicao).order_by(modelo.id).limit(lote))
+        if not linhas:
+            break
+        _apagar(modelo, modelo.id.in_([linha.id for linha in linhas]))
+        if depois:
+            depois(linhas)
+        db.session.commit()
+        total += len(linhas)
+        if len(linhas) < lote:
+            break
+    return total
+
+def arvore_comentarios(raizes):
+    """CTE (id, nivel) com os comentários de `raizes` (select de ids) e todas as respostas abaixo."""
+    c = Comentario.__table__
+    arvore = select(c.c.id, literal(0).label('nivel')).where(c.c.id.in_(raizes)).cte('arvore_comentarios', recursive=True)
+    return arvore.union_all(select(c.c.id, arvore.c.nivel + 1).join(arvore, c.c.parent_id == arvore.c.id))
+
+def apagar_comentarios(raizes, lote):
+    """Apaga os comentários de `raizes` (select de ids) e todas as respostas abaixo deles, das
+    folhas para a raiz, e recalcula os contadores de quem fica (evento/aviso e pais)."""
+    c = Comentario.__table__
+    arvore = arvore_comentarios(raizes)
+    total = 0
+    while True:
+        # Um comentário pode aparecer em mais de um nível (raiz e resposta de outra raiz): vale o mais fundo
+        ids = [i for (i,) in _todas(select(arvore.c.id).group_by(arvore.c.id)
+                                    .order_by(func.max(arvore.c.nivel).desc(), arvore.c.id).limit(lote))]
+        if not ids:
+            break
+        linhas = _todas(select(c.c.evento_id, c.c.aviso_id, c.c.parent_id).where(c.c.id.in_(ids)))
+        _apagar(CurtidaComentario, CurtidaComentario.comentario_id.in_(ids))
+        _apagar(Comentario, Comentario.id.in_(ids))
+        recontar_contadores({l.evento_id for l in linhas if l.evento_id}, {l.aviso_id for l in linhas if l.aviso_id},
+                            {l.parent_id for l in linhas if l.parent_id} - set(ids))
+        db.session.commit()
+        total += len(ids)
+    return total
+
+def apagar_avisos(condicao, lote):
+    avisos = select(Aviso.id).where(condicao)
+    apagar_comentarios(select(Comentario.id).where(Comentario.aviso_id.in_(avisos)), lote)
+    apagar_em_lotes(Curtida, Curtida.aviso_id.in_(avisos), lote)
+    apagar_em_lotes(Aviso, condicao, lote)
+
+def recontar_curtidas(linhas):
+    recontar_contadores({l.evento_id for l in linhas if l.evento_id}, {l.aviso_id for l in linhas if l.aviso_id})
+
+def purgar_membros(ids, lote):
+    fotos = []
+    apagar_em_lotes(Curtida, Curtida.membro_id.in_(ids), lote, (Curtida.evento_id, Curtida.aviso_id), recontar_curtidas)
+    apagar_em_lotes(CurtidaComentario, CurtidaComentario.membro_id.in_(ids), lote, (CurtidaComentario.comentario_id,),
+                    lambda linhas: recontar_contadores(comentario_ids={l.comentario_id for l in linhas}))
+    apagar_comentarios(select(Comentario.id).where(Comentario.membro_id.in_(ids)), lote)
+    apagar_avisos(Aviso.autor_id.in_(ids), lote)
+    apagar_em_lotes(Frequencia, Frequencia.membro_id.in_(ids), lote, (Frequencia.reuniao_id,),
+                    lambda linhas: atualizar_frequencia_semanal(semanas_das_reunioes({l.reuniao_id for l in linhas})))
+    apagar_em_lotes(PedidoOracao, PedidoOracao.membro_id.in_(ids), lote)
+    apagar_em_lotes(Testemunho, Testemunho.membro_id.in_(ids), lote)
+    apagar_em_lotes(Story, Story.autor_id.in_(ids), lote, (Story.foto_url,), lambda linhas: fotos.extend(l.foto_url for l in linhas))
+    apagar_em_lotes(Membro, Membro.id.in_(ids), lote, (Membro.foto_url,), lambda linhas: fotos.extend(l.foto_url for l in linhas))
+    remover_uploads_orfaos(fotos)
+
+def purgar_celulas(ids, lote):
+    fotos = []
+    # Os membros continuam, sem célula (o UPDATE em massa não passa pelo after_flush da busca)
+    membros = [i for (i,) in _todas(select(Membro.id).where(Membro.celula_id.in_(ids)))]
+    for inicio in range(0, len(membros), lote):
+        parte = membros[inicio:inicio + lote]
+        db.session.execute(db.update(Membro).where(Membro.id.in_(parte)).values(celula_id=None)
+                           .execution_options(synchronize_session=False))
+        reindexar_busca(Membro, parte)
+        db.session.commit()
+    apagar_avisos(Aviso.celula_id.in_(ids), lote)
+    reunioes = select(Reuniao.id).where(Reuniao.celula_id.in_(ids))
+    apagar_em_lotes(Frequencia, Frequencia.reuniao_id.in_(reunioes), lote)
+    apagar_em_lotes(Reuniao, Reuniao.celula_id.in_(ids), lote)
+    apagar_em_lotes(PedidoOracao, PedidoOracao.celula_id.in_(ids), lote)
+    apagar_em_lotes(Testemunho, Testemunho.celula_id.in_(ids), lote)
+    apagar_em_lotes(Story, Story.celula_id.in_(ids), lote, (Story.foto_url,), lambda linhas: fotos.extend(l.foto_url for l in linhas))
+    _apagar(FrequenciaSemanal, FrequenciaSemanal.celula_id.in_(ids))
+    _apagar(HierarquiaCelula, HierarquiaCelula.celula_id.in_(ids))
+    apagar_em_lotes(Celula, Celula.id.in_(ids), lote)
+    remover_uploads_orfaos(fotos)
+
+def purgar_eventos(ids, lote):
+    fotos = []
+    apagar_comentarios(select(Comentario.id).where(Comentario.evento_id.in_(ids)), lote)
+    apagar_em_lotes(Curtida, Curtida.evento_id.in_(ids), lote)
+    apagar_em_lotes(Evento, Evento.id.in_(ids), lote, (Evento.foto_url,), lambda linhas: fotos.extend(l.foto_url for l in linhas))
+    remover_uploads_orfaos(fotos)
+
+def purgar_excluidos(lote=EXCLUSAO_PURGA_LOTE):
+    """Apaga de vez as linhas com exclusão lógica e tudo que depende delas. Cada etapa apaga no
+    máximo `lote` linhas por transação; se for interrompida, a próxima execução continua.
+    Retorna {tabela: linhas excluídas removidas}."""
+    totais = {}
+    for modelo, purgar in ((Evento, purgar_eventos), (Membro, purgar_membros), (Celula, purgar_celulas)):
+        total = 0
+        while True:
+            ids = [i for (i,) in _todas(select(modelo.id).where(modelo.excluido_em.isnot(None))
+                                        .order_by(modelo.excluido_em, modelo.id).limit(lote))]
+            if not ids:
+                break
+            purgar(ids, lote)
+            total += len(ids)
+            if len(ids) < lote:
+                break
+        totais[modelo.__tablename__] = total
+    return totais
+
+purga_pendente = threading.Event()
+purga_thread = None
+
+def agendar_purga():
+    # A thread sobe na primeira exclusão (depois do fork do gunicorn), uma por processo; cada
+    # exclusão a acorda e, sem exclusões, ela confere a cada EXCLUSAO_PURGA_MIN minutos (0 desliga)
+    global purga_thread
+    if EXCLUSAO_PURGA_MIN <= 0:
+        return
+    purga_pendente.set()
+    if purga_thread and purga_thread.is_alive():
+        return
+
+    def loop():
+        while True:
+            purga_pendente.wait(EXCLUSAO_PURGA_MIN * 60)
+            purga_pendente.clear()
+            try:
+                with app.app_context():
+                    totais = purgar_excluidos()
+                    if any(totais.values()):
+                        print(f"Exclusões purgadas: {totais}")
+                    db.session.remove()
+            except Exception as e:
+                print(f"Erro na purga de exclusões: {e}")
+
+    purga_thread = threading.Thread(target=loop, daemon=True)
+    purga_thread.start()
+
+# --- VERSÕES DAS TABELAS E GET CONDICIONAL (ETag / Last-Modified) ---
+
+def _registrar_tabelas(session, nomes):
+    session.info.setdefault('tabelas_alteradas', set()).update(nomes)
+
+@event.listens_for(Session, 'after_flush')
+def _tabelas_do_flush(session, flush_context):
+    nomes = {obj.__table__.name for obj in session.new | session.deleted}
+    nomes |= {obj.__table__.name for obj in session.dirty if session.is_modified(obj)}
+    _registrar_tabelas(session, nomes)
+
+@event.listens_for(Session, 'do_orm_execute')
+def _tabelas_em_massa(orm_execute_state):
+    # Query.update/delete e inserts em lote não passam pelo flush
+    if orm_execute_state.is_update or orm_execute_state.is_delete or orm_execute_state.is_insert:
+        tabela = getattr(orm_execute_state.statement, 'table', None)
+        if tabela is not None:
+            _registrar_tabelas(orm_execute_state.session, {tabela.name})
+
+@event.listens_for(Session, 'after_rollback')
+def _descartar_tabelas(session):
+    session.info.pop('tabelas_alteradas', None)
+
+@event.listens_for(Session, 'after_commit')
+def _publicar_alteracoes(session):
+    nomes = session.info.pop('tabelas_alteradas', None)
+    if nomes:
+        incrementar_versoes(nomes)
+        cache_respostas.invalidar_tags(nomes)
+
+def incrementar_versoes(nomes):
+    """Incrementa a versão das tabelas (conexão própria, logo após o commit)."""
+    nomes = sorted(set(nomes) - {VersaoTabela.__tablename__, EventoStream.__tablename__, GeoCache.__tablename__})
+    if not nomes:
+        return
+    t = VersaoTabela.__table__
+    agora = datetime.utcnow()
+    try:
+        with db.engine.begin() as conn:
+            existentes = {n for (n,) in conn.execute(select(t.c.tabela).where(t.c.tabela.in_(nomes)))}
+            conn.execute(t.update().where(t.c.tabela.in_(nomes))
+                .values(versao=t.c.versao + 1, atualizado_em=agora))
+            novos = [{"tabela": n, "versao": 1, "atualizado_em": agora} for n in nomes if n not in existentes]
+            if novos:
+                conn.execute(t.insert(), novos)
+    except Exception as e:
+        # Nunca derruba a escrita principal (ex: migração ainda não rodada)
+        print(f"Erro ao atualizar versoes {nomes}: {e}")
+
+def versoes_tabelas(nomes):
+    """{tabela: (versao, atualizado_em)} numa única consulta."""
+    linhas = db.session.query(VersaoTabela.tabela, VersaoTabela.versao, VersaoTabela.atualizado_em) \
+        .filter(VersaoTabela.tabela.in_(nomes)).all()
+    return {tabela: (versao, atualizado_em) for tabela, versao, atualizado_em in linhas}
+
+def versoes_da_requisicao(nomes):
+    """versoes_tabelas lido uma única vez por requisição, para que condicional e
+    cache_resposta enxerguem exatamente as mesmas versões."""
+    chave = tuple(sorted(nomes))
+    lidas = g.setdefault('versoes_lidas', {})
+    if chave not in lidas:
+        lidas[chave] = versoes_tabelas(chave)
+    return lidas[chave]
+
+def chave_versionada(nomes, versoes):
+    # A resposta varia com a URL, com quem pede (curtido_por_mim) e com a versão das tabelas
+    return '|'.join([request.full_path, str(usuario_atual_id() or '')] +
+                    [f"{n}:{versoes.get(n, (0, None))[0]}" for n in sorted(nomes)])
+
+def condicional(*modelos):
+    """GET condicional para listagens: gera ETag forte e Last-Modified a partir da versão das
+    tabelas das quais a resposta depende e responde 304 antes de consultar/serializar qualquer coisa."""
+    nomes = sorted(m.__tablename__ for m in modelos)
+
+    def decorator(f):
+        @wraps(f)
+        def wrapper(*args, **kwargs):
+            if request.method != 'GET':
+                return f(*args, **kwargs)
+            try:
+                versoes = versoes_da_requisicao(nomes)
+            except Exception:
+                db.session.rollback()
+                return f(*args, **kwargs)
+
+            etag = hashlib.sha1(chave_versionada(nomes, versoes).encode()).hexdigest()
+            datas = [d for _, d in versoes.values() if d]
+            ultima = max(datas).replace(microsecond=0) if datas else None
+
+            if request.if_none_match:
+                nao_modificado = request.if_none_match.contains(etag)
+            else:
+                nao_modificado = bool(ultima and request.if_modified_since and
+                                      ultima <= request.if_modified_since.replace(tzinfo=None))
+            if nao_modificado:
+                resp = make_response('', 304)
+            else:
+                resp = make_response(f(*args, **kwargs))
+                if resp.status_code != 200:
+                    return resp
+            resp.set_etag(etag)
+            if ultima:
+                resp.last_modified = ultima
+            resp.headers['Cache-Control'] = 'no-cache'
+            resp.vary.add('User-Id')
+            resp.vary.add('Authorization')
+            return resp
+        return wrapper
+    return decorator
+
+# --- CACHE DE RESPOSTAS (dados de referência) ---
+# Redes, gerações, escolas, estudos e células mudam poucas vezes por mês mas são lidos a
+# cada abertura do app. As respostas ficam em cache com as tabelas como tags e são
+# invalidadas no commit que altera alguma delas (ver _publicar_alteracoes).
+# A chave também leva a versão das tabelas (versao_tabela), lida antes de montar a
+# resposta: um worker que não recebeu a invalidação, ou uma leitura que cruzou com um
+# commit, passa a procurar outra chave em vez de servir o corpo antigo com ETag nova.
+# Por isso o backend em memória é seguro com vários workers; só ocupa mais memória.
+#   CACHE_BACKEND=memoria  LRU com TTL no próprio processo (padrão)
+#   CACHE_BACKEND=arquivo  SQLite local compartilhado entre os workers do gunicorn
+#   CACHE_BACKEND=nenhum   desliga o cache
+CACHE_BACKEND = os.environ.get('CACHE_BACKEND', 'memoria')
+CACHE_TTL = int(os.environ.get('CACHE_TTL', '300'))
+
+class CacheMemoria:
+    nome = 'memoria'
+
+    def __init__(self, max_itens=512):
+        self.max_itens = max_itens
+        self.itens = OrderedDict() # chave -> (expira, tags, valor)
+        self.lock = threading.Lock()
+        self.hits = self.misses = self.invalidacoes = 0
+
+    def get(self, chave):
+        with self.lock:
+            item = self.itens.get(chave)
+            if item is None or item[0] < time.time():
+                self.itens.pop(chave, None)
+                self.misses += 1
+                return None
+            self.itens.move_to_end(chave)
+            self.hits += 1
+            return item[2]
+
+    def set(self, chave, valor, tags, ttl=CACHE_TTL):
+        with self.lock:
+            self.itens[chave] = (time.time() + ttl, set(tags), valor)
+            self.itens.move_to_end(chave)
+            while len(self.itens) > self.max_itens:
+                self.itens.popitem(last=False)
+
+    def invalidar_tags(self, tags):
+        tags = set(tags)
+        with self.lock:
+            chaves = [c for c, (_, t, _) in self.itens.items() if t & tags]
+            for c in chaves:
+                del self.itens[c]
+            self.invalidacoes += len(chaves)
+
+    def total_itens(self):
+        return len(self.itens)
+
+class CacheArquivo:
+    """Cache em arquivo SQLite: visível para todos os workers da mesma máquina,
+    então a invalidação feita por um worker vale para os outros."""
+    nome = 'arquivo'
+
+    def __init__(self, caminho):
+        self.caminho = caminho
+        self.hits = self.misses = self.invalidacoes = 0
+        with self._conectar() as conn, conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("CREATE TABLE IF NOT EXISTS entrada (chave TEXT PRIMARY KEY, valor BLOB, expira REAL)")
+            conn.execute("CREATE TABLE IF NOT EXISTS entrada_tag (tag TEXT, chave TEXT)")
+            conn.execute("CREATE INDEX IF NOT EXISTS ix_entrada_tag ON entrada_tag (tag)")
+
+    def _conectar(self):
+        # closing fecha a conexão; o "with conn" interno só faz commit/rollback
+        return closing(sqlite3.connect(self.caminho, timeout=5))
+
+    def get(self, chave):
+        with self._conectar() as conn:
+            linha = conn.execute("SELECT valor FROM entrada WHERE chave = ? AND expira >= ?", (chave, time.time())).fetchone()
+        if linha is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return json.loads(linha[0])
+
+    def set(self, chave, valor, tags, ttl=CACHE_TTL):
+        with self._conectar() as conn, conn:
+            conn.execute("INSERT OR REPLACE INTO entrada (chave, valor, expira) VALUES (?, ?, ?)",
+                         (chave, json.dumps(valor), time.time() + ttl))
+            conn.execute("DELETE FROM entrada_tag WHERE chave = ?", (chave,))
+            conn.executemany("INSERT INTO entrada_tag (tag, chave) VALUES (?, ?)", [(t, chave) for t in tags])
+            # Faxina das entradas vencidas
+            conn.execute("DELETE FROM entrada WHERE expira < ?", (time.time(),))
+
+    def invalidar_tags(self, tags):
+        tags = list(tags)
+        marcadores = ','.join('?' * len(tags))
+        with self._conectar() as conn, conn:
+            cur = conn.execute(f"DELETE FROM entrada WHERE chave IN (SELECT chave FROM entrada_tag WHERE tag IN ({marcadores}))", tags)
+            conn.execute(f"DELETE FROM entrada_tag WHERE tag IN ({marcadores})", tags)
+        self.invalidacoes += cur.rowcount
+
+    def total_itens(self):
+        with self._conectar() as conn:
+            return conn.execute("SELECT COUNT(*) FROM entrada").fetchone()[0]
+
+class CacheDesligado:
+    nome = 'nenhum'
+    hits = misses = invalidacoes = 0
+    def get(self, chave): return None
+    def set(self, chave, valor, tags, ttl=CACHE_TTL): pass
+    def invalidar_tags(self, tags): pass
+    def total_itens(self): return 0
+
+def criar_cache(backend):
+    if backend == 'arquivo':
+        os.makedirs(app.instance_path, exist_ok=True)
+        return CacheArquivo(os.environ.get('CACHE_ARQUIVO', os.path.join(app.instance_path, 'cache_respostas.db')))
+    if backend == 'nenhum':
+        return CacheDesligado()
+    return CacheMemoria()
+
+cache_respostas = criar_cache(CACHE_BACKEND)
+
+def cache_resposta(*modelos):
+    """Guarda a resposta do GET (200) com as tabelas de `modelos` como tags."""
+    tags = [m.__tablename__ for m in modelos]
+
+    def decorator(f):
+        @wraps(f)
+        def wrapper(*args, **kwargs):
+            if request.method != 'GET':
+                return f(*args, **kwargs)
+            try:
+                versoes = versoes_da_requisicao(tags)
+            except Exception:
+                # Sem versão não dá para garantir que o corpo guardado é o atual
+                db.session.rollback()
+                return f(*args, **kwargs)
+            chave = chave_versionada(tags, versoes)
+            valor = cache_respostas.get(chave)
+            if valor is not None:
+                return Response(valor['corpo'], status=200, mimetype=valor['mimetype'])
+
+            resp = make_response(f(*args, **kwargs))
+            if resp.status_code == 200 and not resp.is_streamed:
+                cache_respostas.set(chave, {"corpo": resp.get_data(as_text=True), "mimetype": resp.mimetype}, tags)
+            return resp
+        return wrapper
+    return decorator
+
+@app.route('/api/cache/stats', methods=['GET'])
+def cache_stats():
+    # Contadores do processo atual (cada worker tem os seus)
+    return jsonify({
+        "backend": cache_respostas.nome,
+        "hits": cache_respostas.hits,
+        "misses": cache_respostas.misses,
+        "invalidacoes": cache_respostas.invalidacoes,
+        "itens": cache_respostas.total_itens(),
+        "pid": os.getpid()
+    })
+
+# --- HELPERS DE CONSULTA ---
+
+class ParametroInvalido(Exception):
+    """Parâmetro de query string inválido; vira uma resposta 400 com {"erro": ...}."""
+    pass
+
+@app.errorhandler(ParametroInvalido)
+def handle_parametro_invalido(e):
+    return jsonify({"erro": str(e)}), 400
+
+def parametro_int(nome, padrao=None, minimo=None, maximo=None):
+    """Lê um inteiro da query string, limitado a [minimo, maximo]."""
+    valor = request.args.get(nome)
+    if valor is None or valor == '':
+        return padrao
+    try:
+        valor = int(valor)
+    except ValueError:
+        raise ParametroInvalido(f"{nome} deve ser numerico")
+    if minimo is not None: valor = max(minimo, valor)
+    if maximo is not None: valor = min(maximo, valor)
+    return valor
+
+def parametro_float(nome, padrao=None, minimo=None, maximo=None):
+    """Lê um número decimal da query string, limitado a [minimo, maximo]."""
+    valor = request.args.get(nome)
+    if valor is None or valor == '':
+        return padrao
+    try:
+        valor = float(valor)
+    except ValueError:
+        raise ParametroInvalido(f"{nome} deve ser numerico")
+    if not math.isfinite(valor):
+        raise ParametroInvalido(f"{nome} deve ser numerico")
+    if minimo is not None: valor = max(minimo, valor)
+    if maximo is not None: valor = min(maximo, valor)
+    return valor
+
+FEED_LIMIT_PADRAO = 20
+FEED_LIMIT_MAXIMO = 100
+
+def codificar_cursor(data_criacao, item_id):
+    bruto = f"{data_criacao.isoformat()}|{item_id}".encode()
+    return base64.urlsafe_b64encode(bruto).decode().rstrip('=')
+
+def decodificar_cursor(cursor):
+    try:
+        bruto = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+        data_str, item_id = bruto.rsplit('|', 1)
+        return datetime.fromisoformat(data_str), int(item_id)
+    except (ValueError, UnicodeDecodeError):
+        raise ParametroInvalido("Cursor invalido")
+
+def feed_paginado():
+    return 'limit' in request.args or 'cursor' in request.args
+
+def paginar_feed(query, modelo, campos=None):
+    """Ordena o feed por (data_criacao, id) desc. Com ?limit/?cursor aplica paginação
+    keyset: a página N custa o mesmo que a primeira (usa os índices data_criacao/id).
+    Com campos (?fields=) só carrega as colunas da projeção. Retorna (itens, next_cursor)."""
+    query = aplicar_campos(query, modelo, campos, modelo.data_criacao)
+    query = query.order_by(modelo.data_criacao.desc(), modelo.id.desc())
+    if not feed_paginado():
+        return query.all(), None
+
+    limit = parametro_int('limit', FEED_LIMIT_PADRAO, 1, FEED_LIMIT_MAXIMO)
+
+    cursor = request.args.get('cursor')
+    if cursor:
+        data_cursor, id_cursor = decodificar_cursor(cursor)
+        query = query.filter(db.or_(
+            modelo.data_criacao < data_cursor,
+            db.and_(modelo.data_criacao == data_cursor, modelo.id < id_cursor)
+        ))
+
+    itens = query.limit(limit + 1).all()
+    next_cursor = None
+    if len(itens) > limit:
+        itens = itens[:limit]
+        next_cursor = codificar_cursor(itens[-1].data_criacao, itens[-1].id)
+    return itens, next_cursor
+
+def resposta_feed(dados, next_cursor):
+    # Sem limit/cursor mantém o formato antigo (lista pura) para os clientes atuais
+    if not feed_paginado():
+        return jsonify(dados)
+    return jsonify({"itens": dados, "next_cursor": next_cursor})
+
+def parametro_include(padrao=('membros',)):
+    """Lê ?include=a,b. Sem o parâmetro, mantém as expansões padrão (compatibilidade).
+    Ex: /api/celulas?include= devolve as células sem a lista de membros."""
+    if 'include' not in request.args:
+        return set(padrao)
+    return {p.strip() for p in request.args['include'].split(',') if p.strip()}
+
+def query_celulas(incluir_membros=True, campos=None):
+    """Query de células com rede/geração (e membros, se pedido) carregados em lote,
+    evitando 1 + 3N consultas na serialização. Com campos (?fields=), só carrega as
+    colunas e relacionamentos que a projeção usa."""
+    query = aplicar_campos(Celula.query, Celula, campos)
+    if quer(campos, "rede"):
+        query = query.options(joinedload(Celula.rede_obj))
+    if quer(campos, "geracao"):
+        query = query.options(joinedload(Celula.geracao))
+    if incluir_membros and quer(campos, "membros"):
+        campos_membros = subcampos(campos, "membros")
+        carregar = selectinload(Celula.membros)
+        if campos_membros is not None:
+            Membro.validar_campos(campos_membros)
+            # celula_id é necessário para agrupar os membros por célula
+            carregar = carregar.load_only(Membro.id, Membro.celula_id, *Membro.colunas_json(campos_membros))
+        query = query.options(carregar)
+    return query
+
+THREAD_MAX_DEPTH_PADRAO = 5
+THREAD_MAX_DEPTH_LIMITE = 20
+THREAD_LIMITE_RESPOSTAS_PADRAO = 20
+
+def arvore_thread(evento_id=None, aviso_id=None, raiz_id=None, limite=None, offset=0,
+                  max_depth=THREAD_MAX_DEPTH_PADRAO, limite_respostas=THREAD_LIMITE_RESPOSTAS_PADRAO):
+    """CTE recursiva (id, nivel) com os comentários de uma thread.
+
+    Os nós do nível 0 são os comentários raiz do evento/aviso (mais novos primeiro) ou,
+    com raiz_id, as respostas desse comentário (mais antigas primeiro). A CTE desce até
+    max_depth níveis trazendo no máximo limite_respostas respostas por nó;
+    "total_respostas" indica quando existem mais para buscar em /api/comentarios/<id>/respostas.
+    A CTE é Core (o filtro global de exclusão não entra nela): comentários excluídos são
+    tirados aqui, para não ocuparem lugar na paginação nem no limite de respostas.
+    """
+    c = Comentario.__table__
+    visivel = c.c.excluido_em.is_(None)
+
+    if raiz_id is not None:
+        raiz = c.alias('raiz')
+        da_thread = db.or_(
+            c.c.evento_id == select(raiz.c.evento_id).where(raiz.c.id == raiz_id).scalar_subquery(),
+            c.c.aviso_id == select(raiz.c.aviso_id).where(raiz.c.id == raiz_id).scalar_subquery())
+        ancora = select(c.c.id).where(c.c.parent_id == raiz_id, visivel) \
+            .order_by(c.c.data_criacao.asc(), c.c.id.asc())
+    else:
+        da_thread = c.c.evento_id == evento_id if evento_id is not None else c.c.aviso_id == aviso_id
+        ancora = select(c.c.id).where(c.c.parent_id.is_(None), visivel, da_thread) \
+            .order_by(c.c.data_criacao.desc(), c.c.id.desc())
+    if limite is not None:
+        ancora = ancora.limit(limite)
+    if offset:
+        ancora = ancora.offset(offset)
+
+    arvore = select(c.c.id, literal(0).label('nivel')) \
+        .where(c.c.id.in_(ancora)).cte('arvore', recursive=True)
+
+    # Respostas: só as primeiras `limite_respostas` de cada pai (posição entre os irmãos
+    # visíveis, numeradas uma vez para a thread toda). Respostas têm o evento/aviso do pai.
+    respostas = select(
+        c.c.id, c.c.parent_id,
+        func.row_number().over(partition_by=c.c.parent_id, order_by=(c.c.data_criacao, c.c.id)).label('posicao')
+    ).where(c.c.parent_id.isnot(None), visivel, da_thread).subquery('respostas')
+    arvore = arvore.union_all(
+        select(respostas.c.id, arvore.c.nivel + 1)
+        .join(arvore, respostas.c.parent_id == arvore.c.id)
+        .where(arvore.c.nivel < max_depth, respostas.c.posicao <= limite_respostas)
+    )
+    return arvore
+
+def ordenar_thread(linhas, raiz_id=None):
+    """Recebe pares (comentário, nivel) e devolve (raizes, filhos por parent_id) já ordenados.
+    Serve tanto para objetos do ORM quanto para linhas com id/parent_id/data_criacao."""
+    filhos = {}
+    for com, nivel in linhas:
+        if nivel > 0:
+            filhos.setdefault(com.parent_id, []).append(com)
+    for respostas in filhos.values():
+        respostas.sort(key=lambda r: (r.data_criacao, r.id))
+
+    raizes = [com for com, nivel in linhas if nivel == 0]
+    if raiz_id is not None:
+        raizes.sort(key=lambda r: (r.data_criacao, r.id))
+    else:
+        raizes.sort(key=lambda r: (r.data_criacao, r.id), reverse=True)
+    return raizes, filhos
+
+def carregar_thread(evento_id=None, aviso_id=None, raiz_id=None, current_user_id=None, campos=None, **params):
+    """Carrega uma thread de comentários inteira em duas consultas (ver arvore_thread)."""
+    arvore = arvore_thread(evento_id, aviso_id, raiz_id, **params)
+
+    # 1. Comentários + autores
+    query = db.session.query(Comentario, arvore.c.nivel).join(arvore, Comentario.id == arvore.c.id)
+    # parent_id/data_criacao montam e ordenam a árvore mesmo com ?fields=
+    query = aplicar_campos(query, Comentario, campos, Comentario.parent_id, Comentario.data_criacao)
+    if quer(campos, "autor_nome") or quer(campos, "autor_foto"):
+        query = query.options(joinedload(Comentario.autor))
+    linhas = query.all()
+    if not linhas:
+        return []
+    ids = [com.id for com, _ in linhas]
+
+    # 2. Quais o usuário atual curtiu (totais de curtidas/respostas são colunas)
+    curtidos = ids_curtidos(CurtidaComentario.comentario_id, current_user_id, ids) \
+        if current_user_id and quer(campos, "curtido_por_mim") else set()
+
+    # Monta a árvore em memória
+    raizes, filhos = ordenar_thread(linhas, raiz_id)
+
+    def montar(com):
+        respostas = [montar(r) for r in filhos.get(com.id, [])]
+        return com.to_json(current_user_id, respostas=respostas, curtidos=curtidos, campos=campos)
+
+    return [montar(com) for com in raizes]
+
+def parametros_thread():
+    return {
+        "limite": parametro_int('limite', None, 1, FEED_LIMIT_MAXIMO),
+        "offset": parametro_int('offset', 0, 0),
+        "max_depth": parametro_int('max_depth', THREAD_MAX_DEPTH_PADRAO, 0, THREAD_MAX_DEPTH_LIMITE),
+        "limite_respostas": parametro_int('limite_respostas', THREAD_LIMITE_RESPOSTAS_PADRAO, 1, FEED_LIMIT_MAXIMO),
+        "campos": parametro_fields(Comentario),
+    }
+
+# --- JSON MONTADO NO BANCO (PostgreSQL) ---
+# Nas leituras mais pesadas (célula com membros, feeds de avisos, threads de comentários) o
+# PostgreSQL monta o documento com json_build_object/json_agg e a resposta sai como veio,
+# sem hidratar objetos do ORM. Em SQLite (ou com JSON_NO_BANCO=0) segue pelo to_json.
+# As expressões espelham o CAMPOS_JSON de cada modelo; tests/test_json_banco.py compara as saídas.
+app.config['JSON_NO_BANCO'] = os.environ.get('JSON_NO_BANCO', '1') != '0'
+
+def json_no_banco():
+    return app.config['JSON_NO_BANCO'] and db.engine.dialect.name == 'postgresql'
+
+def data_hora_curta(coluna):
+    # Mesmo formato do strftime('%d/%m %H:%M') dos to_json
+    return func.to_char(coluna, 'DD/MM HH24:MI')
+
+def campos_sql(modelo, **calculados):
+    """Expressão SQL de cada campo de CAMPOS_JSON: a coluna de mesmo nome ou a calculada."""
+    return {nome: calculados[nome] if nome in calculados else getattr(modelo, nome) for nome in modelo.CAMPOS_JSON}
+
+def objeto_json(expressoes, campos=None):
+    # Chaves em ordem alfabética, como no jsonify
+    pares = []
+    for nome in sorted(expressoes):
+        if quer(campos, nome):
+            pares += [literal(nome), expressoes[nome]]
+    return func.json_build_object(*pares)
+
+def lista_json(objeto, *ordem):
+    return func.coalesce(func.json_agg(aggregate_order_by(objeto, *ordem)), cast(literal('[]'), db.JSON))
+
+def texto_json(expressao):
+    # Como texto, o driver não decodifica o JSON: a string vai direto para a resposta
+    return cast(expressao, db.Text).label('json')
+
+def autor_sql(coluna_autor, coluna):
+    return select(coluna).where(Membro.id == coluna_autor).scalar_subquery()
+
+def celula_json(celula_id, incluir_membros=True, campos=None):
+    expressoes = campos_sql(Celula,
+        rede=case((Rede.id.isnot(None), Rede.nome), else_=func.coalesce(func.nullif(Celula.rede_str, ''), 'Sem Rede')),
+        geracao=case((Geracao.id.isnot(None), Geracao.nome), else_='Sem Geração'),
+        # f-string do to_json: valores nulos aparecem como "None"
+        formatted_address=func.concat(*[
+            parte if isinstance(parte, str) else func.coalesce(parte, 'None')
+            for parte in (Celula.endereco, ', ', Celula.numero, ' - ', Celula.bairro, ', ', Celula.cidade, '/', Celula.estado)
+        ]))
+    if incluir_membros and quer(campos, "membros"):
+        membro = objeto_json(campos_sql(Membro), subcampos(campos, "membros"))
+        expressoes["membros"] = select(lista_json(membro, Membro.id)) \
+            .where(Membro.celula_id == Celula.id).scalar_subquery()
+    consulta = select(texto_json(objeto_json(expressoes, campos))).select_from(Celula) \
+        .outerjoin(Rede, Rede.id == Celula.rede_id) \
+        .outerjoin(Geracao, Geracao.id == Celula.geracao_id) \
+        .where(Celula.id == celula_id)
+    return db.session.execute(consulta).scalar()
+
+def aviso_json(current_user_id=None, campos=None):
+    expressoes = campos_sql(Aviso,
+        data=data_hora_curta(Aviso.data_criacao),
+        autor_nome=autor_sql(Aviso.autor_id, Membro.nome),
+        total_curtidas=func.coalesce(Aviso.total_curtidas, 0),
+        total_comentarios=func.coalesce(Aviso.total_comentarios, 0))
+    if current_user_id and quer(campos, "curtido_por_mim"):
+        expressoes["curtido_por_mim"] = select(Curtida.id) \
+            .where(Curtida.aviso_id == Aviso.id, Curtida.membro_id == current_user_id).exists()
+    return objeto_json(expressoes, campos)
+
+def resposta_feed_json(query, modelo, objeto):
+    """Feed (mesma paginação do paginar_feed) com cada item já serializado pelo banco."""
+    itens, next_cursor = paginar_feed(query.with_entities(texto_json(objeto), modelo.data_criacao, modelo.id), modelo)
+    corpo = '[' + ','.join(item.json for item in itens) + ']'
+    if feed_paginado():
+        corpo = '{"itens": ' + corpo + ', "next_cursor": ' + json.dumps(next_cursor) + '}'
+    return Response(corpo, mimetype='application/json')
+
+def carregar_thread_json(evento_id=None, aviso_id=None, raiz_id=None, current_user_id=None, campos=None, **params):
+    """Mesma thread do carregar_thread, com cada comentário montado pelo banco. As respostas
+    são encaixadas no texto de cada pai, sem decodificar o JSON."""
+    arvore = arvore_thread(evento_id, aviso_id, raiz_id, **params)
+    expressoes = campos_sql(Comentario,
+        data=data_hora_curta(Comentario.data_criacao),
+        autor_nome=autor_sql(Comentario.membro_id, Membro.nome),
+        autor_foto=autor_sql(Comentario.membro_id, Membro.foto_url),
+        total_curtidas=func.coalesce(Comentario.total_curtidas, 0),
+        total_respostas=func.coalesce(Comentario.total_respostas, 0))
+    if current_user_id and quer(campos, "curtido_por_mim"):
+        expressoes["curtido_por_mim"] = select(CurtidaComentario.id).where(
+            CurtidaComentario.comentario_id == Comentario.id, CurtidaComentario.membro_id == current_user_id).exists()
+
+    linhas = db.session.execute(
+        select(Comentario.id, Comentario.parent_id, Comentario.data_criacao, arvore.c.nivel,
+               texto_json(objeto_json(expressoes, campos)))
+        .join(arvore, Comentario.id == arvore.c.id)
+    ).all()
+    raizes, filhos = ordenar_thread([(linha, linha.nivel) for linha in linhas], raiz_id)
+    com_respostas = quer(campos, "respostas")
+
+    def montar(linha):
+        if not com_respostas:
+            return linha.json
+        respostas = '"respostas" : [' + ','.join(montar(r) for r in filhos.get(linha.id, [])) + ']}'
+        return '{' + respostas if linha.json.rstrip() == '{}' else linha.json.rstrip()[:-1] + ', ' + respostas
+
+    return '[' + ','.join(montar(linha) for linha in raizes) + ']'
+
+def resposta_thread(**kwargs):
+    if json_no_banco():
+        return Response(carregar_thread_json(**kwargs), mimetype='application/json')
+    return jsonify(carregar_thread(**kwargs))
+
+# --- CURTIDAS E CONTADORES ---
+
+def ids_curtidos(coluna_alvo, membro_id, alvo_ids):
+    """Resolve numa única consulta quais alvos (eventos, avisos ou comentários) o membro curtiu.
+    Ex: ids_curtidos(Curtida.aviso_id, 5, [1, 2, 3]) -> {2}"""
+    alvo_ids = list(alvo_ids)
+    if not membro_id or not alvo_ids:
+        return set()
+    modelo = coluna_alvo.class_
+    return {alvo_id for (alvo_id,) in db.session.query(coluna_alvo)
+        .filter(coluna_alvo.in_(alvo_ids), modelo.membro_id == membro_id)}
+
+def incrementar(modelo, alvo_id, **deltas):
+    """UPDATE atômico de contadores: incrementar(Evento, 1, total_curtidas=1)."""
+    valores = {getattr(modelo, campo): getattr(modelo, campo) + delta for campo, delta in deltas.items() if delta}
+    if valores:
+        modelo.query.filter(modelo.id == alvo_id).update(valores, synchronize_session=False)
+
+# tipo -> (modelo da curtida, coluna do alvo, modelo do alvo)
+ALVOS_CURTIDA = {
+    'evento': (Curtida, 'evento_id', Evento),
+    'aviso': (Curtida, 'aviso_id', Aviso),
+    'comentario': (CurtidaComentario, 'comentario_id', Comentario),
+}
+
+def curtida_existe(tipo, alvo_id, membro_id):
+    modelo_curtida, campo_alvo, _ = ALVOS_CURTIDA[tipo]
+    return db.session.query(
+        modelo_curtida.query.filter_by(**{campo_alvo: alvo_id, 'membro_id': membro_id}).exists()
+    ).scalar()
+
+def total_curtidas(tipo, alvo_id):
+    modelo_alvo = ALVOS_CURTIDA[tipo][2]
+    return db.session.query(modelo_alvo.total_curtidas).filter(modelo_alvo.id == alvo_id).scalar() or 0
+
+def aplicar_curtidas(tipo, estados):
+    """Aplica em lote o estado desejado das curtidas: {(alvo_id, membro_id): curtido}.
+
+    Idempotente (curtir o que já está curtido não faz nada) e com operações por conjunto:
+    uma leitura dos pares existentes, um DELETE, um INSERT em lote e um UPDATE de
+    contador por alvo. Não faz commit. Retorna {alvo_id: variação do total}."""
+    if not estados:
+        return {}
+    modelo_curtida, campo_alvo, modelo_alvo = ALVOS_CURTIDA[tipo]
+    coluna_alvo = getattr(modelo_curtida, campo_alvo)
+
+    alvo_ids = {alvo_id for alvo_id, _ in estados}
+    membro_ids = {membro_id for _, membro_id in estados}
+    existentes = {(alvo_id, membro_id): cid for cid, alvo_id, membro_id in db.session.query(
+        modelo_curtida.id, coluna_alvo, modelo_curtida.membro_id
+    ).filter(coluna_alvo.in_(alvo_ids), modelo_curtida.membro_id.in_(membro_ids))}
+
+    variacao = {}
+    remover = [existentes[par] for par, curtido in estados.items() if not curtido and par in existentes]
+    inserir = [par for par, curtido in estados.items() if curtido and par not in existentes]
+
+    if remover:
+        modelo_curtida.query.filter(modelo_curtida.id.in_(remover)).delete(synchronize_session=False)
+        for par, curtido in estados.items():
+            if not curtido and par in existentes:
+                variacao[par[0]] = variacao.get(par[0], 0) - 1
+    if inserir:
+        db.session.execute(modelo_curtida.__table__.insert(), [
+            {campo_alvo: alvo_id, 'membro_id': membro_id} for alvo_id, membro_id in inserir
+        ])
+        for alvo_id, _ in inserir:
+            variacao[alvo_id] = variacao.get(alvo_id, 0) + 1
+
+    for alvo_id, delta in variacao.items():
+        incrementar(modelo_alvo, alvo_id, total_curtidas=delta)
+    return variacao
+
+def alternar_curtida(tipo, alvo_id, membro_id):
+    """Curte/descurte e ajusta o contador do alvo na mesma transação.
+    Retorna (action, total)."""
+    curtido = not curtida_existe(tipo, alvo_id, membro_id)
+    action = "curtiu" if curtido else "descurtiu"
+    try:
+        variacao = aplicar_curtidas(tipo, {(alvo_id, membro_id): curtido})
+        publicar_curtidas(tipo, [alvo for alvo, delta in variacao.items() if delta])
+        db.session.commit()
+    except IntegrityError:
+        # Toque duplo simultâneo: a outra requisição já gravou a curtida
+        db.session.rollback()
+
+    return action, total_curtidas(tipo, alvo_id)
+
+# --- BUFFER DE CURTIDAS (write-behind) ---
+# Em cultos ao vivo centenas de toques chegam no mesmo aviso/evento em segundos.
+# Com CURTIDAS_BUFFER_MS > 0 os toques ficam em memória (coalescidos por alvo/membro)
+# e são gravados em lote a cada N ms, devolvendo na hora uma contagem otimista.
+CURTIDAS_BUFFER_MS = int(os.environ.get('CURTIDAS_BUFFER_MS', '0'))
+
+class BufferCurtidas:
+    def __init__(self, intervalo_ms):
+        self.intervalo = intervalo_ms / 1000.0
+        self.lock = threading.Lock()
+        self.pendentes = {}   # (tipo, alvo_id, membro_id) -> estado desejado
+        self.originais = {}   # (tipo, alvo_id, membro_id) -> estado no banco quando entrou no buffer
+        self.deltas = {}      # (tipo, alvo_id) -> variação ainda não gravada
+        self.em_voo = {}      # mesmo formato de pendentes, durante o flush
+        self.deltas_em_voo = {}
+        self.thread = None
+
+    def _iniciar(self):
+        # Sobe a thread no primeiro uso (depois do fork do gunicorn)
+        if self.thread is None or not self.thread.is_alive():
+            self.thread = threading.Thread(target=self._loop, daemon=True)
+            self.thread.start()
+
+    def _loop(self):
+        while True:
+            time.sleep(self.intervalo)
+            try:
+                with app.app_context():
+                    self.flush()
+            except Exception as e:
+                print(f"Erro ao gravar buffer de curtidas: {e}")
+
+    def alternar(self, tipo, alvo_id, membro_id):
+        chave = (tipo, alvo_id, membro_id)
+        no_banco = None
+        with self.lock:
+            self._iniciar()
+            conhecido = chave in self.pendentes or chave in self.em_voo
+        if not conhecido:
+            no_banco = curtida_existe(tipo, alvo_id, membro_id)
+        with self.lock:
+            if chave in self.pendentes:
+                atual = self.pendentes[chave]
+            elif chave in self.em_voo:
+                # O lote em gravação passa a ser a base desta chave
+                atual = self.originais[chave] = self.em_voo[chave]
+            else:
+                if no_banco is None:
+                    # O flush terminou entre as duas leituras
+                    no_banco = curtida_existe(tipo, alvo_id, membro_id)
+                atual = no_banco
+                self.originais[chave] = no_banco
+            curtido = not atual
+
+            delta = 1 if curtido else -1
+            self.deltas[(tipo, alvo_id)] = self.deltas.get((tipo, alvo_id), 0) + delta
+            if curtido == self.originais[chave]:
+                # Curtiu e descurtiu antes do flush: nada a gravar
+                del self.pendentes[chave]
+                del self.originais[chave]
+            else:
+                self.pendentes[chave] = curtido
+            # Total lido junto com os deltas: o flush grava e zera deltas_em_voo sob o mesmo lock,
+            # então o que já está no banco não é somado duas vezes
+            pendente = self.deltas.get((tipo, alvo_id), 0) + self.deltas_em_voo.get((tipo, alvo_id), 0)
+            total = total_curtidas(tipo, alvo_id)
+
+        action = "curtiu" if curtido else "descurtiu"
+        return action, max(0, total + pendente)
+
+    def flush(self):
+        """Grava tudo que está pendente numa única transação."""
+        with self.lock:
+            if not self.pendentes:
+                # Toques que se anularam (curtiu e descurtiu) deixam só deltas zerados
+                self.deltas = {alvo: delta for alvo, delta in self.deltas.items() if delta}
+                return 0
+            lote, originais = self.pendentes, self.originais
+            self.pendentes, self.originais = {}, {}
+            self.em_voo, self.deltas_em_voo, self.deltas = lote, self.deltas, {}
+
+        por_tipo = {}
+        for (tipo, alvo_id, membro_id), curtido in lote.items():
+            por_tipo.setdefault(tipo, {})[(alvo_id, membro_id)] = curtido
+        try:
+            for tentativa in range(2):
+                try:
+                    for tipo, estados in por_tipo.items():
+                        variacao = aplicar_curtidas(tipo, estados)
+                        publicar_curtidas(tipo, [alvo_id for alvo_id, delta in variacao.items() if delta])
+                    with self.lock:
+                        # Gravado: a partir daqui o total do banco já inclui o lote
+                        db.session.commit()
+                        self.em_voo, self.deltas_em_voo = {}, {}
+                    break
+                except IntegrityError:
+                    # Outro worker gravou os mesmos pares; relê e aplica de novo
+                    db.session.rollback()
+                    if tentativa:
+                        raise
+        except Exception:
+            db.session.rollback()
+            # Devolve o lote ao buffer para a próxima rodada
+            with self.lock:
+                for chave, curtido in lote.items():
+                    original = originais[chave]
+                    curtido = self.pendentes.get(chave, curtido)
+                    if curtido == original:
+                        self.pendentes.pop(chave, None)
+                        self.originais.pop(chave, None)
+                    else:
+                        self.pendentes[chave] = curtido
+                        self.originais[chave] = original
+                for alvo, delta in self.deltas_em_voo.items():
+                    self.deltas[alvo] = self.deltas.get(alvo, 0) + delta
+            raise
+        finally:
+            with self.lock:
+                self.em_voo, self.deltas_em_voo = {}, {}
+        return len(lote)
+
+buffer_curtidas = BufferCurtidas(CURTIDAS_BUFFER_MS) if CURTIDAS_BUFFER_MS > 0 else None
+
+@atexit.register
+def _gravar_buffer_curtidas():
+    if buffer_curtidas:
+        with app.app_context():
+            buffer_curtidas.flush()
+
+def curtir(tipo, alvo_id, membro_id):
+    if buffer_curtidas:
+        return buffer_curtidas.alternar(tipo, alvo_id, membro_id)
+    return alternar_curtida(tipo, alvo_id, membro_id)
+
+# --- AUTENTICAÇÃO (TOKENS ASSINADOS) ---
+# Token = base64url(claims JSON) + "." + base64url(HMAC-SHA256 com SECRET_KEY). As claims
+# trazem id, tipo e célula/geração/rede do membro, então checar papel/escopo não consulta o
+# banco. O token vale TOKEN_VALIDADE_MIN minutos; /api/token/renovar relê o membro e emite
+# outro (até TOKEN_RENOVACAO_DIAS após o login), então mudanças de tipo feitas por
+# update_user_role.py e afins valem em no máximo TOKEN_VALIDADE_MIN.
+# Token inválido ou expirado é 401, sem cair para outra forma de identificação.
+SECRET_KEY = os.environ.get('SECRET_KEY')
+if not SECRET_KEY and database_url.startswith('postgresql'):
+    # Em produção cada worker geraria a própria chave e os tokens falhariam entre eles
+    raise RuntimeError("SECRET_KEY nao definida (obrigatoria em producao)")
+if not SECRET_KEY:
+    # Chave aleatória: tokens só valem neste processo (defina SECRET_KEY com vários workers)
+    print("AVISO: SECRET_KEY nao definida, usando chave temporaria")
+    SECRET_KEY = base64.urlsafe_b64encode(os.urandom(32)).decode()
+app.config['SECRET_KEY'] = SECRET_KEY
+TOKEN_VALIDADE = int(os.environ.get('TOKEN_VALIDADE_MIN', '15')) * 60
+TOKEN_RENOVACAO = int(os.environ.get('TOKEN_RENOVACAO_DIAS', '30')) * 86400
+PAPEIS_LIDERANCA = ('Lider', 'LiderRede', 'LiderGeracao', 'Admin')
+
+# Clientes antigos (User-Id ou o id no corpo, sem token): só com AUTH_LEGADO=1 e até
+# AUTH_LEGADO_ATE. Depois dessa data o caminho some mesmo com a variável ligada.
+AUTH_LEGADO = os.environ.get('AUTH_LEGADO') == '1'
+AUTH_LEGADO_ATE = datetime(2027, 1, 31)
+if AUTH_LEGADO:
+    print(f"AVISO: AUTH_LEGADO ligado, User-Id sem token aceito ate {AUTH_LEGADO_ATE:%d/%m/%Y}")
+
+def legado_permitido():
+    return AUTH_LEGADO and datetime.utcnow() < AUTH_LEGADO_ATE
+
+def _b64(dados):
+    return base64.urlsafe_b64encode(dados).rstrip(b'=').decode()
+
+def _de_b64(texto):
+    return base64.urlsafe_b64decode(texto + '=' * (-len(texto) % 4))
+
+def _assinatura(corpo):
+    return hmac.new(SECRET_KEY.encode(), corpo.encode(), hashlib.sha256).digest()
+
+def claims_do_membro(membro):
+    return {"id": membro.id, "tipo": membro.tipo, "c": membro.celula_id, "g": membro.geracao_id, "r": membro.rede_id}
+
+def emitir_token(membro, login_em=None):
+    """Retorna (token, expira_em em epoch). login_em preserva o início da janela de renovação."""
+    agora = int(time.time())
+    claims = dict(claims_do_membro(membro), iat=login_em or agora, exp=agora + TOKEN_VALIDADE)
+    corpo = _b64(json.dumps(claims, separators=(',', ':')).encode())
+    return f"{corpo}.{_b64(_assinatura(corpo))}", claims['exp']
+
+def ler_token(token, aceitar_expirado=False):
+    try:
+        corpo, assinatura = token.split('.')
+        if not hmac.compare_digest(_de_b64(assinatura), _assinatura(corpo)):
+            return None
+        claims = json.loads(_de_b64(corpo))
+    except ValueError:
+        return None
+    if not aceitar_expirado and claims.get('exp', 0) < time.time():
+        return None
+    return claims
+
+def token_da_requisicao():
+    autorizacao = request.headers.get('Authorization', '')
+    if autorizacao.startswith('Bearer '):
+        return autorizacao[7:].strip()
+    return request.args.get('token')
+
+def claims_atuais():
+    """Claims do token válido da requisição (memorizadas em g), ou None."""
+    if 'claims' not in g:
+        token = token_da_requisicao()
+        g.claims = ler_token(token) if token else None
+    return g.claims
+
+def usuario_atual_id():
+    claims = claims_atuais()
+    if claims:
+        return claims['id']
+    if token_da_requisicao() or not legado_permitido():
+        return None
+    user_id = request.headers.get('User-Id')
+    return int(user_id) if user_id and user_id.isdigit() else None
+
+def autenticado(campo_legado=None, metodos=None):
+    """Exige token válido e deixa as claims em g.claims, sem consultar o banco. Com
+    AUTH_LEGADO (e só sem token) aceita User-Id ou campo_legado (JSON ou query string)
+    e lê o membro. metodos restringe a exigência (ex.: só POST numa rota GET/POST)."""
+    def decorator(f):
+        @wraps(f)
+        def wrapper(*args, **kwargs):
+            if metodos and request.method not in metodos:
+                return f(*args, **kwargs)
+            if token_da_requisicao():
+                if claims_atuais() is None:
+                    return jsonify({"erro": "Token invalido ou expirado"}), 401
+            elif claims_atuais() is None:
+                if not legado_permitido():
+                    return jsonify({"erro": "Autenticacao necessaria"}), 401
+                legado = request.headers.get('User-Id')
+                if not legado and campo_legado:
+                    legado = (request.get_json(silent=True) or {}).get(campo_legado) or request.args.get(campo_legado)
+                membro = Membro.query.get(int(legado)) if str(legado or '').isdigit() else None
+                if not membro:
+                    return jsonify({"erro": "Autenticacao necessaria"}), 401
+                g.claims = claims_do_membro(membro)
+            return f(*args, **kwargs)
+        return wrapper
+    return decorator
+
+@app.route('/api/token/renovar', methods=['POST'])
+def renovar_token():
+    token = token_da_requisicao() or (request.get_json(silent=True) or {}).get('token')
+    claims = ler_token(token, aceitar_expirado=True) if token else None
+    if not claims or claims.get('iat', 0) + TOKEN_RENOVACAO < time.time():
+        return jsonify({"erro": "Token invalido ou expirado, faca login novamente"}), 401
+
+    # Relê o membro: tipo e escopo atualizados entram no novo token
+    membro = Membro.query.get(claims['id'])
+    if not membro:
+        return jsonify({"erro": "Usuario nao encontrado"}), 401
+    novo, expira_em = emitir_token(membro, login_em=claims['iat'])
+    return jsonify({"token": novo, "expira_em": expira_em})
+
+# --- STREAM DE EVENTOS (SSE) ---
+# Os handlers chamam publicar() antes do commit; o evento vai para a tabela evento_stream
+# na mesma transação. Em cada processo uma única thread (BrokerStream) lê as linhas novas
+# e entrega às conexões abertas conforme o escopo (célula/geração/rede) de cada membro.
+# Cada conexão aberta fica parada em fila.get(); por isso o Procfile roda o gunicorn com
+# worker gevent (-k gevent --worker-connections 1000): a espera é de uma green thread e
+# não de um worker inteiro (threading/queue/time são substituídos pelo monkey-patch).
+STREAM_INTERVALO = float(os.environ.get('STREAM_INTERVALO', '1'))
+STREAM_PING = 15          # segundos entre comentários de keep-alive
+STREAM_RETENCAO = timedelta(minutes=10)
+
+def publicar(tipo, dados, celula_id=None, geracao_id=None, rede_id=None):
+    """Registra um evento para o stream (grava junto com o commit do handler).
+    Sem célula/geração/rede o evento vai para todos."""
+    db.session.add(EventoStream(
+        tipo=tipo, dados=json.dumps(dados),
+        celula_id=celula_id, geracao_id=geracao_id, rede_id=rede_id
+    ))
+
+def escopo_aviso(aviso_id):
+    aviso = db.session.query(Aviso.celula_id, Aviso.geracao_id, Aviso.rede_id).filter(Aviso.id == aviso_id).first()
+    if not aviso:
+        return {}
+    return {"celula_id": aviso.celula_id, "geracao_id": aviso.geracao_id, "rede_id": aviso.rede_id}
+
+def publicar_curtidas(tipo, alvo_ids):
+    # Novo total de cada alvo (lido dentro da transação, já com o UPDATE do contador)
+    modelo_alvo = ALVOS_CURTIDA[tipo][2]
+    if not alvo_ids:
+        return
+    colunas = [modelo_alvo.id, modelo_alvo.total_curtidas]
+    if tipo == 'comentario':
+        colunas.append(Comentario.aviso_id)
+    for linha in db.session.query(*colunas).filter(modelo_alvo.id.in_(alvo_ids)):
+        # Eventos são globais; avisos têm escopo próprio; comentários herdam o do aviso
+        aviso_id = linha.id if tipo == 'aviso' else (linha.aviso_id if tipo == 'comentario' else None)
+        escopo = escopo_aviso(aviso_id) if aviso_id else {}
+        publicar('curtida', {"alvo": tipo, "id": linha.id, "total_curtidas": linha.total_curtidas}, **escopo)
+
+class BrokerStream:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.assinantes = {}  # fila -> escopo
+        self.ultimo_id = None
+        self.thread = None
+        self.ultima_faxina = 0
+
+    def assinar(self, escopo):
+        fila = queue.Queue(maxsize=500)
+        with self.lock:
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self._loop, daemon=True)
+                self.thread.start()
+            self.assinantes[fila] = escopo
+        return fila
+
+    def cancelar(self, fila):
+        with self.lock:
+            self.assinantes.pop(fila, None)
+
+    def _loop(self):
+        while True:
+            try:
+                with app.app_context():
+                    self._ler_novos()
+                    db.session.remove()
+            except Exception as e:
+                print(f"Erro no broker do stream: {e}")
+            time.sleep(STREAM_INTERVALO)
+
+    def _ler_novos(self):
+        if self.ultimo_id is None:
+            self.ultimo_id = db.session.query(func.max(EventoStream.id)).scalar() or 0
+        eventos = EventoStream.query.filter(EventoStream.id > self.ultimo_id).order_by(EventoStream.id).limit(1000).all()
+        if eventos:
+            self.ultimo_id = eventos[-1].id
+            with self.lock:
+                assinantes = list(self.assinantes.items())
+            for ev in eventos:
+                for fila, escopo in assinantes:
+                    if escopo_permite(escopo, ev):
+                        try:
+                            fila.put_nowait(ev_para_sse(ev))
+                        except queue.Full:
+                            pass # Cliente lento: perde o delta e recarrega a lista quando reconectar
+
+        # Faxina ocasional do log
+        if time.time() - self.ultima_faxina > 60:
+            self.ultima_faxina = time.time()
+            EventoStream.query.filter(EventoStream.criado_em < datetime.utcnow() - STREAM_RETENCAO).delete(synchronize_session=False)
+            db.session.commit()
+
+broker_stream = BrokerStream()
+
+def escopo_das_claims(claims):
+    """Células/gerações/redes cujos eventos o membro recebe (Admin recebe tudo)."""
+    if claims['tipo'] == 'Admin':
+        return None
+    escopo = {"celulas": set(), "geracoes": set(), "redes": set()}
+    if claims['c']:
+        escopo["celulas"].add(claims['c'])
+        for tipo, ancestral_id in db.session.query(HierarquiaCelula.ancestral_tipo, HierarquiaCelula.ancestral_id) \
+                .filter(HierarquiaCelula.celula_id == claims['c']):
+            escopo["redes" if tipo == 'rede' else "geracoes"].add(ancestral_id)
+    if claims['g']:
+        escopo["geracoes"].add(claims['g'])
+    if claims['r']:
+        escopo["redes"].add(claims['r'])
+    return escopo
+
+def escopo_permite(escopo, ev):
+    if escopo is None or (ev.celula_id is None and ev.geracao_id is None and ev.rede_id is None):
+        return True
+    return (ev.celula_id in escopo["celulas"] or ev.geracao_id in escopo["geracoes"]
+            or ev.rede_id in escopo["redes"])
+
+def ev_para_sse(ev):
+    return f"id: {ev.id}\nevent: {ev.tipo}\ndata: {ev.dados}\n\n"
+
+# EventSource não envia headers customizados: aceita ?token= (ou ?membro_id= de clientes antigos)
+@app.route('/api/stream')
+@autenticado(campo_legado='membro_id')
+def stream_eventos():
+    escopo = escopo_das_claims(g.claims)
+    ultimo_id = request.headers.get('Last-Event-ID') or request.args.get('ultimo_id')
+    pendentes = []
+    if ultimo_id and str(ultimo_id).isdigit():
+        # Reconexão: reenvia o que foi perdido (dentro da retenção do log)
+        pendentes = [ev_para_sse(ev) for ev in EventoStream.query
+            .filter(EventoStream.id > int(ultimo_id)).order_by(EventoStream.id).limit(500)
+            if escopo_permite(escopo, ev)]
+    fila = broker_stream.assinar(escopo)
+    # A conexão ociosa não deve segurar conexão do banco
+    db.session.remove()
+
+    def gerar():
+        try:
+            yield "retry: 5000\n\n"
+            for msg in pendentes:
+                yield msg
+            while True:
+                try:
+                    yield fila.get(timeout=STREAM_PING)
+                except queue.Empty:
+                    yield ": ping\n\n"
+        finally:
+            broker_stream.cancelar(fila)
+
+    return Response(gerar(), mimetype='text/event-stream', headers={
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no"
+    })
+
+def recontar_contadores(evento_ids=(), aviso_ids=(), comentario_ids=()):
+    """Recalcula os contadores a partir das tabelas (usado após exclusões em massa). Conta só o
+    que está visível: sem curtidas de membros excluídos e sem comentários excluídos."""
+    curtida_visivel = Curtida.membro_id.not_in(ids_excluidos(Membro))
+    if evento_ids:
+        Evento.query.filter(Evento.id.in_(list(evento_ids))).update({
+            Evento.total_curtidas: select(func.count(Curtida.id)).where(Curtida.evento_id == Evento.id, curtida_visivel).scalar_subquery(),
+            Evento.total_comentarios: select(func.count(Comentario.id)).where(Comentario.evento_id == Evento.id, Comentario.excluido_em.is_(None)).scalar_subquery()
+        }, synchronize_session=False)
+    if aviso_ids:
+        Aviso.query.filter(Aviso.id.in_(list(aviso_ids))).update({
+            Aviso.total_curtidas: select(func.count(Curtida.id)).where(Curtida.aviso_id == Aviso.id, curtida_visivel).scalar_subquery(),
+            Aviso.total_comentarios: select(func.count(Comentario.id)).where(Comentario.aviso_id == Aviso.id, Comentario.excluido_em.is_(None)).scalar_subquery()
+        }, synchronize_session=False)
+    if comentario_ids:
+        resposta = db.aliased(Comentario)
+        Comentario.query.filter(Comentario.id.in_(list(comentario_ids))).update({
+            Comentario.total_curtidas: select(func.count(CurtidaComentario.id)).where(
+                CurtidaComentario.comentario_id == Comentario.id, CurtidaComentario.membro_id.not_in(ids_excluidos(Membro))).scalar_subquery(),
+            Comentario.total_respostas: select(func.count(resposta.id)).where(resposta.parent_id == Comentario.id, resposta.excluido_em.is_(None)).scalar_subquery()
+        }, synchronize_session=False)
 
 # --- ROTAS DA API ---
 
@@ -452,12 +2221,16 @@ def login():
     email = data.get('email')
     senha = data.get('senha')
     
+    campos = parametro_fields(Membro)
     user = Membro.query.filter_by(email=email).first()
     
     if user and user.senha == senha:
+        token, expira_em = emitir_token(user)
         return jsonify({
             "mensagem": "Login realizado com sucesso",
-            "usuario": user.to_json()
+            "usuario": user.to_json(campos),
+            "token": token,
+            "expira_em": expira_em
         })
         
     return jsonify({"erro": "Credenciais invalidas"}), 401
@@ -541,172 +2314,153 @@ def register():
 
 @app.route('/api/meus-dados/<int:id>')
 def menus_dados(id):
+    # ?fields=usuario.nome,celula.nome,rede: cada bloco aceita os campos do seu modelo
+    campos = parametro_fields()
+    blocos = {"usuario": Membro, "celula": Celula, "rede": Rede, "geracao": Geracao}
+    if campos is not None:
+        invalidos = set(campos) - set(blocos)
+        if invalidos:
+            raise ParametroInvalido(f"Campos invalidos: {', '.join(sorted(invalidos))}. Disponiveis: {', '.join(blocos)}")
+        for nome, modelo in blocos.items():
+            if subcampos(campos, nome):
+                modelo.validar_campos(campos[nome])
+
     user = Membro.query.get(id)
     if not user:
         return jsonify({"erro": "Usuario nao encontrado"}), 404
         
-    # Busca dados da célula, rede ou geração do usuário
-    celula = Celula.query.get(user.celula_id) if user.celula_id else None
-    rede = Rede.query.get(user.rede_id) if user.rede_id else None
-    geracao = Geracao.query.get(user.geracao_id) if user.geracao_id else None
+    # Busca dados da célula, rede ou geração do usuário (só os blocos pedidos)
+    celula = rede = geracao = None
+    if user.celula_id and quer(campos, "celula"):
+        celula = query_celulas(campos=subcampos(campos, "celula")).filter(Celula.id == user.celula_id).first()
+    if user.rede_id and quer(campos, "rede"):
+        rede = aplicar_campos(Rede.query, Rede, subcampos(campos, "rede")).filter(Rede.id == user.rede_id).first()
+    if user.geracao_id and quer(campos, "geracao"):
+        geracao = aplicar_campos(Geracao.query, Geracao, subcampos(campos, "geracao")).filter(Geracao.id == user.geracao_id).first()
     
-    return jsonify({
-        "usuario": user.to_json(),
-        "celula": celula.to_json() if celula else None,
-        "rede": rede.to_json() if rede else None,
-        "geracao": geracao.to_json() if geracao else None
-    })
+    dados = {
+        "usuario": user.to_json(subcampos(campos, "usuario")),
+        "celula": celula.to_json(campos=subcampos(campos, "celula")) if celula else None,
+        "rede": rede.to_json(subcampos(campos, "rede")) if rede else None,
+        "geracao": geracao.to_json(campos=subcampos(campos, "geracao")) if geracao else None
+    }
+    return jsonify({nome: valor for nome, valor in dados.items() if quer(campos, nome)})
 
 @app.route('/api/eventos', methods=['GET'])
+@condicional(Evento, Curtida)
 def get_eventos():
-    eventos = Evento.query.order_by(Evento.data_evento).all()
+    campos = parametro_fields(Evento)
+    eventos = aplicar_campos(Evento.query, Evento, campos).order_by(Evento.data_evento).all()
     # Tenta pegar ID do usuário do header para checar likes
-    user_id = request.headers.get('User-Id')
-    try:
-        user_id = int(user_id) if user_id else None
-    except:
-        user_id = None
-        
-    return jsonify([e.to_json(current_user_id=user_id) for e in eventos])
+    user_id = usuario_atual_id()
+
+    curtidos = ids_curtidos(Curtida.evento_id, user_id, [e.id for e in eventos]) if quer(campos, "curtido_por_mim") else set()
+    return jsonify([e.to_json(current_user_id=user_id, curtidos=curtidos, campos=campos) for e in eventos])
 
 @app.route('/api/eventos/<int:evento_id>/curtir', methods=['POST'])
+@autenticado(campo_legado='membro_id')
 def curtir_evento(evento_id):
-    data = request.json
-    membro_id = data.get('membro_id')
-    
-    if not membro_id:
-        return jsonify({"error": "Membro ID obrigatório"}), 400
+    membro_id = g.claims['id']
 
-    curtida = Curtida.query.filter_by(evento_id=evento_id, membro_id=membro_id).first()
-    
-    if curtida:
-        db.session.delete(curtida)
-        action = "descurtiu"
-    else:
-        nova_curtida = Curtida(evento_id=evento_id, membro_id=membro_id)
-        db.session.add(nova_curtida)
-        action = "curtiu"
-    
-    db.session.commit()
-    
-    # Retorna contagem atualizada
-    total = Curtida.query.filter_by(evento_id=evento_id).count()
+    action, total = curtir('evento', evento_id, membro_id)
     return jsonify({"action": action, "total": total})
 
 @app.route('/api/eventos/<int:evento_id>/comentar', methods=['POST'])
+@autenticado(campo_legado='membro_id')
 def comentar_evento(evento_id):
     data = request.json
-    membro_id = data.get('membro_id')
+    membro_id = g.claims['id']
     texto = data.get('texto')
     
-    if not membro_id or not texto:
+    if not texto:
         return jsonify({"error": "Dados incompletos"}), 400
         
     novo_comentario = Comentario(evento_id=evento_id, membro_id=membro_id, texto=texto)
     db.session.add(novo_comentario)
+    incrementar(Evento, evento_id, total_comentarios=1)
+    db.session.flush()
+    publicar('comentario', {"id": novo_comentario.id, "evento_id": evento_id,
+        "total_comentarios": db.session.query(Evento.total_comentarios).filter(Evento.id == evento_id).scalar()})
     db.session.commit()
     
     return jsonify(novo_comentario.to_json())
 
 @app.route('/api/eventos/<int:evento_id>/comentarios', methods=['GET'])
+@condicional(Comentario, CurtidaComentario, Membro)
 def get_comentarios(evento_id):
-    # Retorna apenas comentários RAIZ (sem pai)
-    comentarios = Comentario.query.filter_by(evento_id=evento_id, parent_id=None).order_by(Comentario.data_criacao.desc()).all()
-    
-    user_id = request.headers.get('User-Id')
-    try: user_id = int(user_id) if user_id else None
-    except: user_id = None
+    # Comentários RAIZ (sem pai) com as respostas aninhadas
+    user_id = usuario_atual_id()
 
-    return jsonify([c.to_json(current_user_id=user_id) for c in comentarios])
-
-    db.session.commit()
-    
-    # Retorna contagem atualizada
-    total = CurtidaComentario.query.filter_by(comentario_id=comentario_id).count()
-    return jsonify({"action": action, "total": total})
+    return resposta_thread(evento_id=evento_id, current_user_id=user_id, **parametros_thread())
 
 # --- INTERAÇÕES NO MURAL (AVISOS) ---
 
 @app.route('/api/avisos/<int:aviso_id>/curtir', methods=['POST'])
+@autenticado(campo_legado='membro_id')
 def curtir_aviso(aviso_id):
-    data = request.json
-    membro_id = data.get('membro_id')
-    
-    if not membro_id:
-        return jsonify({"error": "Membro ID obrigatório"}), 400
+    membro_id = g.claims['id']
 
-    curtida = Curtida.query.filter_by(aviso_id=aviso_id, membro_id=membro_id).first()
-    
-    if curtida:
-        db.session.delete(curtida)
-        action = "descurtiu"
-    else:
-        nova_curtida = Curtida(aviso_id=aviso_id, membro_id=membro_id)
-        db.session.add(nova_curtida)
-        action = "curtiu"
-    
-    db.session.commit()
-    
-    total = Curtida.query.filter_by(aviso_id=aviso_id).count()
+    action, total = curtir('aviso', aviso_id, membro_id)
     return jsonify({"action": action, "total": total})
 
 @app.route('/api/avisos/<int:aviso_id>/comentar', methods=['POST'])
+@autenticado(campo_legado='membro_id')
 def comentar_aviso(aviso_id):
     data = request.json
-    membro_id = data.get('membro_id')
+    membro_id = g.claims['id']
     texto = data.get('texto')
     
-    if not membro_id or not texto:
+    if not texto:
         return jsonify({"error": "Dados incompletos"}), 400
         
     novo_comentario = Comentario(aviso_id=aviso_id, membro_id=membro_id, texto=texto)
     db.session.add(novo_comentario)
+    incrementar(Aviso, aviso_id, total_comentarios=1)
+    db.session.flush()
+    publicar('comentario', {"id": novo_comentario.id, "aviso_id": aviso_id,
+        "total_comentarios": db.session.query(Aviso.total_comentarios).filter(Aviso.id == aviso_id).scalar()},
+        **escopo_aviso(aviso_id))
     db.session.commit()
     
     return jsonify(novo_comentario.to_json())
 
 @app.route('/api/avisos/<int:aviso_id>/comentarios', methods=['GET'])
+@condicional(Comentario, CurtidaComentario, Membro)
 def get_comentarios_aviso(aviso_id):
-    comentarios = Comentario.query.filter_by(aviso_id=aviso_id, parent_id=None).order_by(Comentario.data_criacao.desc()).all()
-    
-    user_id = request.headers.get('User-Id')
-    try: user_id = int(user_id) if user_id else None
-    except: user_id = None
+    user_id = usuario_atual_id()
+
+    return resposta_thread(aviso_id=aviso_id, current_user_id=user_id, **parametros_thread())
+
+@app.route('/api/comentarios/<int:comentario_id>/respostas', methods=['GET'])
+@condicional(Comentario, CurtidaComentario, Membro)
+def get_respostas(comentario_id):
+    # Paginação das respostas de um nível: ?offset=&limite=
+    if not Comentario.query.get(comentario_id):
+        return jsonify({"error": "Comentario nao encontrado"}), 404
+
+    user_id = usuario_atual_id()
 
-    return jsonify([c.to_json(current_user_id=user_id) for c in comentarios])
+    params = parametros_thread()
+    if params["limite"] is None:
+        params["limite"] = THREAD_LIMITE_RESPOSTAS_PADRAO
+    return resposta_thread(raiz_id=comentario_id, current_user_id=user_id, **params)
 
 @app.route('/api/comentarios/<int:comentario_id>/curtir', methods=['POST'])
+@autenticado(campo_legado='membro_id')
 def curtir_comentario(comentario_id):
-    data = request.json
-    membro_id = data.get('membro_id')
-    
-    if not membro_id:
-        return jsonify({"error": "Membro ID obrigatório"}), 400
+    membro_id = g.claims['id']
 
-    curtida = CurtidaComentario.query.filter_by(comentario_id=comentario_id, membro_id=membro_id).first()
-    
-    if curtida:
-        db.session.delete(curtida)
-        action = "descurtiu"
-    else:
-        nova_curtida = CurtidaComentario(comentario_id=comentario_id, membro_id=membro_id)
-        db.session.add(nova_curtida)
-        action = "curtiu"
-    
-    db.session.commit()
-    
-    # Retorna contagem atualizada
-    total = CurtidaComentario.query.filter_by(comentario_id=comentario_id).count()
-    return jsonify({"action": action, "total": total})
+    action, total = curtir('comentario', comentario_id, membro_id)
     return jsonify({"action": action, "total": total})
 
 @app.route('/api/comentarios/<int:comentario_id>/responder', methods=['POST'])
+@autenticado(campo_legado='membro_id')
 def responder_comentario(comentario_id):
     data = request.json
-    membro_id = data.get('membro_id')
+    membro_id = g.claims['id']
     texto = data.get('texto')
     
-    if not membro_id or not texto:
+    if not texto:
         return jsonify({"error": "Dados incompletos"}), 400
 
     parent = Comentario.query.get(comentario_id)
@@ -715,27 +2469,234 @@ def responder_comentario(comentario_id):
 
     nova_resposta = Comentario(
         evento_id=parent.evento_id, # Mesmo evento do pai
+        aviso_id=parent.aviso_id, # ... ou mesmo aviso
         membro_id=membro_id, 
         texto=texto,
         parent_id=comentario_id
     )
     db.session.add(nova_resposta)
+    incrementar(Comentario, comentario_id, total_respostas=1)
+    if parent.evento_id: incrementar(Evento, parent.evento_id, total_comentarios=1)
+    if parent.aviso_id: incrementar(Aviso, parent.aviso_id, total_comentarios=1)
+    db.session.flush()
+    publicar('comentario', {"id": nova_resposta.id, "parent_id": comentario_id,
+        "evento_id": parent.evento_id, "aviso_id": parent.aviso_id},
+        **(escopo_aviso(parent.aviso_id) if parent.aviso_id else {}))
     db.session.commit()
     
     return jsonify(nova_resposta.to_json())
 
 
 
+# --- LISTAGENS EM STREAM ---
+# Em vez de montar a lista inteira antes do jsonify, lê as linhas em lotes (yield_per; no
+# PostgreSQL vira cursor no servidor) e envia o array JSON aos pedaços: a memória do worker
+# não cresce com o tamanho da tabela e o primeiro byte sai logo.
+STREAM_JSON_LOTE = int(os.environ.get('STREAM_JSON_LOTE', '500'))
+
+def json_bytes(obj):
+    if orjson:
+        return orjson.dumps(obj)
+    return json.dumps(obj, ensure_ascii=False, separators=(',', ':')).encode()
+
+def resposta_json_stream(query, serializar, lote=STREAM_JSON_LOTE):
+    def gerar():
+        yield b'['
+        separador = b''
+        pedacos = []
+        for obj in query.yield_per(lote):
+            pedacos.append(json_bytes(serializar(obj)))
+            if len(pedacos) >= lote:
+                yield separador + b','.join(pedacos)
+                separador, pedacos = b',', []
+        if pedacos:
+            yield separador + b','.join(pedacos)
+        yield b']'
+    # stream_with_context mantém a sessão do banco viva enquanto o gerador roda
+    return Response(stream_with_context(gerar()), mimetype='application/json')
+
+# --- AUTOCOMPLETE DE MEMBROS (ÍNDICE DE PREFIXOS EM MEMÓRIA) ---
+# Lista ordenada de (chave, membro_id) no próprio processo: cada nome entra a partir de cada
+# palavra ("joao silva", "silva") e o telefone só com dígitos (com e sem DDD). Um prefixo vira
+# um bisect + varredura curta. É montado na primeira consulta, corrigido no commit que altera
+# membros neste processo e remontado quando a versão da tabela (versao_tabela) mostra escrita
+# de outro worker.
+AUTOCOMPLETE_VERIFICAR_SEG = float(os.environ.get('AUTOCOMPLETE_VERIFICAR_SEG', '2'))
+AUTOCOMPLETE_LIMITE_PADRAO = 10
+AUTOCOMPLETE_LIMITE_MAXIMO = 50
+
+def normalizar_nome(texto):
+    """Minúsculas, sem acentos e só letras/dígitos separados por um espaço."""
+    texto = unicodedata.normalize('NFKD', texto or '')
+    texto = ''.join(ch for ch in texto if not unicodedata.combining(ch)).lower()
+    return ' '.join(re.findall(r'[a-z0-9]+', texto))
+
+def dados_autocomplete(membro):
+    return (membro.nome, membro.email, membro.telefone, membro.tipo, membro.celula_id)
+
+class IndicePrefixos:
+    def __init__(self):
+        self.chaves = []   # [(chave, membro_id)] ordenada
+        self.membros = {}  # membro_id -> (chaves do membro, dados)
+        self.versao = None
+        self.verificado_em = 0
+        self.montado = False
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def chaves_de(dados):
+        nome, _, telefone, _, _ = dados
+        palavras = normalizar_nome(nome).split()
+        chaves = {' '.join(palavras[i:]) for i in range(len(palavras))}
+        digitos = re.sub(r'\D', '', telefone or '')
+        if digitos:
+            chaves.add(digitos)
+            if len(digitos) >= 10:
+                chaves.add(digitos[2:]) # sem DDD
+        return chaves
+
+    def _remover(self, membro_id):
+        chaves, _ = self.membros.pop(membro_id, ((), None))
+        for chave in chaves:
+            i = bisect.bisect_left(self.chaves, (chave, membro_id))
+            if i < len(self.chaves) and self.chaves[i] == (chave, membro_id):
+                del self.chaves[i]
+
+    def _inserir(self, membro_id, dados):
+        chaves = self.chaves_de(dados)
+        self.membros[membro_id] = (chaves, dados)
+        for chave in chaves:
+            bisect.insort(self.chaves, (chave, membro_id))
+
+    def montar(self, versao):
+        linhas = db.session.query(Membro.id, Membro.nome, Membro.email, Membro.telefone, Membro.tipo, Membro.celula_id)
+        membros, chaves = {}, []
+        for membro_id, *dados in linhas:
+            dados = tuple(dados)
+            chaves_membro = self.chaves_de(dados)
+            membros[membro_id] = (chaves_membro, dados)
+            chaves.extend((chave, membro_id) for chave in chaves_membro)
+        chaves.sort()
+        with self.lock:
+            self.chaves, self.membros, self.versao, self.montado = chaves, membros, versao, True
+
+    def garantir(self):
+        """Monta na primeira chamada; depois confere a versão de membro no máximo a cada
+        AUTOCOMPLETE_VERIFICAR_SEG segundos e remonta se outro processo escreveu."""
+        agora = time.time()
+        if self.montado and agora - self.verificado_em < AUTOCOMPLETE_VERIFICAR_SEG:
+            return
+        versao = versoes_tabelas([Membro.__tablename__]).get(Membro.__tablename__, (0, None))[0]
+        if not self.montado or versao != self.versao:
+            self.montar(versao)
+        self.verificado_em = agora
+
+    def aplicar(self, alterados, versao):
+        """Corrige o índice com os membros gravados no commit ({id: dados ou None se excluído})."""
+        with self.lock:
+            if not self.montado:
+                return
+            for membro_id, dados in alterados.items():
+                self._remover(membro_id)
+                if dados is not None:
+                    self._inserir(membro_id, dados)
+            # Só este commit mexeu na tabela desde a versão conhecida: o índice continua em dia
+            if versao is not None and self.versao is not None and versao == self.versao + 1:
+                self.versao = versao
+            self.verificado_em = 0
+
+    def invalidar(self):
+        with self.lock:
+            self.montado = False
+
+    def buscar(self, prefixo, limite, filtro=None):
+        encontrados, vistos = [], set()
+        with self.lock:
+            i = bisect.bisect_left(self.chaves, (prefixo,))
+            while i < len(self.chaves) and len(encontrados) < limite:
+                chave, membro_id = self.chaves[i]
+                if not chave.startswith(prefixo):
+                    break
+                i += 1
+                if membro_id in vistos:
+                    continue
+                vistos.add(membro_id)
+                dados = self.membros[membro_id][1]
+                if filtro is None or filtro(dados):
+                    encontrados.append((membro_id, dados))
+        return encontrados
+
+indice_membros = IndicePrefixos()
+
+@event.listens_for(Session, 'after_flush')
+def _membros_do_flush(session, flush_context):
+    alterados = session.info.setdefault('membros_alterados', {})
+    for obj in session.new | session.dirty:
+        if isinstance(obj, Membro) and (obj in session.new or session.is_modified(obj)):
+            alterados[obj.id] = None if obj.excluido_em else dados_autocomplete(obj)
+    for obj in session.deleted:
+        if isinstance(obj, Membro):
+            alterados[obj.id] = None
+
+@event.listens_for(Session, 'do_orm_execute')
+def _membros_em_massa(orm_execute_state):
+    # Query.update/delete em membro não diz quais linhas mudaram: o índice é remontado
+    if (orm_execute_state.is_update or orm_execute_state.is_delete) and \
+            getattr(orm_execute_state.statement, 'table', None) is Membro.__table__:
+        orm_execute_state.session.info['membros_em_massa'] = True
+
+@event.listens_for(Session, 'after_rollback')
+def _descartar_membros(session):
+    session.info.pop('membros_alterados', None)
+    session.info.pop('membros_em_massa', None)
+
+@event.listens_for(Session, 'after_commit')
+def _atualizar_indice_membros(session):
+    # Registrado depois de _publicar_alteracoes: a versão de membro já foi incrementada
+    alterados = session.info.pop('membros_alterados', None)
+    if session.info.pop('membros_em_massa', None):
+        indice_membros.invalidar()
+        return
+    if not alterados or not indice_membros.montado:
+        return
+    try:
+        with db.engine.connect() as conn:
+            t = VersaoTabela.__table__
+            versao = conn.execute(select(t.c.versao).where(t.c.tabela == Membro.__tablename__)).scalar()
+    except Exception:
+        versao = None
+    indice_membros.aplicar(alterados, versao)
+
+@app.route('/api/membros/autocomplete', methods=['GET'])
+def autocomplete_membros():
+    # Ex: /api/membros/autocomplete?prefix=joao s&limite=10&sem_celula=1
+    prefixo = normalizar_nome(request.args.get('prefix', ''))
+    if not prefixo:
+        return jsonify({"erro": "Informe o prefixo em prefix"}), 400
+    if not re.search(r'[a-z]', prefixo):
+        prefixo = prefixo.replace(' ', '') # telefone digitado com máscara: "(98) 9999"
+    limite = parametro_int('limite', AUTOCOMPLETE_LIMITE_PADRAO, 1, AUTOCOMPLETE_LIMITE_MAXIMO)
+    filtro = (lambda dados: dados[4] is None) if request.args.get('sem_celula') in ('1', 'true') else None
+
+    indice_membros.garantir()
+    return jsonify([{
+        "id": membro_id, "nome": nome, "email": email, "telefone": telefone, "tipo": tipo, "celula_id": celula_id
+    } for membro_id, (nome, email, telefone, tipo, celula_id) in indice_membros.buscar(prefixo, limite, filtro)])
+
 @app.route('/api/membros/sem-celula', methods=['GET'])
+@condicional(Membro)
 def get_sem_celula():
-    membros = Membro.query.filter_by(celula_id=None).all()
-    return jsonify([m.to_json() for m in membros])
+    campos = parametro_fields(Membro)
+    query = aplicar_campos(Membro.query, Membro, campos).filter_by(celula_id=None).order_by(Membro.id)
+    return resposta_json_stream(query, lambda m: m.to_json(campos))
 
 @app.route('/api/membros', methods=['GET', 'POST'])
+@condicional(Membro)
 def handle_membros():
     if request.method == 'GET':
-        membros = Membro.query.all()
-        return jsonify([m.to_json() for m in membros])
+        campos = parametro_fields(Membro)
+        query = aplicar_campos(Membro.query, Membro, campos).order_by(Membro.id)
+        return resposta_json_stream(query, lambda m: m.to_json(campos))
     
     if request.method == 'POST':
         # Mantendo para compatibilidade, mas ideal usar /api/register
@@ -802,51 +2763,22 @@ def delete_membro(id):
     membro = Membro.query.get(id)
     if not membro:
         return jsonify({"erro": "Membro nao encontrado"}), 404
-    
-    try:
-        # Remover dependências para evitar erro de integridade
-        # 1. Curtidas em eventos
-        Curtida.query.filter_by(membro_id=id).delete()
-        
-        # 2. Curtidas em comentários
-        CurtidaComentario.query.filter_by(membro_id=id).delete()
-        
-        # 3. Comentários (e suas dependências: respostas e curtidas neles)
-        user_comments = Comentario.query.filter_by(membro_id=id).all()
-        for c in user_comments:
-            # Deleta curtidas neste comentário
-            CurtidaComentario.query.filter_by(comentario_id=c.id).delete()
-            # Deleta respostas a este comentário (recursivo simples)
-            Comentario.query.filter_by(parent_id=c.id).delete()
-            # Deleta o próprio comentário
-            db.session.delete(c)
-            
-        # 4. Frequencias
-        Frequencia.query.filter_by(membro_id=id).delete()
-
-        # 5. Avisos (se for líder)
-        Aviso.query.filter_by(autor_id=id).delete()
-
-        # 6. Pedidos de Oração
-        PedidoOracao.query.filter_by(membro_id=id).delete()
 
-        # 7. Testemunhos
-        Testemunho.query.filter_by(membro_id=id).delete()
-
-        # 8. Finalmente, deleta o membro
-        db.session.delete(membro)
-        db.session.commit()
-        return jsonify({"mensagem": "Membro excluído com sucesso"}), 200
-    except Exception as e:
-        db.session.rollback()
-        print(f"Erro ao excluir membro: {e}")
-        return jsonify({"erro": str(e)}), 500
+    # Exclusão lógica: some de tudo agora; curtidas, comentários (com as respostas), avisos,
+    # frequências etc. são apagados em lotes por purgar_excluidos
+    excluir_logicamente(membro)
+    db.session.commit()
+    agendar_purga()
+    return jsonify({"mensagem": "Membro excluído com sucesso"}), 200
 
 @app.route('/api/redes', methods=['GET', 'POST'])
+@condicional(Rede)
+@cache_resposta(Rede)
 def handle_redes():
     if request.method == 'GET':
-        redes = Rede.query.all()
-        return jsonify([r.to_json() for r in redes])
+        campos = parametro_fields(Rede)
+        redes = aplicar_campos(Rede.query, Rede, campos).all()
+        return jsonify([r.to_json(campos) for r in redes])
     
     if request.method == 'POST':
         data = request.json
@@ -860,14 +2792,22 @@ def handle_redes():
         return jsonify(nova.to_json()), 201
 
 @app.route('/api/geracoes', methods=['GET', 'POST'])
+@condicional(Geracao, Rede, Celula, Membro)
+@cache_resposta(Geracao, Rede, Celula, Membro)
 def handle_geracoes():
     if request.method == 'GET':
         rede_id = request.args.get('rede_id')
+        campos = parametro_fields(Geracao)
+        query = aplicar_campos(Geracao.query, Geracao, campos)
+        if quer(campos, "rede_nome"):
+            query = query.options(joinedload(Geracao.rede))
+        if quer(campos, "celulas"):
+            query = query.options(selectinload(Geracao.celulas))
         if rede_id:
-            geracoes = Geracao.query.filter_by(rede_id=rede_id).all()
-        else:
-            geracoes = Geracao.query.all()
-        return jsonify([g.to_json() for g in geracoes])
+            query = query.filter_by(rede_id=rede_id)
+        geracoes = query.all()
+        contagens = contagem_membros([c.id for g in geracoes for c in g.celulas]) if quer(campos, "celulas") else {}
+        return jsonify([g.to_json(contagens, campos) for g in geracoes])
     
     if request.method == 'POST':
         data = request.json
@@ -881,12 +2821,678 @@ def handle_geracoes():
         db.session.commit()
         return jsonify(nova.to_json()), 201
 
+def contagem_membros(celulas):
+    """{celula_id: {total, membros, visitantes, encontro}} num GROUP BY só.
+    celulas: lista de ids ou subquery."""
+    if isinstance(celulas, list) and not celulas:
+        return {}
+    linhas = db.session.query(
+        Membro.celula_id,
+        func.count(Membro.id),
+        func.sum(case((Membro.tipo == 'Visitante', 1), else_=0)),
+        func.sum(case((Membro.fez_encontro == True, 1), else_=0))
+    ).filter(Membro.celula_id.in_(celulas)).group_by(Membro.celula_id)
+    return {celula_id: {"total": total, "membros": total - (visitantes or 0),
+                        "visitantes": visitantes or 0, "encontro": encontro or 0}
+            for celula_id, total, visitantes, encontro in linhas}
+
+def _somar_totais(destino, origem):
+    for chave, valor in origem.items():
+        destino[chave] = destino.get(chave, 0) + valor
+
+@app.route('/api/hierarquia')
+@condicional(Rede, Geracao, Celula, Membro)
+@cache_resposta(Rede, Geracao, Celula, Membro)
+def get_hierarquia():
+    """Árvore rede -> geração -> célula com contagens agregadas, em 4 consultas.
+    ?rede_id= limita a uma rede. Sem filtro, o que não tem rede vai em "sem_rede"."""
+    rede_id = parametro_int('rede_id')
+    redes = Rede.query.order_by(Rede.nome)
+    geracoes = Geracao.query.order_by(Geracao.nome)
+    celulas = db.session.query(Celula.id, Celula.nome, Celula.lider, Celula.lider_treinamento,
+                               Celula.rede_id, Celula.geracao_id).order_by(Celula.nome)
+    if rede_id:
+        redes = redes.filter(Rede.id == rede_id)
+        geracoes = geracoes.filter(Geracao.rede_id == rede_id)
+        escopo = celulas_do_escopo(rede_id=rede_id)
+        celulas = celulas.filter(Celula.id.in_(escopo))
+        contagens = contagem_membros(escopo)
+    else:
+        contagens = contagem_membros(select(Celula.id))
+
+    redes = redes.all()
+    if rede_id and not redes:
+        return jsonify({"erro": "Rede nao encontrada"}), 404
+
+    zeros = {"membros": 0, "visitantes": 0, "encontro": 0}
+    def no(extra):
+        return dict(extra, totais={"celulas": 0, "lideres_treinamento": 0, **zeros}, geracoes=[], celulas=[])
+
+    nos_rede = {r.id: no({"id": r.id, "nome": r.nome, "lider_nome": r.lider_nome}) for r in redes}
+    sem_rede = no({})
+    nos_geracao, rede_da_geracao = {}, {}
+    for ger in geracoes:
+        nos_geracao[ger.id] = no({"id": ger.id, "nome": ger.nome, "lider_nome": ger.lider_nome})
+        del nos_geracao[ger.id]["geracoes"]
+        rede_da_geracao[ger.id] = nos_rede.get(ger.rede_id, sem_rede)
+        rede_da_geracao[ger.id]["geracoes"].append(nos_geracao[ger.id])
+
+    for c in celulas:
+        conta = contagens.get(c.id, {})
+        totais = {k: conta.get(k, 0) for k in zeros}
+        tem_treinamento = 1 if c.lider_treinamento else 0
+        if c.geracao_id in nos_geracao:
+            # Com geração, a célula fica sob a rede da geração
+            pai, pai_rede = nos_geracao[c.geracao_id], rede_da_geracao[c.geracao_id]
+        else:
+            pai = pai_rede = nos_rede.get(c.rede_id, sem_rede)
+        pai["celulas"].append({"id": c.id, "nome": c.nome, "lider": c.lider,
+                               "lider_treinamento": c.lider_treinamento, "totais": totais})
+        for destino in {id(pai): pai, id(pai_rede): pai_rede}.values():
+            _somar_totais(destino["totais"], dict(totais, celulas=1, lideres_treinamento=tem_treinamento))
+
+    resultado = {"redes": list(nos_rede.values())}
+    if not rede_id:
+        resultado["sem_rede"] = {"geracoes": sem_rede["geracoes"], "celulas": sem_rede["celulas"]}
+    return jsonify(resultado)
+
+# --- BUSCA POR PROXIMIDADE (GEOHASH) ---
+# celula.geohash (indexado) é recalculado em toda gravação de latitude/longitude. Para um raio R
+# usa-se o prefixo mais longo cuja célula do geohash ainda cobre R: a célula do ponto e as 8
+# vizinhas viram faixas no índice e só esses candidatos passam pelo haversine exato.
+GEOHASH_BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+GEOHASH_PRECISAO = 9 # ~5m
+RAIO_TERRA_KM = 6371.0088
+KM_POR_GRAU = 111.32
+PROXIMAS_RAIO_PADRAO_KM = 5
+PROXIMAS_RAIO_MAXIMO_KM = 100
+
+def geohash(lat, lng, precisao=GEOHASH_PRECISAO):
+    if lat is None or lng is None:
+        return None
+    faixa_lat, faixa_lng = [-90.0, 90.0], [-180.0, 180.0]
+    codigo, bits, valor, longitude = [], 0, 0, True
+    while len(codigo) < precisao:
+        faixa, coordenada = (faixa_lng, lng) if longitude else (faixa_lat, lat)
+        meio = (faixa[0] + faixa[1]) / 2
+        valor <<= 1
+        if coordenada >= meio:
+            valor |= 1
+            faixa[0] = meio
+        else:
+            faixa[1] = meio
+        longitude = not longitude
+        bits += 1
+        if bits == 5:
+            codigo.append(GEOHASH_BASE32[valor])
+            bits, valor = 0, 0
+    return ''.join(codigo)
+
+def tamanho_geohash(precisao):
+    # (graus de latitude, graus de longitude) de uma célula do geohash com essa precisão
+    bits = precisao * 5
+    return 180.0 / 2 ** (bits // 2), 360.0 / 2 ** ((bits + 1) // 2)
+
+def prefixos_proximos(lat, lng, raio_km):
+    """Prefixos de geohash (célula do ponto + 8 vizinhas) que cobrem o círculo de raio_km."""
+    raio_lat = raio_km / KM_POR_GRAU
+    raio_lng = raio_km / (KM_POR_GRAU * max(math.cos(math.radians(lat)), 0.01))
+    precisao = next((p for p in range(GEOHASH_PRECISAO, 0, -1)
+                     if tamanho_geohash(p)[0] >= raio_lat and tamanho_geohash(p)[1] >= raio_lng), 1)
+    altura, largura = tamanho_geohash(precisao)
+    prefixos = set()
+    for dlat in (-altura, 0, altura):
+        for dlng in (-largura, 0, largura):
+            vizinho_lat = min(max(lat + dlat, -90.0), 90.0)
+            vizinho_lng = (lng + dlng + 180.0) % 360.0 - 180.0
+            prefixos.add(geohash(vizinho_lat, vizinho_lng, precisao))
+    return prefixos
+
+def filtro_geohash(prefixos):
+    # Faixa prefixo..prefixo+'zzz' em vez de LIKE: usa o índice B-tree em qualquer collation
+    return db.or_(*[Celula.geohash.between(p, p + 'z' * (GEOHASH_PRECISAO - len(p))) for p in sorted(prefixos)])
+
+def distancia_km(lat1, lng1, lat2, lng2):
+    # Haversine
+    dlat = math.radians(lat2 - lat1)
+    dlng = math.radians(lng2 - lng1)
+    a = math.sin(dlat / 2) ** 2 + math.cos(math.radians(lat1)) * math.cos(math.radians(lat2)) * math.sin(dlng / 2) ** 2
+    return 2 * RAIO_TERRA_KM * math.asin(min(1.0, math.sqrt(a)))
+
+@event.listens_for(Celula, 'before_insert')
+@event.listens_for(Celula, 'before_update')
+def atualizar_geohash(mapper, connection, celula):
+    celula.geohash = geohash(celula.latitude, celula.longitude)
+
+@event.listens_for(Celula, 'before_insert')
+@event.listens_for(Celula, 'before_update')
+def atualizar_dia_busca(mapper, connection, celula):
+    # lower() do SQLite só dobra ASCII ('TERÇA' não vira 'terça'): compara a forma normalizada
+    celula.dia_reuniao_busca = normalizar_nome(celula.dia_reuniao) or None
+
+@app.route('/api/celulas/proximas', methods=['GET'])
+@condicional(Celula, Rede, Geracao)
+def celulas_proximas():
+    # Ex: /api/celulas/proximas?lat=-23.55&lng=-46.63&raio=3&dia=terça
+    lat = parametro_float('lat', None, -90, 90)
+    lng = parametro_float('lng', None, -180, 180)
+    if lat is None or lng is None:
+        return jsonify({"erro": "lat e lng sao obrigatorios"}), 400
+    raio = parametro_float('raio', PROXIMAS_RAIO_PADRAO_KM, 0, PROXIMAS_RAIO_MAXIMO_KM)
+    limite = parametro_int('limite', FEED_LIMIT_PADRAO, 1, FEED_LIMIT_MAXIMO)
+    dia = request.args.get('dia', '').strip()
+    campos = parametro_fields(Celula)
+
+    # Candidatos das faixas do geohash como tuplas (id, lat, lng); o ranking exato roda só neles
+    candidatos = db.session.query(Celula.id, Celula.latitude, Celula.longitude) \
+        .filter(filtro_geohash(prefixos_proximos(lat, lng, raio)))
+    if dia:
+        candidatos = candidatos.filter(Celula.dia_reuniao_busca.contains(normalizar_nome(dia)))
+    distancias = ((distancia_km(lat, lng, c_lat, c_lng), c_id) for c_id, c_lat, c_lng in candidatos)
+    proximas = heapq.nsmallest(limite, (item for item in distancias if item[0] <= raio))
+    if not proximas:
+        return jsonify([])
+
+    # Só as células do resultado são carregadas inteiras
+    celulas = {c.id: c for c in query_celulas(False, campos).filter(Celula.id.in_([c_id for _, c_id in proximas]))}
+    return jsonify([dict(celulas[c_id].to_json(False, campos), distancia_km=round(distancia, 3))
+                    for distancia, c_id in proximas])
+
+# Mapa: os prefixos do geohash já são uma grade em várias resoluções. O zoom escolhe o
+# tamanho do prefixo (célula da grade com ~MAPA_CLUSTER_PIXELS na tela) e o banco agrupa por
+# ele, devolvendo contagem e centróide de cada grupo. Células sozinhas saem com id/nome/coords.
+MAPA_CLUSTER_PIXELS = 64
+MAPA_FAIXAS_MAXIMO = 32
+MAPA_ZOOM_MAXIMO = 22
+
+def precisao_do_zoom(zoom):
+    # Largura em pixels de uma célula do geohash num mapa de tiles 256px (Leaflet/OSM)
+    pixels_por_grau = 256 * 2 ** zoom / 360.0
+    return next((p for p in range(GEOHASH_PRECISAO, 0, -1)
+                 if tamanho_geohash(p)[1] * pixels_por_grau >= MAPA_CLUSTER_PIXELS), 1)
+
+def prefixos_da_area(min_lat, min_lng, max_lat, max_lng):
+    """Prefixos de geohash que cobrem o retângulo, na maior precisão que gere no máximo
+    MAPA_FAIXAS_MAXIMO faixas no índice."""
+    for precisao in range(GEOHASH_PRECISAO, 0, -1):
+        altura, largura = tamanho_geohash(precisao)
+        linhas = math.ceil((max_lat - min_lat) / altura) + 1
+        colunas = math.ceil((max_lng - min_lng) / largura) + 1
+        if linhas * colunas <= MAPA_FAIXAS_MAXIMO or precisao == 1:
+            lats = [min(min_lat + i * altura, max_lat) for i in range(linhas)] + [max_lat]
+            lngs = [min(min_lng + j * largura, max_lng) for j in range(colunas)] + [max_lng]
+            return {geohash(lat, lng, precisao) for lat in lats for lng in lngs}
+
+def parametro_bbox():
+    # Formato do Leaflet (map.getBounds().toBBoxString()): oeste,sul,leste,norte
+    try:
+        oeste, sul, leste, norte = [float(v) for v in request.args.get('bbox', '').split(',')]
+    except ValueError:
+        raise ParametroInvalido("bbox deve ser oeste,sul,leste,norte")
+    if not all(math.isfinite(v) for v in (oeste, sul, leste, norte)) or sul > norte or oeste > leste:
+        raise ParametroInvalido("bbox deve ser oeste,sul,leste,norte")
+    return max(sul, -90.0), max(oeste, -180.0), min(norte, 90.0), min(leste, 180.0)
+
+@app.route('/api/celulas/mapa', methods=['GET'])
+@condicional(Celula)
+def celulas_mapa():
+    # Ex: /api/celulas/mapa?bbox=-46.7,-23.6,-46.5,-23.5&zoom=13
+    min_lat, min_lng, max_lat, max_lng = parametro_bbox()
+    zoom = parametro_int('zoom', 13, 0, MAPA_ZOOM_MAXIMO)
+    precisao = precisao_do_zoom(zoom)
+
+    chave = func.substr(Celula.geohash, 1, precisao).label('chave')
+    grupos = db.session.query(
+        chave, func.count(Celula.id), func.avg(Celula.latitude), func.avg(Celula.longitude),
+        func.min(Celula.id), func.min(Celula.nome)
+    ).filter(
+        filtro_geohash(prefixos_da_area(min_lat, min_lng, max_lat, max_lng)),
+        Celula.latitude.between(min_lat, max_lat),
+        Celula.longitude.between(min_lng, max_lng)
+    ).group_by(chave).all()
+
+    clusters, celulas = [], []
+    for prefixo, total, lat, lng, celula_id, nome in grupos:
+        if total == 1:
+            celulas.append({"id": celula_id, "nome": nome, "latitude": lat, "longitude": lng})
+        else:
+            clusters.append({"geohash": prefixo, "total": total, "latitude": lat, "longitude": lng})
+    return jsonify({"zoom": zoom, "precisao": precisao, "clusters": clusters, "celulas": celulas})
+
+# --- GEOLOCALIZAÇÃO (CEP E GEOCODIFICAÇÃO) ---
+# Proxy para ViaCEP/Nominatim com cache persistente (GeoCache). Pedidos simultâneos da mesma
+# chave esperam uma única chamada ao provedor. As URLs dos provedores vêm do ambiente, então
+# dá para apontar para um servidor local de testes (GEO_CEP_URL/GEO_GEOCODE_URL).
+GEO_CEP_URL = os.environ.get('GEO_CEP_URL', 'https://viacep.com.br/ws/{cep}/json/')
+GEO_GEOCODE_URL = os.environ.get('GEO_GEOCODE_URL', 'https://nominatim.openstreetmap.org/search')
+GEO_USER_AGENT = os.environ.get('GEO_USER_AGENT', 'iba-celulas-agape/1.0')
+GEO_TIMEOUT = float(os.environ.get('GEO_TIMEOUT', '5'))
+GEO_CACHE_DIAS = int(os.environ.get('GEO_CACHE_DIAS', '90'))
+GEO_CACHE_NEGATIVO_HORAS = int(os.environ.get('GEO_CACHE_NEGATIVO_HORAS', '24'))
+GEO_GEOCODE_INTERVALO = float(os.environ.get('GEO_GEOCODE_INTERVALO', '1')) # Nominatim: 1 req/s
+GEO_LOTE_WORKERS = int(os.environ.get('GEO_LOTE_WORKERS', '2'))
+
+class GeoIndisponivel(Exception):
+    """Provedor fora do ar ou com resposta inválida (não vai para o cache)."""
+    pass
+
+def geo_http_json(url):
+    req = urllib.request.Request(url, headers={'User-Agent': GEO_USER_AGENT, 'Accept': 'application/json'})
+    try:
+        with urllib.request.urlopen(req, timeout=GEO_TIMEOUT) as resposta:
+            return json.loads(resposta.read().decode('utf-8'))
+    except urllib.error.HTTPError as e:
+        if e.code in (400, 404):
+            return None
+        raise GeoIndisponivel(f"HTTP {e.code}")
+    except (urllib.error.URLError, OSError, ValueError) as e:
+        raise GeoIndisponivel(str(e))
+
+def buscar_cep_provedor(cep):
+    dados = geo_http_json(GEO_CEP_URL.format(cep=cep))
+    if not dados or dados.get('erro'):
+        return None
+    return dados
+
+geo_intervalo_lock = threading.Lock()
+geo_ultima_chamada = [0.0]
+
+def geocodificar_provedor(consulta):
+    # Respeita o intervalo mínimo entre chamadas (vale para todas as threads do processo)
+    with geo_intervalo_lock:
+        espera = geo_ultima_chamada[0] + GEO_GEOCODE_INTERVALO - time.monotonic()
+        if espera > 0:
+            time.sleep(espera)
+        geo_ultima_chamada[0] = time.monotonic()
+    url = GEO_GEOCODE_URL + '?' + urlencode({'format': 'json', 'limit': 1, 'countrycodes': 'br', 'q': consulta})
+    resultados = geo_http_json(url)
+    if not resultados:
+        return None
+    try:
+        primeiro = resultados[0]
+        return {"latitude": float(primeiro['lat']), "longitude": float(primeiro['lon']),
+                "endereco": primeiro.get('display_name')}
+    except (KeyError, IndexError, TypeError, ValueError):
+        raise GeoIndisponivel("Resposta inesperada do provedor")
+
+PROVEDORES_GEO = {'cep': buscar_cep_provedor, 'geocode': geocodificar_provedor}
+
+def chave_geo(texto):
+    return ' '.join(texto.lower().split())[:300]
+
+def ler_cache_geo(tipo, chaves):
+    """{chave: dados} das entradas válidas (dados None = não encontrado)."""
+    linhas = db.session.query(GeoCache.chave, GeoCache.dados).filter(
+        GeoCache.tipo == tipo, GeoCache.chave.in_(list(chaves)), GeoCache.expira_em > datetime.utcnow())
+    return {chave: json.loads(dados) if dados else None for chave, dados in linhas}
+
+def gravar_cache_geo(tipo, resultados):
+    """resultados: {chave: dados ou None}. Faz commit."""
+    agora = datetime.utcnow()
+    upsert(GeoCache, [{
+        "tipo": tipo, "chave": chave, "dados": json.dumps(dados, ensure_ascii=False) if dados else None,
+        "criado_em": agora,
+        "expira_em": agora + (timedelta(days=GEO_CACHE_DIAS) if dados else timedelta(hours=GEO_CACHE_NEGATIVO_HORAS))
+    } for chave, dados in resultados.items()], ['tipo', 'chave'], ['dados', 'criado_em', 'expira_em'])
+    db.session.commit()
+
+geo_pendentes = {}
+geo_pendentes_lock = threading.Lock()
+
+def consultar_geo(tipo, chave):
+    """Cache -> provedor. Se outra requisição já está buscando a mesma chave, espera por ela."""
+    cache = ler_cache_geo(tipo, [chave])
+    if chave in cache:
+        return cache[chave]
+
+    with geo_pendentes_lock:
+        futuro = geo_pendentes.get((tipo, chave))
+        dono = futuro is None
+        if dono:
+            futuro = geo_pendentes[(tipo, chave)] = Future()
+    if not dono:
+        return futuro.result(timeout=GEO_TIMEOUT * 3)
+
+    try:
+        dados = PROVEDORES_GEO[tipo](chave)
+        gravar_cache_geo(tipo, {chave: dados})
+        futuro.set_result(dados)
+        return dados
+    except Exception as e:
+        futuro.set_exception(e)
+        raise
+    finally:
+        with geo_pendentes_lock:
+            geo_pendentes.pop((tipo, chave), None)
+
+def resposta_geo(dados, erro_404):
+    if dados is None:
+        return jsonify({"erro": erro_404}), 404
+    resposta = jsonify(dados)
+    resposta.headers['Cache-Control'] = 'public, max-age=86400'
+    return resposta
+
+@app.route('/api/geo/cep/<cep>', methods=['GET'])
+def geo_cep(cep):
+    cep = re.sub(r'\D', '', cep)
+    if len(cep) != 8:
+        return jsonify({"erro": "CEP deve ter 8 digitos"}), 400
+    try:
+        return resposta_geo(consultar_geo('cep', cep), "CEP nao encontrado")
+    except (GeoIndisponivel, TimeoutError):
+        return jsonify({"erro": "Servico de CEP indisponivel"}), 502
+
+@app.route('/api/geo/geocode', methods=['GET'])
+def geo_geocode():
+    # Ex: /api/geo/geocode?q=Rua X, 10, São Luís - MA
+    consulta = chave_geo(request.args.get('q', ''))
+    if len(consulta) < 3:
+        return jsonify({"erro": "Informe o endereco em q"}), 400
+    try:
+        return resposta_geo(consultar_geo('geocode', consulta), "Endereco nao encontrado")
+    except (GeoIndisponivel, TimeoutError):
+        return jsonify({"erro": "Servico de geolocalizacao indisponivel"}), 502
+
+def endereco_para_geocode(obj):
+    """Texto de busca a partir do endereço de uma célula/membro (None se não houver dados)."""
+    rua = ', '.join(p for p in (obj.endereco, obj.numero, obj.bairro) if p)
+    cidade = ' - '.join(p for p in (obj.cidade, obj.estado) if p)
+    if rua and cidade:
+        return chave_geo(f"{rua}, {cidade}, Brasil")
+    if obj.cep and re.sub(r'\D', '', obj.cep):
+        return chave_geo(re.sub(r'\D', '', obj.cep))
+    return None
+
+def geocodificar_pendentes(workers=GEO_LOTE_WORKERS, limite=None):
+    """Geocodifica células e membros sem latitude/longitude. Endereços repetidos viram uma
+    única consulta, o cache é consultado antes e no máximo `workers` chamadas ao provedor
+    rodam ao mesmo tempo (além do intervalo mínimo do provedor). Retorna estatísticas."""
+    pendentes = {}
+    for modelo in (Celula, Membro):
+        query = modelo.query.filter(db.or_(modelo.latitude.is_(None), modelo.longitude.is_(None)))
+        for obj in query.limit(limite) if limite else query:
+            consulta = endereco_para_geocode(obj)
+            if consulta:
+                pendentes.setdefault(consulta, []).append((modelo, obj.id))
+
+    resultados = {}
+    consultas = list(pendentes)
+    for i in range(0, len(consultas), 500):
+        resultados.update(ler_cache_geo('geocode', consultas[i:i + 500]))
+    em_cache = len(resultados)
+    falhas = 0
+
+    faltando = [c for c in consultas if c not in resultados]
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        # Threads só falam com o provedor; o banco é usado apenas nesta thread
+        futuros = {executor.submit(PROVEDORES_GEO['geocode'], c): c for c in faltando}
+        novos = {}
+        for futuro in as_completed(futuros):
+            try:
+                novos[futuros[futuro]] = futuro.result()
+            except GeoIndisponivel:
+                falhas += 1
+                continue
+            if len(novos) >= 50:
+                gravar_cache_geo('geocode', novos)
+                resultados.update(novos)
+                novos = {}
+        if novos:
+            gravar_cache_geo('geocode', novos)
+            resultados.update(novos)
+
+    atualizados = 0
+    for consulta, alvos in pendentes.items():
+        dados = resultados.get(consulta)
+        if not dados:
+            continue
+        for modelo, obj_id in alvos:
+            valores = {modelo.latitude: dados['latitude'], modelo.longitude: dados['longitude']}
+            if modelo is Celula:
+                # update em massa não passa pelo before_update do geohash
+                valores[Celula.geohash] = geohash(dados['latitude'], dados['longitude'])
+            modelo.query.filter(modelo.id == obj_id).update(valores, synchronize_session=False)
+            atualizados += 1
+    db.session.commit()
+    return {"consultas": len(consultas), "em_cache": em_cache, "consultados": len(faltando) - falhas,
+            "falhas": falhas, "atualizados": atualizados}
+
+# --- BUSCA TEXTUAL ---
+# Índice único (busca_indice) de membros, células, avisos e testemunhos, criado por
+# migrate_busca.py: FTS5 (unicode61 remove_diacritics) no SQLite; tsvector com a configuração
+# 'portuguese' + unaccent e índice GIN no PostgreSQL. É mantido no after_flush, na mesma
+# transação da escrita. O id da linha codifica o registro (ref_id * 4 + código do tipo), o que
+# deixa a atualização incremental indexada também no FTS5 (rowid).
+BUSCA_TIPOS = {'membro': 0, 'celula': 1, 'aviso': 2, 'testemunho': 3}
+BUSCA_TERMOS_MAXIMO = 8
+
+# Modelo -> (tipo, campos que mudam o documento)
+BUSCA_MODELOS = {
+    Membro: ('membro', ('nome', 'email', 'telefone', 'bairro', 'celula_id', 'rede_id', 'geracao_id', 'excluido_em')),
+    Celula: ('celula', ('nome', 'lider', 'bairro', 'rede_id', 'geracao_id', 'excluido_em')),
+    Aviso: ('aviso', ('titulo', 'mensagem', 'celula_id', 'rede_id', 'geracao_id')),
+    Testemunho: ('testemunho', ('texto', 'celula_id')),
+}
+
+busca_indice = table('busca_indice', column('tipo'), column('ref_id'), column('celula_id'),
+                     column('rede_id'), column('geracao_id'), column('titulo'), column('texto'))
+
+def documento_busca(obj):
+    """(titulo, texto, celula_id, rede_id, geracao_id) indexados para o registro."""
+    if isinstance(obj, Membro):
+        telefone = obj.telefone or ''
+        # Telefone também só com dígitos: "98999991234" acha "(98) 99999-1234"
+        texto = ' '.join(filter(None, (obj.email, telefone, re.sub(r'\D', '', telefone), obj.bairro)))
+        return obj.nome, texto, obj.celula_id, obj.rede_id, obj.geracao_id
+    if isinstance(obj, Celula):
+        return obj.nome, ' '.join(filter(None, (obj.lider, obj.bairro))), obj.id, obj.rede_id, obj.geracao_id
+    if isinstance(obj, Aviso):
+        return obj.titulo, obj.mensagem, obj.celula_id, obj.rede_id, obj.geracao_id
+    return None, obj.texto, obj.celula_id, None, None
+
+def id_busca(tipo, ref_id):
+    return ref_id * 4 + BUSCA_TIPOS[tipo]
+
+busca_estado = {}
+
+def indice_busca_existe(conn):
+    # Sem migrate_busca.py as escritas seguem normalmente (o índice é ignorado)
+    if 'existe' not in busca_estado:
+        busca_estado['existe'] = inspect(conn).has_table('busca_indice')
+    return busca_estado['existe']
+
+def criar_indice_busca(conn):
+    if conn.dialect.name == 'postgresql':
+        conn.execute(text("CREATE EXTENSION IF NOT EXISTS unaccent"))
+        conn.execute(text(
+            "CREATE TABLE IF NOT EXISTS busca_indice (id BIGINT PRIMARY KEY, tipo VARCHAR(12) NOT NULL, "
+            "ref_id INTEGER NOT NULL, celula_id INTEGER, rede_id INTEGER, geracao_id INTEGER, "
+            "titulo TEXT, texto TEXT, documento TSVECTOR)"))
+        conn.execute(text("CREATE INDEX IF NOT EXISTS ix_busca_indice_documento ON busca_indice USING GIN (documento)"))
+    else:
+        conn.execute(text(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS busca_indice USING fts5(tipo UNINDEXED, ref_id UNINDEXED, "
+            "celula_id UNINDEXED, rede_id UNINDEXED, geracao_id UNINDEXED, titulo, texto, "
+            "tokenize = 'unicode61 remove_diacritics 2')"))
+    busca_estado.pop('existe', None)
+
+def remover_da_busca(conn, ids):
+    if not ids:
+        return
+    coluna = 'id' if conn.dialect.name == 'postgresql' else 'rowid'
+    conn.execute(text(f"DELETE FROM busca_indice WHERE {coluna} IN :ids")
+                 .bindparams(bindparam('ids', expanding=True)), {"ids": list(ids)})
+
+def indexar_na_busca(conn, objetos):
+    linhas = []
+    for obj in objetos:
+        tipo = BUSCA_MODELOS[type(obj)][0]
+        titulo, texto, celula_id, rede_id, geracao_id = documento_busca(obj)
+        linhas.append({"id": id_busca(tipo, obj.id), "tipo": tipo, "ref_id": obj.id, "titulo": titulo or '',
+                       "texto": texto or '', "celula_id": celula_id, "rede_id": rede_id, "geracao_id": geracao_id})
+    if not linhas:
+        return
+    remover_da_busca(conn, [linha["id"] for linha in linhas])
+    if conn.dialect.name == 'postgresql':
+        sql = ("INSERT INTO busca_indice (id, tipo, ref_id, celula_id, rede_id, geracao_id, titulo, texto, documento) "
+               "VALUES (:id, :tipo, :ref_id, :celula_id, :rede_id, :geracao_id, :titulo, :texto, "
+               "setweight(to_tsvector('portuguese', unaccent(:titulo)), 'A') || "
+               "setweight(to_tsvector('portuguese', unaccent(:texto)), 'B'))")
+    else:
+        sql = ("INSERT INTO busca_indice (rowid, tipo, ref_id, celula_id, rede_id, geracao_id, titulo, texto) "
+               "VALUES (:id, :tipo, :ref_id, :celula_id, :rede_id, :geracao_id, :titulo, :texto)")
+    conn.execute(text(sql), linhas)
+
+def reindexar_busca(modelo, ids):
+    """Reindexa registros alterados por UPDATE em massa (não passa pelo after_flush). Os
+    ocultos pela exclusão lógica não voltam ao índice."""
+    conn = db.session.connection()
+    if not ids or not indice_busca_existe(conn):
+        return
+    objetos = db.session.scalars(select(modelo).where(modelo.id.in_(ids))
+                                 .execution_options(populate_existing=True)).all()
+    indexar_na_busca(conn, objetos)
+
+def reconstruir_busca(lote=500):
+    """Reindexa tudo (migrate_busca.py). Faz commit."""
+    conn = db.session.connection()
+    conn.execute(text("DELETE FROM busca_indice"))
+    total = 0
+    for modelo in BUSCA_MODELOS:
+        for objetos in db.session.scalars(select(modelo).order_by(modelo.id)
+                                          .execution_options(yield_per=lote)).partitions():
+            indexar_na_busca(conn, objetos)
+            total += len(objetos)
+    db.session.commit()
+    return total
+
+@event.listens_for(Session, 'after_flush')
+def _manter_busca(session, flush_context):
+    gravar, remover, excluidos = [], [], []
+    for obj in session.new:
+        if type(obj) in BUSCA_MODELOS:
+            gravar.append(obj)
+    for obj in session.dirty:
+        campos = BUSCA_MODELOS.get(type(obj), (None, ()))[1]
+        estado = inspect(obj)
+        if not any(estado.attrs[c].history.has_changes() for c in campos):
+            continue
+        if getattr(obj, 'excluido_em', None):
+            remover.append(id_busca(BUSCA_MODELOS[type(obj)][0], obj.id))
+            excluidos.append(obj)
+        else:
+            gravar.append(obj)
+    for obj in session.deleted:
+        if type(obj) in BUSCA_MODELOS:
+            remover.append(id_busca(BUSCA_MODELOS[type(obj)][0], obj.id))
+
+    if not gravar and not remover:
+        return
+    conn = session.connection()
+    if not indice_busca_existe(conn):
+        return
+    for obj in excluidos:
+        # Exclusão lógica: avisos e testemunhos que a purga vai apagar saem do índice agora
+        if isinstance(obj, Membro):
+            filtros = ((Aviso, Aviso.autor_id), (Testemunho, Testemunho.membro_id))
+        else:
+            filtros = ((Aviso, Aviso.celula_id), (Testemunho, Testemunho.celula_id))
+        for modelo, coluna in filtros:
+            tipo = BUSCA_MODELOS[modelo][0]
+            remover += [id_busca(tipo, ref_id) for (ref_id,) in conn.execute(select(modelo.id).where(coluna == obj.id))]
+    remover_da_busca(conn, remover)
+    indexar_na_busca(conn, gravar)
+
+@event.listens_for(Session, 'do_orm_execute')
+def _busca_em_massa(orm_execute_state):
+    # Query.delete() não passa pelo flush: tira do índice as linhas que o DELETE vai apagar
+    if not orm_execute_state.is_delete or orm_execute_state.bind_mapper is None:
+        return
+    modelo = orm_execute_state.bind_mapper.class_
+    if modelo not in BUSCA_MODELOS:
+        return
+    conn = orm_execute_state.session.connection()
+    if not indice_busca_existe(conn):
+        return
+    consulta = select(modelo.id)
+    if orm_execute_state.statement.whereclause is not None:
+        consulta = consulta.where(orm_execute_state.statement.whereclause)
+    tipo = BUSCA_MODELOS[modelo][0]
+    remover_da_busca(conn, [id_busca(tipo, ref_id) for (ref_id,) in conn.execute(consulta)])
+
+def escopo_da_busca(claims):
+    """Filtro do índice pela hierarquia de quem busca: Admin vê tudo; líder de rede/geração vê
+    o que está abaixo dele; os demais veem a própria célula e os avisos enviados a ela."""
+    if claims['tipo'] == 'Admin':
+        return None
+    indice = busca_indice.c
+    condicoes = [db.and_(indice.tipo == 'aviso', indice.celula_id.is_(None),
+                         indice.rede_id.is_(None), indice.geracao_id.is_(None))]
+    if claims['tipo'] == 'LiderRede' and claims['r']:
+        condicoes += [indice.celula_id.in_(celulas_do_escopo(rede_id=claims['r'])),
+                      indice.rede_id == claims['r'],
+                      indice.geracao_id.in_(geracoes_da_rede(claims['r']))]
+    if claims['tipo'] == 'LiderGeracao' and claims['g']:
+        condicoes += [indice.celula_id.in_(celulas_do_escopo(geracao_id=claims['g'])),
+                      indice.geracao_id == claims['g']]
+    if claims['c']:
+        condicoes += [indice.celula_id == claims['c'],
+                      db.and_(indice.tipo == 'aviso', db.or_(
+                          indice.rede_id.in_(ancestrais_da_celula(claims['c'], 'rede')),
+                          indice.geracao_id.in_(ancestrais_da_celula(claims['c'], 'geracao'))))]
+    return db.or_(*condicoes)
+
+@app.route('/api/busca', methods=['GET'])
+@autenticado()
+def buscar():
+    # Ex: /api/busca?q=joao silva&tipos=membro,celula&limite=20
+    termos = re.findall(r'\w+', request.args.get('q', '').lower())[:BUSCA_TERMOS_MAXIMO]
+    if not termos:
+        return jsonify({"erro": "Informe o termo em q"}), 400
+    tipos = [t for t in request.args.get('tipos', '').split(',') if t]
+    if set(tipos) - set(BUSCA_TIPOS):
+        raise ParametroInvalido(f"tipos invalidos. Disponiveis: {', '.join(BUSCA_TIPOS)}")
+    limite = parametro_int('limite', FEED_LIMIT_PADRAO, 1, FEED_LIMIT_MAXIMO)
+
+    conn = db.session.connection()
+    if not indice_busca_existe(conn):
+        return jsonify({"erro": "Indice de busca nao criado (rode migrate_busca.py)"}), 503
+
+    # Todos os termos, cada um como prefixo ("jo" acha "João")
+    if conn.dialect.name == 'postgresql':
+        consulta_ts = func.to_tsquery('portuguese', func.unaccent(' & '.join(f"{t}:*" for t in termos)))
+        relevancia = func.ts_rank(literal_column('documento'), consulta_ts)
+        filtro, ordem = literal_column('documento').op('@@')(consulta_ts), relevancia.desc()
+    else:
+        # Pesos do bm25 por coluna (tipo, ref_id, celula_id, rede_id, geracao_id, titulo, texto)
+        relevancia = -literal_column('bm25(busca_indice, 0, 0, 0, 0, 0, 10.0, 1.0)')
+        filtro = literal_column('busca_indice').op('MATCH')(' '.join(f'"{t}"*' for t in termos))
+        ordem = relevancia.desc()
+
+    indice = busca_indice.c
+    consulta = select(indice.tipo, indice.ref_id, indice.titulo, indice.texto, indice.celula_id,
+                      relevancia.label('relevancia')).select_from(busca_indice).where(filtro)
+    escopo = escopo_da_busca(g.claims)
+    if escopo is not None:
+        consulta = consulta.where(escopo)
+    if tipos:
+        consulta = consulta.where(indice.tipo.in_(tipos))
+
+    resultados = conn.execute(consulta.order_by(ordem).limit(limite)).all()
+    return jsonify([{
+        "tipo": tipo, "id": ref_id, "titulo": titulo or None, "resumo": (texto or '')[:160],
+        "celula_id": celula_id, "relevancia": round(float(rank), 4)
+    } for tipo, ref_id, titulo, texto, celula_id, rank in resultados])
+
 @app.route('/api/celulas', methods=['GET', 'POST'])
+@condicional(Celula, Membro, Rede, Geracao)
+@cache_resposta(Celula, Membro, Rede, Geracao)
 def handle_celulas():
     if request.method == 'GET':
-        celulas = Celula.query.all()
-        celulas.sort(key=lambda x: x.nome)
-        return jsonify([c.to_json() for c in celulas])
+        incluir_membros = 'membros' in parametro_include()
+        campos = parametro_fields(Celula)
+        celulas = query_celulas(incluir_membros, campos).order_by(Celula.nome).all()
+        return jsonify([c.to_json(incluir_membros, campos) for c in celulas])
     
     if request.method == 'POST':
         data = request.json
@@ -917,14 +3523,27 @@ def handle_celulas():
         return jsonify(nova_celula.to_json()), 201
 
 @app.route('/api/celulas/<int:id>', methods=['GET', 'PUT', 'DELETE'])
+@condicional(Celula, Membro, Rede, Geracao)
 def handle_celula_id(id):
+    if request.method == 'GET':
+        incluir_membros = 'membros' in parametro_include()
+        campos = parametro_fields(Celula)
+        if json_no_banco():
+            if campos and isinstance(campos.get("membros"), dict):
+                Membro.validar_campos(campos["membros"])
+            texto = celula_json(id, incluir_membros, campos)
+            if texto is None:
+                return jsonify({"erro": "Celula nao encontrada"}), 404
+            return Response(texto, mimetype='application/json')
+        celula = query_celulas(incluir_membros, campos).filter(Celula.id == id).first()
+        if not celula:
+            return jsonify({"erro": "Celula nao encontrada"}), 404
+        return jsonify(celula.to_json(incluir_membros, campos))
+
     celula = Celula.query.get(id)
     if not celula:
         return jsonify({"erro": "Celula nao encontrada"}), 404
 
-    if request.method == 'GET':
-        return jsonify(celula.to_json())
-
     if request.method == 'PUT':
         data = request.json
         
@@ -961,15 +3580,19 @@ def handle_celula_id(id):
         return jsonify(celula.to_json())
 
     if request.method == 'DELETE':
-        db.session.delete(celula)
+        # Exclusão lógica; reuniões, avisos, pedidos etc. saem na purga (membros ficam sem célula)
+        excluir_logicamente(celula)
         db.session.commit()
+        agendar_purga()
         return jsonify({"mensagem": "Celula removida"}), 200
 
 @app.route('/api/reunioes', methods=['GET', 'POST'])
+@condicional(Reuniao)
 def handle_reunioes():
     if request.method == 'GET':
-        reunioes = Reuniao.query.all()
-        return jsonify([r.to_json() for r in reunioes])
+        campos = parametro_fields(Reuniao)
+        query = aplicar_campos(Reuniao.query, Reuniao, campos).order_by(Reuniao.id)
+        return resposta_json_stream(query, lambda r: r.to_json(campos))
     
     if request.method == 'POST':
         data = request.json
@@ -982,55 +3605,312 @@ def handle_reunioes():
             observacoes=data.get('observacoes')
         )
         db.session.add(nova)
+        db.session.flush()
+        atualizar_frequencia_semanal(semanas_das_reunioes([nova.id]))
         db.session.commit()
         return jsonify(nova.to_json()), 201
 
+# --- FREQUÊNCIA ---
+FREQUENCIA_LOTE_MAXIMO = 200   # reuniões por requisição de /api/frequencia/lote
+UPSERT_LINHAS_POR_COMANDO = 500
+
+def upsert(modelo, linhas, chaves, campos):
+    """INSERT ... ON CONFLICT (chaves) DO UPDATE SET campos, em lotes (SQLite e PostgreSQL).
+    Exige índice único em chaves. Não faz commit."""
+    insert_dialeto = pg_insert if db.session.get_bind().dialect.name == 'postgresql' else sqlite_insert
+    for i in range(0, len(linhas), UPSERT_LINHAS_POR_COMANDO):
+        stmt = insert_dialeto(modelo).values(linhas[i:i + UPSERT_LINHAS_POR_COMANDO])
+        stmt = stmt.on_conflict_do_update(index_elements=chaves, set_={c: stmt.excluded[c] for c in campos})
+        db.session.execute(stmt)
+
+def aplicar_frequencias(estados):
+    """estados: {reuniao_id: {membro_id: presente}}. Grava só o que mudou (upsert) e retorna
+    {reuniao_id: {"adicionados": [...], "alterados": [...], "inalterados": n}}. Não faz commit."""
+    atuais = {}
+    if estados:
+        for reuniao_id, membro_id, presente in db.session.query(
+                Frequencia.reuniao_id, Frequencia.membro_id, Frequencia.presente) \
+                .filter(Frequencia.reuniao_id.in_(list(estados))):
+            atuais[(reuniao_id, membro_id)] = bool(presente)
+
+    linhas, diffs = [], {}
+    for reuniao_id, membros in estados.items():
+        diff = diffs[reuniao_id] = {"adicionados": [], "alterados": [], "inalterados": 0}
+        for membro_id, presente in membros.items():
+            antes = atuais.get((reuniao_id, membro_id))
+            if antes == presente:
+                diff["inalterados"] += 1
+                continue
+            item = {"membro_id": membro_id, "presente": presente}
+            diff["adicionados" if antes is None else "alterados"].append(item)
+            linhas.append({"reuniao_id": reuniao_id, "membro_id": membro_id, "presente": presente})
+
+    upsert(Frequencia, linhas, ['reuniao_id', 'membro_id'], ['presente'])
+    return diffs
+
+def ids_validos(valores, campo):
+    if not isinstance(valores, list) or not all(isinstance(v, int) and not isinstance(v, bool) for v in valores):
+        raise ParametroInvalido(f"'{campo}' deve ser uma lista de ids")
+    return valores
+
 @app.route('/api/frequencia', methods=['POST'])
 def handle_frequencia():
     # Espera { "reuniao_id": 1, "membros_presentes": [1, 2, 5] }
     data = request.json
     reuniao_id = data['reuniao_id']
-    presentes_ids = data['membros_presentes']
+    presentes_ids = ids_validos(data['membros_presentes'], 'membros_presentes')
     
-    # Primeiro, limpa frequencias anteriores dessa reunião (simples) ou atualiza
-    # Aqui vamos assumir que enviamos a lista completa de presentes
+    # A lista é a de presentes completa: quem já tinha registro ou é da célula fica como ausente
     reuniao = Reuniao.query.get(reuniao_id)
     if not reuniao:
         return jsonify({"erro": "Reuniao nao encontrada"}), 404
         
-    # Remove frequencias existentes desta reuniao
-    Frequencia.query.filter_by(reuniao_id=reuniao_id).delete()
-    
-    for mid in presentes_ids:
-        freq = Frequencia(reuniao_id=reuniao_id, membro_id=mid, presente=True)
-        db.session.add(freq)
+    estados = {mid: False for (mid,) in db.session.query(Frequencia.membro_id).filter_by(reuniao_id=reuniao_id)}
+    estados.update({mid: False for (mid,) in db.session.query(Membro.id).filter_by(celula_id=reuniao.celula_id)})
+    estados.update({mid: True for mid in presentes_ids})
+    aplicar_frequencias({reuniao_id: estados})
+    atualizar_frequencia_semanal(semanas_das_reunioes([reuniao_id]))
     
     db.session.commit()
     return jsonify({"mensagem": "Frequencia salva com sucesso"}), 201
 
+def ler_data_reuniao(valor):
+    for formato in ('%Y-%m-%d %H:%M', '%Y-%m-%d'):
+        try:
+            return datetime.strptime(valor, formato)
+        except (TypeError, ValueError):
+            pass
+    raise ParametroInvalido(f"Data invalida: {valor!r} (use AAAA-MM-DD ou AAAA-MM-DD HH:MM)")
+
+def reuniao_do_lote(item):
+    """Reunião pelo id ou (para registros feitos offline) pela célula + dia, criando se faltar.
+    Retorna (reuniao, criada)."""
+    if item.get('reuniao_id') is not None:
+        reuniao = Reuniao.query.get(item['reuniao_id'])
+        if not reuniao:
+            raise ParametroInvalido(f"Reuniao {item['reuniao_id']} nao encontrada")
+        return reuniao, False
+
+    if not isinstance(item.get('celula_id'), int) or not item.get('data'):
+        raise ParametroInvalido("Cada item precisa de 'reuniao_id' ou 'celula_id' + 'data'")
+    data_reuniao = ler_data_reuniao(item['data'])
+    dia = datetime(data_reuniao.year, data_reuniao.month, data_reuniao.day)
+    reuniao = Reuniao.query.filter(Reuniao.celula_id == item['celula_id'],
+                                   Reuniao.data >= dia, Reuniao.data < dia + timedelta(days=1)) \
+        .order_by(Reuniao.id).first()
+    if reuniao:
+        return reuniao, False
+    reuniao = Reuniao(celula_id=item['celula_id'], data=data_reuniao,
+                      tema=item.get('tema'), observacoes=item.get('observacoes'))
+    db.session.add(reuniao)
+    db.session.flush()
+    return reuniao, True
+
+@app.route('/api/frequencia/lote', methods=['POST'])
+@autenticado(campo_legado='membro_id')
+def frequencia_lote():
+    """Sincroniza a frequência de várias reuniões numa transação só.
+    { "reunioes": [
+        { "reuniao_id": 7, "presentes": [1, 2], "ausentes": [3] },
+        { "ref": "offline-1", "celula_id": 2, "data": "2026-10-01 20:00", "tema": "...",
+          "presentes": [4], "ausentes": [5, 6] } ] }
+    Membros não citados num item ficam como estão."""
+    if g.claims['tipo'] not in PAPEIS_LIDERANCA:
+        return jsonify({"erro": "Apenas lideres podem registrar frequencia"}), 403
+
+    itens = (request.get_json(silent=True) or {}).get('reunioes')
+    if not isinstance(itens, list) or not itens:
+        raise ParametroInvalido("'reunioes' deve ser uma lista nao vazia")
+    if len(itens) > FREQUENCIA_LOTE_MAXIMO:
+        raise ParametroInvalido(f"No maximo {FREQUENCIA_LOTE_MAXIMO} reunioes por lote")
+
+    try:
+        estados, resultado, celulas = {}, [], set()
+        for item in itens:
+            if not isinstance(item, dict):
+                raise ParametroInvalido("Cada item de 'reunioes' deve ser um objeto")
+            reuniao, criada = reuniao_do_lote(item)
+            celulas.add(reuniao.celula_id)
+            membros = estados.setdefault(reuniao.id, {})
+            membros.update({mid: False for mid in ids_validos(item.get('ausentes', []), 'ausentes')})
+            membros.update({mid: True for mid in ids_validos(item.get('presentes', []), 'presentes')})
+            resultado.append({"ref": item.get('ref'), "reuniao_id": reuniao.id, "criada": criada})
+
+        # Escopo pelas claims: líder de uma célula não mexe na frequência de outra
+        fora = celulas_fora_do_escopo(g.claims, celulas)
+        if fora:
+            db.session.rollback()
+            return jsonify({"erro": f"Sem permissao para as celulas {sorted(fora)}"}), 403
+
+        citados = {mid for membros in estados.values() for mid in membros}
+        existentes = {mid for (mid,) in db.session.query(Membro.id).filter(Membro.id.in_(citados))} if citados else set()
+        if citados - existentes:
+            raise ParametroInvalido(f"Membros inexistentes: {sorted(citados - existentes)}")
+
+        diffs = aplicar_frequencias(estados)
+        atualizar_frequencia_semanal(semanas_das_reunioes(list(estados)))
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        raise ParametroInvalido("Lote referencia membro inexistente")
+    except Exception:
+        db.session.rollback()
+        raise
+
+    # Itens repetidos da mesma reunião compartilham o diff
+    for r in resultado:
+        r.update(diffs[r["reuniao_id"]])
+    return jsonify({"reunioes": resultado}), 200
+
 @app.route('/api/estudos', methods=['GET'])
+@condicional(Estudo)
+@cache_resposta(Estudo)
 def get_estudos():
-    estudos = Estudo.query.all()
-    return jsonify([e.to_json() for e in estudos])
+    campos = parametro_fields(Estudo)
+    estudos = aplicar_campos(Estudo.query, Estudo, campos).all()
+    return jsonify([e.to_json(campos) for e in estudos])
+
+# --- RELATÓRIOS (consolidado semanal de frequência) ---
+# Sem @condicional: o período padrão (últimas 12 semanas) anda com a data, não com as tabelas
+RELATORIO_SEMANAS_PADRAO = 12
+
+def inicio_da_semana(data):
+    # Semana ISO começa na segunda-feira
+    data = data.date() if isinstance(data, datetime) else data
+    return data - timedelta(days=data.weekday())
+
+def semanas_das_reunioes(reuniao_ids):
+    """{(celula_id, segunda-feira)} das reuniões (lista de ids ou subquery)."""
+    if isinstance(reuniao_ids, (list, set, tuple)) and not reuniao_ids:
+        return set()
+    return {(celula_id, inicio_da_semana(data))
+            for celula_id, data in db.session.query(Reuniao.celula_id, Reuniao.data).filter(Reuniao.id.in_(reuniao_ids))
+            if data}
+
+def atualizar_frequencia_semanal(semanas):
+    """Recalcula só as semanas afetadas a partir das reuniões/frequências daquela semana.
+    Chamar antes do commit de quem gravou. Não faz commit."""
+    linhas, vazias = [], []
+    for celula_id, semana in semanas:
+        inicio = datetime(semana.year, semana.month, semana.day)
+        fim = inicio + timedelta(days=7)
+        da_semana = (Reuniao.celula_id == celula_id, Reuniao.data >= inicio, Reuniao.data < fim)
+        reunioes = db.session.query(func.count(Reuniao.id)).filter(*da_semana).scalar()
+        if not reunioes:
+            vazias.append((celula_id, semana))
+            continue
+        presencas, participantes, visitantes = db.session.query(
+            func.count(Frequencia.id),
+            func.count(distinct(Frequencia.membro_id)),
+            func.count(distinct(case((Membro.tipo == 'Visitante', Frequencia.membro_id))))
+        ).join(Reuniao, Reuniao.id == Frequencia.reuniao_id) \
+         .outerjoin(Membro, Membro.id == Frequencia.membro_id) \
+         .filter(Frequencia.presente == True, *da_semana).one()
+        linhas.append({"celula_id": celula_id, "semana": semana, "reunioes": reunioes,
+                       "presencas": presencas, "participantes": participantes,
+                       "visitantes": visitantes, "atualizado_em": datetime.utcnow()})
+
+    upsert(FrequenciaSemanal, linhas, ['celula_id', 'semana'],
+           ['reunioes', 'presencas', 'participantes', 'visitantes', 'atualizado_em'])
+    for celula_id, semana in vazias:
+        FrequenciaSemanal.query.filter_by(celula_id=celula_id, semana=semana).delete()
+
+def reconstruir_frequencia_semanal():
+    FrequenciaSemanal.query.delete()
+    atualizar_frequencia_semanal(semanas_das_reunioes(select(Reuniao.id)))
+
+@event.listens_for(Session, 'after_flush')
+def _frequencia_por_tipo(session, flush_context):
+    # "visitantes" depende de Membro.tipo: quem muda de tipo (ex.: Visitante -> Membro, pela
+    # rota ou por update_user_role.py) tem as semanas em que esteve presente recalculadas na
+    # mesma transação
+    membro_ids = {obj.id for obj in session.dirty
+                  if isinstance(obj, Membro) and inspect(obj).attrs['tipo'].history.has_changes()}
+    if not membro_ids:
+        return
+    reunioes = select(Frequencia.reuniao_id).where(Frequencia.membro_id.in_(membro_ids), Frequencia.presente == True)
+    atualizar_frequencia_semanal(semanas_das_reunioes(reunioes))
+
+def parametro_data(nome, padrao):
+    valor = request.args.get(nome)
+    if not valor:
+        return padrao
+    try:
+        return datetime.strptime(valor, '%Y-%m-%d').date()
+    except ValueError:
+        raise ParametroInvalido(f"Parametro '{nome}' invalido (use AAAA-MM-DD)")
+
+def relatorio_frequencia(celulas, por_celula=False):
+    """Totais, série semanal e (opcional) quebra por célula de ?inicio=&fim= (AAAA-MM-DD,
+    padrão: últimas 12 semanas). celulas: id ou subquery de ids. Lê só frequencia_semanal."""
+    fim = parametro_data('fim', datetime.utcnow().date())
+    inicio = parametro_data('inicio', fim - timedelta(weeks=RELATORIO_SEMANAS_PADRAO))
+    if inicio > fim:
+        raise ParametroInvalido("'inicio' deve ser anterior a 'fim'")
+
+    filtro = [FrequenciaSemanal.semana >= inicio_da_semana(inicio), FrequenciaSemanal.semana <= fim]
+    filtro.append(FrequenciaSemanal.celula_id == celulas if isinstance(celulas, int)
+                  else FrequenciaSemanal.celula_id.in_(celulas))
+    somas = [func.sum(FrequenciaSemanal.reunioes), func.sum(FrequenciaSemanal.presencas),
+             func.sum(FrequenciaSemanal.participantes), func.sum(FrequenciaSemanal.visitantes)]
+
+    def linha(r, **extra):
+        return dict(extra, reunioes=r[0] or 0, presencas=r[1] or 0, participantes=r[2] or 0, visitantes=r[3] or 0)
+
+    semanas = []
+    for r in db.session.query(*somas, FrequenciaSemanal.semana).filter(*filtro) \
+            .group_by(FrequenciaSemanal.semana).order_by(FrequenciaSemanal.semana):
+        ano, numero, _ = r[4].isocalendar()
+        semanas.append(linha(r, semana=f"{ano}-W{numero:02d}", inicio=r[4].isoformat()))
+
+    reunioes = sum(s["reunioes"] for s in semanas)
+    presencas = sum(s["presencas"] for s in semanas)
+    resultado = {
+        "inicio": inicio.isoformat(),
+        "fim": fim.isoformat(),
+        "totais": {
+            "reunioes": reunioes,
+            "presencas": presencas,
+            "visitantes": sum(s["visitantes"] for s in semanas), # soma semanal (visitas)
+            "media_presencas_por_reuniao": round(presencas / reunioes, 1) if reunioes else 0,
+            "media_participantes_por_semana": round(sum(s["participantes"] for s in semanas) / len(semanas), 1) if semanas else 0,
+        },
+        "semanas": semanas,
+    }
+    if por_celula:
+        resultado["celulas"] = [linha(r, celula_id=r[4]) for r in
+            db.session.query(*somas, FrequenciaSemanal.celula_id).filter(*filtro)
+            .group_by(FrequenciaSemanal.celula_id).order_by(FrequenciaSemanal.celula_id)]
+    return resultado
 
 @app.route('/api/relatorio/celula/<int:celula_id>')
 def get_relatorio_celula(celula_id):
-    # Exemplo simples de estatísticas
-    total_membros = Membro.query.filter_by(celula_id=celula_id, tipo='Membro').count()
-    total_visitantes = Membro.query.filter_by(celula_id=celula_id, tipo='Visitante').count()
-    
-    # Média de presença nas últimas 4 reuniões (exemplo simplificado)
-    reunioes_ids = [r.id for r in Reuniao.query.filter_by(celula_id=celula_id).order_by(Reuniao.data.desc()).limit(4).all()]
-    media_frequencia = 0
-    if reunioes_ids:
-        total_presencas = Frequencia.query.filter(Frequencia.reuniao_id.in_(reunioes_ids), Frequencia.presente==True).count()
-        media_frequencia = total_presencas / len(reunioes_ids)
-
-    return jsonify({
-        "total_membros": total_membros,
-        "total_visitantes": total_visitantes,
-        "media_frequencia_ultimas_4": round(media_frequencia, 1)
-    })
+    por_tipo = dict(db.session.query(Membro.tipo, func.count(Membro.id))
+                    .filter(Membro.celula_id == celula_id, Membro.tipo.in_(['Membro', 'Visitante']))
+                    .group_by(Membro.tipo))
+
+    # Média de presença das últimas 4 semanas com reunião (a partir do consolidado)
+    recentes = FrequenciaSemanal.query.filter(FrequenciaSemanal.celula_id == celula_id, FrequenciaSemanal.reunioes > 0) \
+        .order_by(FrequenciaSemanal.semana.desc()).limit(4).all()
+    total_reunioes = sum(r.reunioes for r in recentes)
+    media_frequencia = sum(r.presencas for r in recentes) / total_reunioes if total_reunioes else 0
+
+    return jsonify(dict(relatorio_frequencia(celula_id),
+        nivel="celula", id=celula_id,
+        total_membros=por_tipo.get('Membro', 0),
+        total_visitantes=por_tipo.get('Visitante', 0),
+        media_frequencia_ultimas_4=round(media_frequencia, 1)
+    ))
+
+@app.route('/api/relatorio/geracao/<int:geracao_id>')
+def get_relatorio_geracao(geracao_id):
+    return jsonify(dict(relatorio_frequencia(celulas_do_escopo(geracao_id=geracao_id), por_celula=True),
+                        nivel="geracao", id=geracao_id))
+
+@app.route('/api/relatorio/rede/<int:rede_id>')
+def get_relatorio_rede(rede_id):
+    return jsonify(dict(relatorio_frequencia(celulas_do_escopo(rede_id=rede_id), por_celula=True),
+                        nivel="rede", id=rede_id))
 
 # Rota para setup inicial rápido
 @app.route('/api/update_profile/<int:user_id>', methods=['PUT'])
@@ -1092,6 +3972,205 @@ def change_password(user_id):
         print(f"Erro troca senha: {e}")
         return jsonify({"erro": str(e)}), 500
 
+# --- UPLOAD DE IMAGENS ---
+# O arquivo é nomeado pelo sha256 do conteúdo (duplicados ficam uma vez só). A resposta sai
+# logo após gravar o bruto (<hash>.orig); um pool de threads nativas corrige a orientação,
+# remove metadados (EXIF/GPS) e gera <hash>.jpg (mestre) e <hash>_<tamanho>.webp/.jpg.
+# Enquanto isso o GET serve o que já existir (ou o bruto), sem esperar o processamento.
+TAMANHOS_IMAGEM = {
+    # tamanho: (largura, altura, recorte quadrado)
+    64: (64, 64, True),
+    256: (256, 256, True),
+    1080: (1080, 1920, False),
+    1280: (1280, 1280, False),
+}
+VARIANTES_UPLOAD = {
+    'avatar': (64, 256),
+    'story': (256, 1080),
+    'banner': (1280,),
+}
+IMAGEM_LADO_MAXIMO = 2048
+IMAGEM_QUALIDADE = 82
+NOME_HASH = re.compile(r'[0-9a-f]{32}')
+
+def criar_pool_imagens(workers):
+    # No worker gevent (Procfile) o threading é monkey-patched: um ThreadPoolExecutor comum
+    # rodaria o Pillow como greenlet e travaria o worker inteiro (e os streams SSE) durante o
+    # resize. O pool do gevent usa threads nativas; o lock precisa ser o nativo porque é tomado
+    # pelo callback de fim, que roda nessas threads.
+    try:
+        from gevent import monkey
+        if monkey.is_module_patched('threading'):
+            from gevent.threadpool import ThreadPoolExecutor as ExecutorNativo
+            return ExecutorNativo(max_workers=workers), monkey.get_original('threading', 'Lock')()
+    except ImportError:
+        pass
+    return ThreadPoolExecutor(max_workers=workers), threading.Lock()
+
+executor_imagens, imagens_lock = criar_pool_imagens(int(os.environ.get('IMAGENS_WORKERS', '2')))
+imagens_pendentes = {}  # hash -> Future do último processamento agendado (só deste processo)
+
+def caminho_upload(nome):
+    return os.path.join(app.config['UPLOAD_FOLDER'], nome)
+
+def gravar_atomico(nome, escrever):
+    # Grava em arquivo temporário e renomeia: ninguém serve um arquivo pela metade
+    destino = caminho_upload(nome)
+    temporario = f"{destino}.{threading.get_ident()}.tmp"
+    try:
+        escrever(temporario)
+        os.replace(temporario, destino)
+    finally:
+        if os.path.exists(temporario):
+            os.remove(temporario)
+
+def gravar_bytes(nome, conteudo):
+    def escrever(caminho):
+        with open(caminho, 'wb') as f:
+            f.write(conteudo)
+    gravar_atomico(nome, escrever)
+
+def gravar_imagem(img, nome, formato):
+    # Salvar sem passar exif= descarta os metadados do original
+    gravar_atomico(nome, lambda caminho: img.save(caminho, formato, quality=IMAGEM_QUALIDADE, optimize=formato == 'JPEG'))
+
+def abrir_origem(digest):
+    # O bruto some quando outro processamento do mesmo arquivo termina; aí o mestre já existe
+    try:
+        return Image.open(caminho_upload(f"{digest}.orig"))
+    except FileNotFoundError:
+        return Image.open(caminho_upload(f"{digest}.jpg"))
+
+def processar_imagem(digest, tamanhos):
+    bruto = f"{digest}.orig"
+    try:
+        with abrir_origem(digest) as original:
+            img = ImageOps.exif_transpose(original)
+            if img.mode in ('RGBA', 'LA', 'P'):
+                img = img.convert('RGBA')
+                fundo = Image.new('RGB', img.size, (255, 255, 255))
+                fundo.paste(img, mask=img.split()[-1])
+                img = fundo
+            elif img.mode != 'RGB':
+                img = img.convert('RGB')
+
+            mestre = img.copy()
+            mestre.thumbnail((IMAGEM_LADO_MAXIMO, IMAGEM_LADO_MAXIMO))
+            gravar_imagem(mestre, f"{digest}.jpg", 'JPEG')
+
+            for tamanho in tamanhos:
+                largura, altura, quadrado = TAMANHOS_IMAGEM[tamanho]
+                if quadrado:
+                    variante = ImageOps.fit(img, (largura, altura))
+                else:
+                    variante = img.copy()
+                    variante.thumbnail((largura, altura))
+                gravar_imagem(variante, f"{digest}_{tamanho}.webp", 'WEBP')
+                gravar_imagem(variante, f"{digest}_{tamanho}.jpg", 'JPEG')
+        if os.path.exists(caminho_upload(bruto)):
+            os.remove(caminho_upload(bruto))
+    except FileNotFoundError:
+        pass # Outro upload do mesmo arquivo já processou e removeu o bruto
+    except Exception as e:
+        print(f"Erro ao processar imagem {digest}: {e}")
+
+def agendar_processamento(digest, tamanhos):
+    # O submit fica fora do lock: no pool do gevent ele cede a vez enquanto espera um slot
+    futuro = executor_imagens.submit(processar_imagem, digest, tamanhos)
+    with imagens_lock:
+        imagens_pendentes[digest] = futuro
+
+    def liberar(concluido):
+        # Um upload repetido pode ter agendado outro job para o mesmo hash: só remove o próprio
+        with imagens_lock:
+            if imagens_pendentes.get(digest) is concluido:
+                del imagens_pendentes[digest]
+    futuro.add_done_callback(liberar)
+
+def salvar_upload(file, tipo=None):
+    """Grava o upload e agenda as variantes. Retorna a URL pública (/uploads/<hash>.<ext>)."""
+    conteudo = file.read()
+    if not conteudo:
+        raise ParametroInvalido("Arquivo vazio")
+    digest = hashlib.sha256(conteudo).hexdigest()[:32]
+
+    if Image is None:
+        extensao = os.path.splitext(secure_filename(file.filename))[1].lower() or '.bin'
+        nome = digest + extensao
+        if not os.path.exists(caminho_upload(nome)):
+            gravar_bytes(nome, conteudo)
+        return f"/uploads/{nome}"
+
+    try:
+        with Image.open(io.BytesIO(conteudo)) as img:
+            img.verify()
+    except Exception:
+        raise ParametroInvalido("Arquivo nao e uma imagem valida")
+
+    tamanhos = VARIANTES_UPLOAD.get(tipo) or tuple(TAMANHOS_IMAGEM)
+    faltando = [t for t in tamanhos if not os.path.exists(caminho_upload(f"{digest}_{t}.webp"))]
+    if faltando or not os.path.exists(caminho_upload(f"{digest}.jpg")):
+        if not os.path.exists(caminho_upload(f"{digest}.jpg")):
+            gravar_bytes(f"{digest}.orig", conteudo)
+        agendar_processamento(digest, faltando)
+    return f"/uploads/{digest}.jpg"
+
+def resolver_variante(filename, tamanho=None):
+    """Arquivo a servir para /uploads/<filename>?tamanho=N. Nomes antigos passam direto.
+    Retorna (nome, mimetype, definitivo); definitivo=False quando um upload futuro ou o
+    processamento em andamento pode mudar o que essa URL entrega (não pode ser imutável)."""
+    digest, extensao = os.path.splitext(filename)
+    if not NOME_HASH.fullmatch(digest) or extensao != '.jpg':
+        return filename, None, False
+
+    with imagens_lock:
+        pendente = digest in imagens_pendentes
+
+    if tamanho and tamanho.isdigit():
+        pedido = int(tamanho)
+        formato = 'webp' if 'image/webp' in request.headers.get('Accept', '') else 'jpg'
+        disponiveis = sorted(t for t in TAMANHOS_IMAGEM if os.path.exists(caminho_upload(f"{digest}_{t}.{formato}")))
+        # Menor variante que cobre o pedido; senão a maior que existir
+        maiores = [t for t in disponiveis if t >= pedido]
+        escolhido = maiores[0] if maiores else (disponiveis[-1] if disponiveis else None)
+        if escolhido:
+            return f"{digest}_{escolhido}.{formato}", None, escolhido >= pedido and not pendente
+
+    if not os.path.exists(caminho_upload(filename)) and os.path.exists(caminho_upload(f"{digest}.orig")):
+        # Processamento ainda em andamento (aqui ou em outro worker): serve o bruto por enquanto
+        return f"{digest}.orig", 'image/jpeg', False
+    return filename, None, not tamanho and not pendente
+
+def arquivos_do_upload(url):
+    # Nomes em disco de uma URL /uploads/... (para hash: mestre, bruto e variantes)
+    if not url or not url.startswith('/uploads/'):
+        return []
+    nome = os.path.basename(url.split('?')[0])
+    digest, extensao = os.path.splitext(nome)
+    if NOME_HASH.fullmatch(digest) and extensao == '.jpg':
+        return [nome, f"{digest}.orig"] + [f"{digest}_{t}.{f}" for t in TAMANHOS_IMAGEM for f in ('webp', 'jpg')]
+    return [nome]
+
+def remover_uploads_orfaos(urls):
+    """Apaga do disco os uploads que nenhuma linha (story, membro, evento, escola) referencia mais.
+    Chamar depois do commit que removeu as referências."""
+    urls = {u for u in urls if u and u.startswith('/uploads/')}
+    if not urls:
+        return 0
+    referenciadas = set()
+    for modelo in (Story, Membro, Evento, Escola):
+        # Linhas com exclusão lógica ainda não purgadas continuam valendo como referência
+        referenciadas.update(u for (u,) in db.session.query(modelo.foto_url).filter(modelo.foto_url.in_(urls))
+                             .execution_options(incluir_excluidos=True))
+    removidos = 0
+    for url in urls - referenciadas:
+        for nome in arquivos_do_upload(url):
+            caminho = caminho_upload(nome)
+            if os.path.exists(caminho):
+                os.remove(caminho)
+                removidos += 1
+    return removidos
+
 @app.route('/api/upload_foto/<int:user_id>', methods=['POST'])
 def upload_foto(user_id):
     if 'foto' not in request.files:
@@ -1102,14 +4181,13 @@ def upload_foto(user_id):
         return jsonify({"erro": "Nenhum arquivo selecionado"}), 400
         
     if file:
-        filename = secure_filename(f"user_{user_id}_{int(datetime.now().timestamp())}_{file.filename}")
-        file.save(os.path.join(app.config['UPLOAD_FOLDER'], filename))
+        url = salvar_upload(file, 'avatar')
         
         # Atualiza usuario
         membro = Membro.query.get(user_id)
         if membro:
-            # Remove foto antiga se existir (opcional, bom para economizar espaço)
-            membro.foto_url = f"/uploads/{filename}"
+            # A foto antiga não é removida: o arquivo pode ser compartilhado (nome por hash)
+            membro.foto_url = url
             db.session.commit()
             return jsonify({"mensagem": "Foto atualizada", "foto_url": membro.foto_url}), 200
             
@@ -1122,8 +4200,9 @@ def upload_foto(user_id):
 def handle_eventos():
     if request.method == 'GET':
         # Ordena por data (mais próximo primeiro)
-        eventos = Evento.query.order_by(Evento.data_evento.asc()).all()
-        return jsonify([e.to_json() for e in eventos])
+        campos = parametro_fields(Evento)
+        eventos = aplicar_campos(Evento.query, Evento, campos).order_by(Evento.data_evento.asc()).all()
+        return jsonify([e.to_json(campos=campos) for e in eventos])
 
     if request.method == 'POST':
         data = request.json # Esperamos JSON, mas upload de imagem precisa ser separado ou base64?
@@ -1163,44 +4242,97 @@ def handle_evento_id(id):
         return jsonify(evento.to_json())
 
     if request.method == 'DELETE':
-        # Remove dependencias
-        Curtida.query.filter_by(evento_id=id).delete()
-        Comentario.query.filter_by(evento_id=id).delete()
-        db.session.delete(evento)
+        # Exclusão lógica; curtidas e comentários (com todas as respostas) saem na purga
+        excluir_logicamente(evento)
         db.session.commit()
+        agendar_purga()
         return jsonify({"mensagem": "Evento removido"}), 200
 
 # 2. STORIES
+# Stories expirados são apagados em lotes (linhas e arquivos órfãos) por uma thread do
+# próprio app a cada STORIES_LIMPEZA_MIN minutos (0 desliga) ou por limpar_stories.py (cron).
+STORIES_LIMPEZA_MIN = int(os.environ.get('STORIES_LIMPEZA_MIN', '30'))
+STORIES_LIMPEZA_LOTE = 500
+
+def limpar_stories_expirados(lote=STORIES_LIMPEZA_LOTE, agora=None):
+    agora = agora or datetime.utcnow()
+    total_linhas, total_arquivos = 0, 0
+    while True:
+        expirados = db.session.query(Story.id, Story.foto_url) \
+            .filter(Story.expira_em <= agora).order_by(Story.expira_em).limit(lote).all()
+        if not expirados:
+            break
+        Story.query.filter(Story.id.in_([s.id for s in expirados])).delete(synchronize_session=False)
+        db.session.commit()
+        total_linhas += len(expirados)
+        total_arquivos += remover_uploads_orfaos([s.foto_url for s in expirados])
+        if len(expirados) < lote:
+            break
+    return total_linhas, total_arquivos
+
+limpeza_stories_thread = None
+
+def iniciar_limpeza_stories():
+    # Sobe no primeiro acesso a /api/stories (depois do fork do gunicorn), uma por processo
+    global limpeza_stories_thread
+    if STORIES_LIMPEZA_MIN <= 0 or (limpeza_stories_thread and limpeza_stories_thread.is_alive()):
+        return
+
+    def loop():
+        while True:
+            try:
+                with app.app_context():
+                    linhas, arquivos = limpar_stories_expirados()
+                    if linhas:
+                        print(f"Stories expirados removidos: {linhas} ({arquivos} arquivos)")
+                    db.session.remove()
+            except Exception as e:
+                print(f"Erro na limpeza de stories: {e}")
+            time.sleep(STORIES_LIMPEZA_MIN * 60)
+
+    limpeza_stories_thread = threading.Thread(target=loop, daemon=True)
+    limpeza_stories_thread.start()
+
 @app.route('/api/stories', methods=['GET', 'POST'])
+@autenticado(campo_legado='autor_id', metodos=['POST'])
 def handle_stories():
+    iniciar_limpeza_stories()
     if request.method == 'GET':
-        # Pega stories das ultimas 24h
-        hoje = datetime.utcnow()
-        ontem = hoje - timedelta(hours=24)
+        # Stories ainda não expirados (janela de 24h; o limite em criado_em deixa usar o
+        # índice (rede_id, geracao_id, criado_em) quando há filtro de rede/geração)
+        agora = datetime.utcnow()
         
         rede_id = request.args.get('rede_id')
         geracao_id = request.args.get('geracao_id')
         autor_id = request.args.get('autor_id')
         
-        query = Story.query.filter(Story.criado_em >= ontem)
+        campos = parametro_fields(Story)
+        query = aplicar_campos(Story.query, Story, campos) \
+            .filter(Story.expira_em > agora, Story.criado_em >= agora - STORY_DURACAO)
+        if quer(campos, "autor_nome"):
+            query = query.options(joinedload(Story.autor))
         if rede_id: query = query.filter_by(rede_id=rede_id)
         if geracao_id: query = query.filter_by(geracao_id=geracao_id)
         if autor_id: query = query.filter_by(autor_id=autor_id)
         
         stories = query.order_by(Story.criado_em.desc()).all()
-        return jsonify([s.to_json() for s in stories])
+        return jsonify([s.to_json(campos) for s in stories])
 
     if request.method == 'POST':
         data = request.json
         novo = Story(
             foto_url=data['foto_url'],
             legenda=data.get('legenda'),
-            autor_id=data.get('autor_id'),
+            autor_id=g.claims['id'],
             celula_id=data.get('celula_id'),
             rede_id=data.get('rede_id'),
-            geracao_id=data.get('geracao_id')
+            geracao_id=data.get('geracao_id'),
+            expira_em=datetime.utcnow() + STORY_DURACAO
         )
         db.session.add(novo)
+        db.session.flush()
+        publicar('story', {"id": novo.id, "autor_id": novo.autor_id},
+            celula_id=novo.celula_id, geracao_id=novo.geracao_id, rede_id=novo.rede_id)
         db.session.commit()
         return jsonify(novo.to_json()), 201
 
@@ -1210,16 +4342,21 @@ def handle_story_id(story_id):
     if not story:
         return jsonify({"erro": "Story nao encontrado"}), 404
         
+    foto_url = story.foto_url
     db.session.delete(story)
     db.session.commit()
+    remover_uploads_orfaos([foto_url])
     return jsonify({"mensagem": "Story removido"}), 200
 
 # 3. ESCOLAS
 @app.route('/api/escolas', methods=['GET', 'POST', 'PUT'])
+@condicional(Escola)
+@cache_resposta(Escola)
 def handle_escolas():
     if request.method == 'GET':
-        escolas = Escola.query.all()
-        return jsonify([e.to_json() for e in escolas])
+        campos = parametro_fields(Escola)
+        escolas = aplicar_campos(Escola.query, Escola, campos).all()
+        return jsonify([e.to_json(campos) for e in escolas])
     
     # POST/PUT para admin editar (implementaremos o básico GET primeiro)
     return jsonify({"msg": "Admin only"}), 403
@@ -1233,10 +4370,10 @@ def upload_general():
     if file.filename == '':
         return jsonify({'error': 'No filename'}), 400
         
-    filename = secure_filename(f"upload_{int(datetime.now().timestamp())}_{file.filename}")
-    file.save(os.path.join(app.config['UPLOAD_FOLDER'], filename))
+    # tipo=story|banner define as variantes geradas (sem tipo gera todas)
+    url = salvar_upload(file, request.form.get('tipo'))
     
-    return jsonify({'url': f"/uploads/{filename}"}), 200
+    return jsonify({'url': url}), 200
 
 @app.route('/setup_test')
 def setup_test():
@@ -1253,6 +4390,8 @@ def setup_test():
         
         r = Reuniao(celula_id=c.id, tema="Fé", observacoes="Reunião abençoada")
         db.session.add(r)
+        db.session.flush()
+        atualizar_frequencia_semanal(semanas_das_reunioes([r.id]))
         db.session.commit()
         
         est = Estudo(titulo="A Importância da Oração", conteudo_link="http://link.com/pdf")
@@ -1262,6 +4401,8 @@ def setup_test():
     return jsonify({"message": "Dados de teste criados!"})
 
 @app.route('/api/celulas/<int:celula_id>/avisos', methods=['GET', 'POST'])
+@condicional(Aviso, Membro, Curtida, Celula, Geracao)
+@autenticado(campo_legado='autor_id', metodos=['POST'])
 def handle_avisos(celula_id):
     if request.method == 'GET':
         # Mural da Célula deve mostrar avisos da própria célula + rede + geração dela
@@ -1269,22 +4410,27 @@ def handle_avisos(celula_id):
         if not celula:
              return jsonify([]), 404
              
-        avisos = Aviso.query.filter(
+        campos = parametro_fields(Aviso)
+        query = Aviso.query.filter(
             (Aviso.celula_id == celula_id) | 
-            (Aviso.rede_id == celula.rede_id) | 
-            (Aviso.geracao_id == celula.geracao_id)
-        ).order_by(Aviso.data_criacao.desc()).all()
+            (Aviso.rede_id.in_(ancestrais_da_celula(celula_id, 'rede'))) | 
+            (Aviso.geracao_id.in_(ancestrais_da_celula(celula_id, 'geracao')))
+        )
+        if json_no_banco():
+            return resposta_feed_json(query, Aviso, aviso_json(usuario_atual_id(), campos))
+        if quer(campos, "autor_nome"):
+            query = query.options(joinedload(Aviso.autor))
+        avisos, next_cursor = paginar_feed(query, Aviso, campos)
         
-        user_id = request.headers.get('User-Id')
-        try: user_id = int(user_id) if user_id else None
-        except: user_id = None
+        user_id = usuario_atual_id()
 
-        return jsonify([a.to_json(current_user_id=user_id) for a in avisos])
+        curtidos = ids_curtidos(Curtida.aviso_id, user_id, [a.id for a in avisos]) if quer(campos, "curtido_por_mim") else set()
+        return resposta_feed([a.to_json(current_user_id=user_id, curtidos=curtidos, campos=campos) for a in avisos], next_cursor)
     
     if request.method == 'POST':
         data = request.json
-        membro = Membro.query.get(data.get('autor_id'))
-        if not membro or membro.tipo not in ['Lider', 'LiderRede', 'LiderGeracao', 'Admin']:
+        # Papel vem das claims do token (sem consultar o membro)
+        if g.claims['tipo'] not in PAPEIS_LIDERANCA:
              return jsonify({"error": "Apenas lideres podem postar avisos"}), 403
              
         novo = Aviso(
@@ -1293,51 +4439,50 @@ def handle_avisos(celula_id):
             geracao_id=data.get('geracao_id'),
             titulo=data['titulo'],
             mensagem=data['mensagem'],
-            autor_id=data['autor_id']
+            autor_id=g.claims['id']
         )
         db.session.add(novo)
+        db.session.flush()
+        publicar('aviso', {"id": novo.id, "titulo": novo.titulo},
+            celula_id=novo.celula_id, geracao_id=novo.geracao_id, rede_id=novo.rede_id)
         db.session.commit()
         return jsonify(novo.to_json()), 201
 
 # Rota genérica para avisos (Feed Global/Rede)
 @app.route('/api/avisos', methods=['GET'])
+@condicional(Aviso, Membro, Curtida, Celula, Geracao)
 def get_all_avisos():
     rede_id = request.args.get('rede_id')
     geracao_id = request.args.get('geracao_id')
     autor_id = request.args.get('autor_id')
+    campos = parametro_fields(Aviso)
     
     query = Aviso.query
+    if quer(campos, "autor_nome") and not json_no_banco():
+        query = query.options(joinedload(Aviso.autor))
     if rede_id:
-        # Pega gerações e células dessa rede
-        gens = Geracao.query.filter_by(rede_id=rede_id).all()
-        g_ids = [g.id for g in gens]
-        cells = Celula.query.filter_by(rede_id=rede_id).all()
-        c_ids = [c.id for c in cells]
-        
+        # Gerações e células dessa rede, resolvidas no próprio SQL (índice de hierarquia)
         query = query.filter(
             (Aviso.rede_id == rede_id) | 
-            (Aviso.geracao_id.in_(g_ids)) |
-            (Aviso.celula_id.in_(c_ids))
+            (Aviso.geracao_id.in_(geracoes_da_rede(rede_id))) |
+            (Aviso.celula_id.in_(celulas_do_escopo(rede_id=rede_id)))
         )
     elif geracao_id:
-        # Pega células dessa geração
-        cells = Celula.query.filter_by(geracao_id=geracao_id).all()
-        c_ids = [c.id for c in cells]
-
         query = query.filter(
             (Aviso.geracao_id == geracao_id) |
-            (Aviso.celula_id.in_(c_ids))
+            (Aviso.celula_id.in_(celulas_do_escopo(geracao_id=geracao_id)))
         )
     
     if autor_id: query = query.filter_by(autor_id=autor_id)
     
-    avisos = query.order_by(Aviso.data_criacao.desc()).all()
+    if json_no_banco():
+        return resposta_feed_json(query, Aviso, aviso_json(usuario_atual_id(), campos))
+    avisos, next_cursor = paginar_feed(query, Aviso, campos)
     
-    user_id = request.headers.get('User-Id')
-    try: user_id = int(user_id) if user_id else None
-    except: user_id = None
+    user_id = usuario_atual_id()
 
-    return jsonify([a.to_json(current_user_id=user_id) for a in avisos])
+    curtidos = ids_curtidos(Curtida.aviso_id, user_id, [a.id for a in avisos]) if quer(campos, "curtido_por_mim") else set()
+    return resposta_feed([a.to_json(current_user_id=user_id, curtidos=curtidos, campos=campos) for a in avisos], next_cursor)
 
 @app.route('/api/avisos/<int:aviso_id>', methods=['DELETE', 'PUT'])
 def handle_aviso_id(aviso_id):
@@ -1359,16 +4504,22 @@ def handle_aviso_id(aviso_id):
         return jsonify({"mensagem": "Aviso atualizado", "aviso": aviso.to_json()}), 200
 
 @app.route('/api/celulas/<int:celula_id>/pedidos', methods=['GET', 'POST'])
+@condicional(PedidoOracao, Membro)
+@autenticado(campo_legado='membro_id', metodos=['POST'])
 def handle_pedidos(celula_id):
     if request.method == 'GET':
-        pedidos = PedidoOracao.query.filter_by(celula_id=celula_id).order_by(PedidoOracao.data_criacao.desc()).all()
-        return jsonify([p.to_json() for p in pedidos])
+        campos = parametro_fields(PedidoOracao)
+        query = PedidoOracao.query.filter_by(celula_id=celula_id)
+        if quer(campos, "autor_nome") or quer(campos, "autor_foto"):
+            query = query.options(joinedload(PedidoOracao.autor))
+        pedidos, next_cursor = paginar_feed(query, PedidoOracao, campos)
+        return resposta_feed([p.to_json(campos) for p in pedidos], next_cursor)
     
     if request.method == 'POST':
         data = request.json
         novo = PedidoOracao(
             celula_id=celula_id,
-            membro_id=data['membro_id'],
+            membro_id=g.claims['id'],
             pedido=data['pedido']
         )
         db.session.add(novo)
@@ -1377,22 +4528,20 @@ def handle_pedidos(celula_id):
 
 # Rota genérica para pedidos (Para Líderes verem tudo da Rede/Geração)
 @app.route('/api/pedidos', methods=['GET'])
+@condicional(PedidoOracao, Membro, Celula, Geracao)
 def get_all_pedidos():
     rede_id = request.args.get('rede_id')
     geracao_id = request.args.get('geracao_id')
     
     query = PedidoOracao.query
-    if rede_id:
-        cells = Celula.query.filter_by(rede_id=rede_id).all()
-        c_ids = [c.id for c in cells]
-        query = query.filter(PedidoOracao.celula_id.in_(c_ids))
-    elif geracao_id:
-        cells = Celula.query.filter_by(geracao_id=geracao_id).all()
-        c_ids = [c.id for c in cells]
-        query = query.filter(PedidoOracao.celula_id.in_(c_ids))
+    if rede_id or geracao_id:
+        query = query.filter(PedidoOracao.celula_id.in_(celulas_do_escopo(rede_id, geracao_id)))
         
-    pedidos = query.order_by(PedidoOracao.data_criacao.desc()).all()
-    return jsonify([p.to_json() for p in pedidos])
+    campos = parametro_fields(PedidoOracao)
+    if quer(campos, "autor_nome") or quer(campos, "autor_foto"):
+        query = query.options(joinedload(PedidoOracao.autor))
+    pedidos, next_cursor = paginar_feed(query, PedidoOracao, campos)
+    return resposta_feed([p.to_json(campos) for p in pedidos], next_cursor)
 
 @app.route('/api/pedidos/<int:pedido_id>/resolver', methods=['PUT'])
 def resolver_pedido(pedido_id):
@@ -1404,16 +4553,22 @@ def resolver_pedido(pedido_id):
     return jsonify(pedido.to_json())
 
 @app.route('/api/celulas/<int:celula_id>/testemunhos', methods=['GET', 'POST'])
+@condicional(Testemunho, Membro)
+@autenticado(campo_legado='membro_id', metodos=['POST'])
 def handle_testemunhos(celula_id):
     if request.method == 'GET':
-        testemunhos = Testemunho.query.filter_by(celula_id=celula_id).order_by(Testemunho.data_criacao.desc()).all()
-        return jsonify([t.to_json() for t in testemunhos])
+        campos = parametro_fields(Testemunho)
+        query = Testemunho.query.filter_by(celula_id=celula_id)
+        if quer(campos, "autor_nome") or quer(campos, "autor_foto"):
+            query = query.options(joinedload(Testemunho.autor))
+        testemunhos, next_cursor = paginar_feed(query, Testemunho, campos)
+        return resposta_feed([t.to_json(campos) for t in testemunhos], next_cursor)
     
     if request.method == 'POST':
         data = request.json
         novo = Testemunho(
             celula_id=celula_id,
-            membro_id=data['membro_id'],
+            membro_id=g.claims['id'],
             texto=data['texto']
         )
         db.session.add(novo)
@@ -1422,22 +4577,20 @@ def handle_testemunhos(celula_id):
 
 # Rota genérica para testemunhos
 @app.route('/api/testemunhos', methods=['GET'])
+@condicional(Testemunho, Membro, Celula, Geracao)
 def get_all_testemunhos():
     rede_id = request.args.get('rede_id')
     geracao_id = request.args.get('geracao_id')
     
     query = Testemunho.query
-    if rede_id:
-        cells = Celula.query.filter_by(rede_id=rede_id).all()
-        c_ids = [c.id for c in cells]
-        query = query.filter(Testemunho.celula_id.in_(c_ids))
-    elif geracao_id:
-        cells = Celula.query.filter_by(geracao_id=geracao_id).all()
-        c_ids = [c.id for c in cells]
-        query = query.filter(Testemunho.celula_id.in_(c_ids))
+    if rede_id or geracao_id:
+        query = query.filter(Testemunho.celula_id.in_(celulas_do_escopo(rede_id, geracao_id)))
         
-    testemunhos = query.order_by(Testemunho.data_criacao.desc()).all()
-    return jsonify([t.to_json() for t in testemunhos])
+    campos = parametro_fields(Testemunho)
+    if quer(campos, "autor_nome") or quer(campos, "autor_foto"):
+        query = query.options(joinedload(Testemunho.autor))
+    testemunhos, next_cursor = paginar_feed(query, Testemunho, campos)
+    return resposta_feed([t.to_json(campos) for t in testemunhos], next_cursor)
 
 if __name__ == '__main__':
     with app.app_context():
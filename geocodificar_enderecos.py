@@ -0,0 +1,16 @@
+import sys
+from app import app, geocodificar_pendentes, GEO_LOTE_WORKERS
+
+# Preenche latitude/longitude de células e membros a partir do endereço (ou CEP), usando o
+# cache de /api/geo e o provedor configurado em GEO_GEOCODE_URL.
+#   python geocodificar_enderecos.py [workers] [limite]
+workers = int(sys.argv[1]) if len(sys.argv) > 1 else GEO_LOTE_WORKERS
+limite = int(sys.argv[2]) if len(sys.argv) > 2 else None
+
+with app.app_context():
+    resultado = geocodificar_pendentes(workers=workers, limite=limite)
+    print(f"Endereços distintos: {resultado['consultas']}")
+    print(f"Já no cache: {resultado['em_cache']}")
+    print(f"Consultados no provedor: {resultado['consultados']}")
+    print(f"Falhas (tentar de novo depois): {resultado['falhas']}")
+    print(f"Registros atualizados: {resultado['atualizados']}")
@@ -0,0 +1,9 @@
+from app import app, db, limpar_stories_expirados
+
+# Remove stories expirados e os arquivos que ficaram sem referência.
+# Para rodar por cron em vez da thread do app (STORIES_LIMPEZA_MIN=0):
+#   */30 * * * * cd /caminho/do/app && python limpar_stories.py
+with app.app_context():
+    linhas, arquivos = limpar_stories_expirados()
+    print(f"Stories removidos: {linhas}")
+    print(f"Arquivos removidos: {arquivos}")
@@ -0,0 +1,16 @@
+from app import app, db, criar_indice_busca, reconstruir_busca
+
+# Índice de busca textual (/api/busca): FTS5 no SQLite, tsvector + unaccent no PostgreSQL.
+# Pode ser rodado de novo para reindexar tudo do zero.
+
+with app.app_context():
+    db.create_all()
+    conn = db.session.connection()
+    criar_indice_busca(conn)
+    db.session.commit()
+    print("Tabela busca_indice criada.")
+
+    total = reconstruir_busca()
+    print(f"{total} registros indexados.")
+    print("Reinicie o servidor para que as escritas passem a atualizar o índice.")
+    print("Migração concluída!")
@@ -0,0 +1,22 @@
+from app import app, db, normalizar_nome
+from sqlalchemy import text
+
+# Coluna celula.dia_reuniao_busca (filtro ?dia= de /api/celulas/proximas) e preenchimento
+with app.app_context():
+    db.create_all()
+    with db.engine.connect() as conn:
+        try:
+            conn.execute(text("ALTER TABLE celula ADD COLUMN dia_reuniao_busca VARCHAR(50)"))
+            conn.commit()
+            print("Coluna dia_reuniao_busca adicionada em celula.")
+        except Exception as e:
+            conn.rollback()
+            print(f"Nota: coluna celula.dia_reuniao_busca provavelmente já existe: {e}")
+
+        linhas = conn.execute(text("SELECT id, dia_reuniao FROM celula WHERE dia_reuniao IS NOT NULL")).all()
+        valores = [{"id": id, "dia": normalizar_nome(dia) or None} for id, dia in linhas]
+        if valores:
+            conn.execute(text("UPDATE celula SET dia_reuniao_busca = :dia WHERE id = :id"), valores)
+        conn.commit()
+        print(f"dia_reuniao_busca preenchido em {len(valores)} células")
+    print("Migração concluída!")
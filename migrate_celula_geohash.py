@@ -0,0 +1,32 @@
+from app import app, db, geohash
+from sqlalchemy import text
+
+# Coluna celula.geohash (busca por proximidade em /api/celulas/proximas), índice e preenchimento
+INDICES = [
+    "CREATE INDEX IF NOT EXISTS ix_celula_geohash ON celula (geohash)",
+]
+
+with app.app_context():
+    db.create_all()
+    with db.engine.connect() as conn:
+        try:
+            conn.execute(text("ALTER TABLE celula ADD COLUMN geohash VARCHAR(12)"))
+            conn.commit()
+            print("Coluna geohash adicionada em celula.")
+        except Exception as e:
+            conn.rollback()
+            print(f"Nota: coluna celula.geohash provavelmente já existe: {e}")
+
+        for sql in INDICES:
+            conn.execute(text(sql))
+            print(f"OK: {sql}")
+
+        linhas = conn.execute(text(
+            "SELECT id, latitude, longitude FROM celula WHERE latitude IS NOT NULL AND longitude IS NOT NULL"
+        )).all()
+        valores = [{"id": id, "geohash": geohash(lat, lng)} for id, lat, lng in linhas]
+        if valores:
+            conn.execute(text("UPDATE celula SET geohash = :geohash WHERE id = :id"), valores)
+        conn.commit()
+        print(f"geohash preenchido em {len(valores)} células")
+    print("Migração concluída!")
@@ -0,0 +1,52 @@
+from app import app, db
+from sqlalchemy import text
+
+# Contadores desnormalizados de curtidas/comentários + unicidade das curtidas
+COLUNAS = [
+    ("evento", "total_curtidas"),
+    ("evento", "total_comentarios"),
+    ("aviso", "total_curtidas"),
+    ("aviso", "total_comentarios"),
+    ("comentario", "total_curtidas"),
+    ("comentario", "total_respostas"),
+]
+
+RECONTAGEM = [
+    "UPDATE evento SET total_curtidas = (SELECT COUNT(*) FROM curtida WHERE curtida.evento_id = evento.id)",
+    "UPDATE evento SET total_comentarios = (SELECT COUNT(*) FROM comentario WHERE comentario.evento_id = evento.id)",
+    "UPDATE aviso SET total_curtidas = (SELECT COUNT(*) FROM curtida WHERE curtida.aviso_id = aviso.id)",
+    "UPDATE aviso SET total_comentarios = (SELECT COUNT(*) FROM comentario WHERE comentario.aviso_id = aviso.id)",
+    "UPDATE comentario SET total_curtidas = (SELECT COUNT(*) FROM curtida_comentario WHERE curtida_comentario.comentario_id = comentario.id)",
+    "UPDATE comentario SET total_respostas = (SELECT COUNT(*) FROM comentario r WHERE r.parent_id = comentario.id)",
+]
+
+# Remove curtidas duplicadas (mantém a mais antiga) antes de criar os índices únicos
+DEDUPLICACAO = [
+    "DELETE FROM curtida WHERE evento_id IS NOT NULL AND id NOT IN (SELECT MIN(id) FROM curtida WHERE evento_id IS NOT NULL GROUP BY evento_id, membro_id)",
+    "DELETE FROM curtida WHERE aviso_id IS NOT NULL AND id NOT IN (SELECT MIN(id) FROM curtida WHERE aviso_id IS NOT NULL GROUP BY aviso_id, membro_id)",
+    "DELETE FROM curtida_comentario WHERE id NOT IN (SELECT MIN(id) FROM curtida_comentario GROUP BY comentario_id, membro_id)",
+]
+
+INDICES = [
+    "CREATE UNIQUE INDEX IF NOT EXISTS uq_curtida_evento_membro ON curtida (evento_id, membro_id)",
+    "CREATE UNIQUE INDEX IF NOT EXISTS uq_curtida_aviso_membro ON curtida (aviso_id, membro_id)",
+    "CREATE UNIQUE INDEX IF NOT EXISTS uq_curtida_comentario_membro ON curtida_comentario (comentario_id, membro_id)",
+]
+
+with app.app_context():
+    db.create_all()
+    with db.engine.connect() as conn:
+        for tabela, coluna in COLUNAS:
+            try:
+                conn.execute(text(f"ALTER TABLE {tabela} ADD COLUMN {coluna} INTEGER NOT NULL DEFAULT 0"))
+                conn.commit()
+                print(f"Coluna {coluna} adicionada em {tabela}.")
+            except Exception as e:
+                conn.rollback()
+                print(f"Nota: coluna {tabela}.{coluna} provavelmente já existe: {e}")
+
+        for sql in DEDUPLICACAO + RECONTAGEM + INDICES:
+            conn.execute(text(sql))
+            print(f"OK: {sql[:80]}...")
+        conn.commit()
+    print("Migração concluída!")
@@ -0,0 +1,24 @@
+from app import app, db
+from sqlalchemy import text
+
+# Exclusão lógica (excluido_em) em membro, celula e evento, com índice para o filtro global.
+# Em comentario a coluna é preenchida junto com o autor ou o evento.
+TABELAS = ['membro', 'celula', 'evento', 'comentario']
+
+with app.app_context():
+    db.create_all()
+    with db.engine.connect() as conn:
+        for tabela in TABELAS:
+            try:
+                conn.execute(text(f"ALTER TABLE {tabela} ADD COLUMN excluido_em TIMESTAMP"))
+                conn.commit()
+                print(f"Coluna excluido_em adicionada em {tabela}.")
+            except Exception as e:
+                conn.rollback()
+                print(f"Nota: coluna {tabela}.excluido_em provavelmente já existe: {e}")
+
+            sql = f"CREATE INDEX IF NOT EXISTS ix_{tabela}_excluido_em ON {tabela} (excluido_em)"
+            conn.execute(text(sql))
+            conn.commit()
+            print(f"OK: {sql}")
+    print("Migração concluída!")
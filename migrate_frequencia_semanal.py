@@ -0,0 +1,11 @@
+from app import app, db, reconstruir_frequencia_semanal, FrequenciaSemanal
+
+# Cria o consolidado semanal de frequência (relatórios) e o preenche com o histórico
+# Rodar de novo reconstrói tudo: use depois de UPDATE em massa de Membro.tipo feito fora do ORM
+# (o recálculo automático da mudança de tipo passa pelo flush)
+with app.app_context():
+    db.create_all()
+    reconstruir_frequencia_semanal()
+    db.session.commit()
+    print(f"Semanas consolidadas: {FrequenciaSemanal.query.count()}")
+    print("Migração concluída!")
@@ -0,0 +1,22 @@
+from app import app, db
+from sqlalchemy import text
+
+# Unicidade (reuniao_id, membro_id) na frequência, usada pelo upsert de /api/frequencia/lote
+# Remove duplicadas (mantém o registro mais recente) antes de criar o índice único
+DEDUPLICACAO = [
+    "DELETE FROM frequencia WHERE id NOT IN (SELECT MAX(id) FROM frequencia GROUP BY reuniao_id, membro_id)",
+]
+
+INDICES = [
+    "CREATE UNIQUE INDEX IF NOT EXISTS uq_frequencia_reuniao_membro ON frequencia (reuniao_id, membro_id)",
+    "CREATE INDEX IF NOT EXISTS ix_reuniao_celula_data ON reuniao (celula_id, data)",
+]
+
+with app.app_context():
+    db.create_all()
+    with db.engine.connect() as conn:
+        for sql in DEDUPLICACAO + INDICES:
+            conn.execute(text(sql))
+            print(f"OK: {sql[:80]}...")
+        conn.commit()
+    print("Migração concluída!")
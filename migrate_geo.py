@@ -0,0 +1,22 @@
+from app import app, db
+from sqlalchemy import text
+
+# Tabela geo_cache (proxy de CEP/geocodificação) e coordenadas do endereço dos membros
+COLUNAS = [
+    ("membro", "latitude"),
+    ("membro", "longitude"),
+]
+
+with app.app_context():
+    db.create_all()
+    print("Tabela geo_cache verificada/criada.")
+    with db.engine.connect() as conn:
+        for tabela, coluna in COLUNAS:
+            try:
+                conn.execute(text(f"ALTER TABLE {tabela} ADD COLUMN {coluna} FLOAT"))
+                conn.commit()
+                print(f"Coluna {coluna} adicionada em {tabela}.")
+            except Exception as e:
+                conn.rollback()
+                print(f"Nota: coluna {tabela}.{coluna} provavelmente já existe: {e}")
+    print("Migração concluída!")
@@ -0,0 +1,20 @@
+from app import app, db, reconstruir_hierarquia
+from sqlalchemy import text
+
+# Cria e popula o índice de hierarquia (rede/geração -> célula) usado pelos feeds com escopo
+INDICES = [
+    "CREATE INDEX IF NOT EXISTS ix_celula_rede_id ON celula (rede_id)",
+    "CREATE INDEX IF NOT EXISTS ix_celula_geracao_id ON celula (geracao_id)",
+    "CREATE INDEX IF NOT EXISTS ix_geracao_rede_id ON geracao (rede_id)",
+]
+
+with app.app_context():
+    db.create_all()
+    with db.engine.connect() as conn:
+        for sql in INDICES:
+            conn.execute(text(sql))
+            print(f"OK: {sql}")
+        conn.commit()
+
+    reconstruir_hierarquia()
+    print("Índice de hierarquia reconstruído.")
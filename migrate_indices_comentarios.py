@@ -0,0 +1,31 @@
+from app import app, db
+from sqlalchemy import text
+
+# Índices usados pelo carregamento de threads de comentários (CTE recursiva por parent_id)
+INDICES = [
+    "CREATE INDEX IF NOT EXISTS ix_comentario_parent_id ON comentario (parent_id)",
+    "CREATE INDEX IF NOT EXISTS ix_comentario_evento_id ON comentario (evento_id)",
+    "CREATE INDEX IF NOT EXISTS ix_comentario_aviso_id ON comentario (aviso_id)",
+]
+
+with app.app_context():
+    db.create_all()
+    with db.engine.connect() as conn:
+        for sql in INDICES:
+            try:
+                conn.execute(text(sql))
+                print(f"OK: {sql}")
+            except Exception as e:
+                print(f"Erro ao criar indice: {e}")
+
+        # Respostas antigas de comentários de avisos ficaram sem aviso_id
+        try:
+            result = conn.execute(text(
+                "UPDATE comentario SET aviso_id = (SELECT p.aviso_id FROM comentario p WHERE p.id = comentario.parent_id) "
+                "WHERE parent_id IS NOT NULL AND aviso_id IS NULL AND evento_id IS NULL"
+            ))
+            print(f"Respostas corrigidas: {result.rowcount}")
+        except Exception as e:
+            print(f"Erro ao corrigir respostas: {e}")
+        conn.commit()
+    print("Migração concluída!")
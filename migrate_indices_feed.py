@@ -0,0 +1,23 @@
+from app import app, db
+from sqlalchemy import text
+
+# Índices compostos usados pela paginação keyset dos feeds (avisos, pedidos, testemunhos)
+INDICES = [
+    "CREATE INDEX IF NOT EXISTS ix_aviso_data_criacao_id ON aviso (data_criacao, id)",
+    "CREATE INDEX IF NOT EXISTS ix_pedido_oracao_data_criacao_id ON pedido_oracao (data_criacao, id)",
+    "CREATE INDEX IF NOT EXISTS ix_pedido_oracao_celula_data_criacao_id ON pedido_oracao (celula_id, data_criacao, id)",
+    "CREATE INDEX IF NOT EXISTS ix_testemunho_data_criacao_id ON testemunho (data_criacao, id)",
+    "CREATE INDEX IF NOT EXISTS ix_testemunho_celula_data_criacao_id ON testemunho (celula_id, data_criacao, id)",
+]
+
+with app.app_context():
+    db.create_all()
+    with db.engine.connect() as conn:
+        for sql in INDICES:
+            try:
+                conn.execute(text(sql))
+                print(f"OK: {sql}")
+            except Exception as e:
+                print(f"Erro ao criar indice: {e}")
+        conn.commit()
+    print("Migração concluída!")
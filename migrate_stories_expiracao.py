@@ -0,0 +1,26 @@
+from app import app, db
+from sqlalchemy import text
+
+# Preenche story.expira_em (24h após a criação) e cria os índices da janela de stories
+INDICES = [
+    "CREATE INDEX IF NOT EXISTS ix_story_expira_em ON story (expira_em)",
+    "CREATE INDEX IF NOT EXISTS ix_story_rede_geracao_criado ON story (rede_id, geracao_id, criado_em)",
+]
+
+with app.app_context():
+    db.create_all()
+    with db.engine.connect() as conn:
+        if conn.dialect.name == 'postgresql':
+            expira = "COALESCE(criado_em, NOW()) + INTERVAL '24 hours'"
+        else:
+            expira = "datetime(COALESCE(criado_em, CURRENT_TIMESTAMP), '+24 hours')"
+        resultado = conn.execute(text(f"UPDATE story SET expira_em = {expira} WHERE expira_em IS NULL"))
+        print(f"expira_em preenchido em {resultado.rowcount} stories")
+        for sql in INDICES:
+            try:
+                conn.execute(text(sql))
+                print(f"OK: {sql}")
+            except Exception as e:
+                print(f"Erro ao criar indice: {e}")
+        conn.commit()
+    print("Migração concluída!")
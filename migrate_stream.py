@@ -0,0 +1,7 @@
+from app import app, db, EventoStream
+
+# Cria a tabela do log de eventos usado por /api/stream (SSE)
+with app.app_context():
+    db.create_all()
+    print(f"Tabela {EventoStream.__tablename__} pronta.")
+    print("Migração concluída!")
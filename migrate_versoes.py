@@ -0,0 +1,13 @@
+from app import app, db, VersaoTabela
+from datetime import datetime
+
+# Cria a tabela de versões (ETag/Last-Modified) com uma linha por tabela do app
+with app.app_context():
+    db.create_all()
+    existentes = {v.tabela for v in VersaoTabela.query.all()}
+    for tabela in db.metadata.tables:
+        if tabela not in existentes and tabela != VersaoTabela.__tablename__:
+            db.session.add(VersaoTabela(tabela=tabela, versao=1, atualizado_em=datetime.utcnow()))
+            print(f"Versão inicial criada para {tabela}")
+    db.session.commit()
+    print("Migração concluída!")
@@ -0,0 +1,8 @@
+from app import app, db, purgar_excluidos
+
+# Apaga de vez membros, células e eventos com exclusão lógica e tudo que depende deles.
+# Para rodar por cron em vez da thread do app (EXCLUSAO_PURGA_MIN=0):
+#   */5 * * * * cd /caminho/do/app && python purgar_excluidos.py
+with app.app_context():
+    for tabela, total in purgar_excluidos().items():
+        print(f"{tabela}: {total} removidos")
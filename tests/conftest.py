@@ -0,0 +1,41 @@
+import os
+import tempfile
+
+import pytest
+
+# app.py lê a configuração no import: aponta para um banco descartável antes de importar.
+# TEST_DATABASE_URL permite rodar a suíte contra um PostgreSQL de teste.
+_banco = tempfile.NamedTemporaryFile(prefix='igreja-teste-', suffix='.db', delete=False)
+os.environ['DATABASE_URL'] = os.environ.get('TEST_DATABASE_URL') or f"sqlite:///{_banco.name}"
+os.environ.setdefault('SECRET_KEY', 'chave-de-teste')
+
+import app as modulo_app  # noqa: E402
+from app import app, db  # noqa: E402
+
+
+@pytest.fixture
+def contexto():
+    """App context com as tabelas recriadas a cada teste."""
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        yield modulo_app
+        db.session.remove()
+
+
+@pytest.fixture
+def membros(contexto):
+    lista = [contexto.Membro(nome=f"Membro {i}", email=f"m{i}@teste") for i in range(4)]
+    db.session.add_all(lista)
+    db.session.commit()
+    return [m.id for m in lista]
+
+
+@pytest.fixture
+def novo_aviso(contexto, membros):
+    def criar(titulo="Aviso"):
+        aviso = contexto.Aviso(titulo=titulo, mensagem="...", autor_id=membros[0])
+        db.session.add(aviso)
+        db.session.commit()
+        return aviso.id
+    return criar
@@ -0,0 +1,153 @@
+"""O buffer de curtidas (CURTIDAS_BUFFER_MS > 0) tem que chegar ao mesmo estado final
+que o caminho direto (CURTIDAS_BUFFER_MS=0): mesmas linhas em curtida e mesmo total."""
+import threading
+
+import pytest
+from sqlalchemy import event
+from sqlalchemy.exc import OperationalError
+
+from app import app, db, Aviso, Curtida, BufferCurtidas
+
+FLUSH = 'flush'
+
+SEQUENCIAS = [
+    [0],
+    [0, 0],                           # curte e descurte dentro da mesma janela
+    [0, 0, 0],
+    [0, 1, 2, 1, 3, 0],
+    [0, FLUSH, 0],                    # descurte o que já foi gravado
+    [0, 1, FLUSH, 1, 2, FLUSH, 2, 2, 3],
+]
+
+
+@pytest.fixture
+def buffer(contexto, monkeypatch):
+    # Sem a thread de fundo: o teste decide quando gravar
+    buf = BufferCurtidas(50)
+    monkeypatch.setattr(buf, '_iniciar', lambda: None)
+    return buf
+
+
+def estado(aviso_id):
+    membros = sorted(m for (m,) in db.session.query(Curtida.membro_id).filter(Curtida.aviso_id == aviso_id))
+    return membros, db.session.get(Aviso, aviso_id).total_curtidas
+
+
+def reproduzir(contexto, monkeypatch, buf, aviso_id, membros, sequencia):
+    monkeypatch.setattr(contexto, 'buffer_curtidas', buf)
+    respostas = []
+    for passo in sequencia:
+        if passo == FLUSH:
+            if buf:
+                buf.flush()
+            continue
+        respostas.append(contexto.curtir('aviso', aviso_id, membros[passo]))
+    if buf:
+        buf.flush()
+    db.session.expire_all()
+    return respostas
+
+
+@pytest.mark.parametrize('ja_curtidos', [(), (0, 2)])
+@pytest.mark.parametrize('sequencia', SEQUENCIAS)
+def test_buffer_chega_ao_mesmo_estado(contexto, monkeypatch, buffer, membros, novo_aviso, sequencia, ja_curtidos):
+    direto, com_buffer = novo_aviso(), novo_aviso()
+    for aviso_id in (direto, com_buffer):
+        for i in ja_curtidos:
+            contexto.alternar_curtida('aviso', aviso_id, membros[i])
+
+    respostas_direto = reproduzir(contexto, monkeypatch, None, direto, membros, sequencia)
+    respostas_buffer = reproduzir(contexto, monkeypatch, buffer, com_buffer, membros, sequencia)
+
+    assert estado(com_buffer) == estado(direto)
+    # A contagem otimista devolvida na hora é a mesma do caminho direto
+    assert respostas_buffer == respostas_direto
+    assert not buffer.pendentes and not buffer.deltas
+
+
+def test_flush_com_falha_devolve_o_lote(contexto, monkeypatch, buffer, membros, novo_aviso):
+    direto, com_buffer = novo_aviso(), novo_aviso()
+    reproduzir(contexto, monkeypatch, None, direto, membros, [0, 1, 1, 2])
+
+    monkeypatch.setattr(contexto, 'buffer_curtidas', buffer)
+    contexto.curtir('aviso', com_buffer, membros[0])
+    contexto.curtir('aviso', com_buffer, membros[1])
+
+    aplicar = contexto.aplicar_curtidas
+    def falhar(tipo, estados):
+        raise OperationalError("UPDATE aviso", {}, Exception("database is locked"))
+    monkeypatch.setattr(contexto, 'aplicar_curtidas', falhar)
+    with pytest.raises(OperationalError):
+        buffer.flush()
+
+    # Nada gravado, e o lote voltou para o buffer
+    assert estado(com_buffer) == ([], 0)
+    assert buffer.pendentes == {('aviso', com_buffer, membros[0]): True, ('aviso', com_buffer, membros[1]): True}
+
+    # Toques depois da falha continuam coalescendo com o lote devolvido
+    assert contexto.curtir('aviso', com_buffer, membros[1]) == ("descurtiu", 1)
+    contexto.curtir('aviso', com_buffer, membros[2])
+
+    monkeypatch.setattr(contexto, 'aplicar_curtidas', aplicar)
+    assert buffer.flush() == 2
+    db.session.expire_all()
+    assert estado(com_buffer) == estado(direto)
+
+
+def test_toque_durante_o_flush(contexto, monkeypatch, buffer, membros, novo_aviso):
+    direto, com_buffer = novo_aviso(), novo_aviso()
+    reproduzir(contexto, monkeypatch, None, direto, membros, [0, 1, 0])
+
+    monkeypatch.setattr(contexto, 'buffer_curtidas', buffer)
+    contexto.curtir('aviso', com_buffer, membros[0])
+    contexto.curtir('aviso', com_buffer, membros[1])
+
+    aplicar = contexto.aplicar_curtidas
+    def aplicar_com_toque(tipo, estados):
+        # O membro 0 descurte enquanto o lote em que ele curtiu está sendo gravado
+        monkeypatch.setattr(contexto, 'aplicar_curtidas', aplicar)
+        assert contexto.curtir('aviso', com_buffer, membros[0]) == ("descurtiu", 1)
+        return aplicar(tipo, estados)
+    monkeypatch.setattr(contexto, 'aplicar_curtidas', aplicar_com_toque)
+    buffer.flush()
+    buffer.flush()
+
+    db.session.expire_all()
+    assert estado(com_buffer) == estado(direto)
+
+
+def test_toque_logo_depois_do_commit(contexto, monkeypatch, buffer, membros, novo_aviso):
+    monkeypatch.setattr(contexto, 'buffer_curtidas', buffer)
+    aviso_id = novo_aviso()
+    contexto.curtir('aviso', aviso_id, membros[0])
+    contexto.curtir('aviso', aviso_id, membros[1])
+
+    respostas = []
+
+    def tocar():
+        with app.app_context():
+            respostas.append(contexto.curtir('aviso', aviso_id, membros[2]))
+            db.session.remove()
+
+    toque = threading.Thread(target=tocar)
+
+    def depois_do_commit(session):
+        # Outro worker toca entre o commit do lote e a limpeza dos deltas em voo; dá a ele
+        # a chance de responder ainda dentro dessa janela
+        if toque.ident is None:
+            toque.start()
+            toque.join(0.5)
+
+    sessao = db.session()
+    event.listen(sessao, 'after_commit', depois_do_commit)
+    try:
+        buffer.flush()
+    finally:
+        event.remove(sessao, 'after_commit', depois_do_commit)
+    toque.join(5)
+
+    # 2 já gravadas + a nova: o lote gravado não pode contar de novo como delta em voo
+    assert respostas == [("curtiu", 3)]
+    buffer.flush()
+    db.session.expire_all()
+    assert estado(aviso_id) == (sorted(membros[:3]), 3)
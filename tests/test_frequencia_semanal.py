@@ -0,0 +1,28 @@
+"""FrequenciaSemanal acompanha a mudança de tipo do membro (coluna visitantes)."""
+from datetime import datetime
+
+from app import db, Celula, Membro, Reuniao, Frequencia, FrequenciaSemanal, atualizar_frequencia_semanal, \
+    semanas_das_reunioes
+
+
+def test_mudanca_de_tipo_recalcula_visitantes(contexto):
+    celula = Celula(nome="Célula")
+    db.session.add(celula)
+    db.session.flush()
+    visitante = Membro(nome="Visitante", email="v@teste", tipo="Visitante", celula_id=celula.id)
+    membro = Membro(nome="Membro", email="m@teste", tipo="Membro", celula_id=celula.id)
+    reuniao = Reuniao(celula_id=celula.id, data=datetime(2026, 3, 4, 20))
+    db.session.add_all([visitante, membro, reuniao])
+    db.session.flush()
+    db.session.add_all([Frequencia(reuniao_id=reuniao.id, membro_id=visitante.id, presente=True),
+                        Frequencia(reuniao_id=reuniao.id, membro_id=membro.id, presente=True)])
+    db.session.flush()
+    atualizar_frequencia_semanal(semanas_das_reunioes([reuniao.id]))
+    db.session.commit()
+    assert FrequenciaSemanal.query.one().visitantes == 1
+
+    visitante.tipo = "Membro"
+    db.session.commit()
+    db.session.expire_all()
+    semana = FrequenciaSemanal.query.one()
+    assert (semana.participantes, semana.visitantes) == (2, 0)
@@ -0,0 +1,161 @@
+"""Cache, coalescência e lote da geolocalização com o provedor trocado por um stub
+(PROVEDORES_GEO): nada sai para ViaCEP/Nominatim."""
+import threading
+import time
+from datetime import datetime, timedelta
+
+import pytest
+
+from app import app, db, Celula, GeoCache, GeoIndisponivel
+
+
+class ProvedorFalso:
+    """Responde a partir de um dict (None = não encontrado; exceção = levanta)."""
+
+    def __init__(self, respostas=None, atraso=0):
+        self.respostas = respostas or {}
+        self.atraso = atraso
+        self.chamadas = []
+        self.simultaneas = 0
+        self.maximo_simultaneas = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, chave):
+        with self._lock:
+            self.chamadas.append(chave)
+            self.simultaneas += 1
+            self.maximo_simultaneas = max(self.maximo_simultaneas, self.simultaneas)
+        try:
+            if self.atraso:
+                time.sleep(self.atraso)
+            resposta = self.respostas.get(chave, {"latitude": -2.5, "longitude": -44.3})
+            if isinstance(resposta, Exception):
+                raise resposta
+            return resposta
+        finally:
+            with self._lock:
+                self.simultaneas -= 1
+
+
+class LockContado:
+    """threading.Lock que conta quantas vezes foi tomado (para sincronizar o teste)."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.entradas = 0
+
+    def __enter__(self):
+        self._lock.acquire()
+        self.entradas += 1
+
+    def __exit__(self, *exc):
+        self._lock.release()
+
+
+def trocar_provedor(contexto, monkeypatch, tipo, provedor):
+    monkeypatch.setitem(contexto.PROVEDORES_GEO, tipo, provedor)
+    return provedor
+
+
+def test_cache_evita_nova_chamada_ate_expirar(contexto, monkeypatch):
+    provedor = trocar_provedor(contexto, monkeypatch, 'cep', ProvedorFalso({'65000000': {"cidade": "Sao Luis"}}))
+
+    assert contexto.consultar_geo('cep', '65000000') == {"cidade": "Sao Luis"}
+    assert contexto.consultar_geo('cep', '65000000') == {"cidade": "Sao Luis"}
+    assert provedor.chamadas == ['65000000']
+
+    GeoCache.query.update({GeoCache.expira_em: datetime.utcnow() - timedelta(seconds=1)})
+    db.session.commit()
+    contexto.consultar_geo('cep', '65000000')
+    assert provedor.chamadas == ['65000000', '65000000']
+
+
+def test_cache_negativo(contexto, monkeypatch):
+    provedor = trocar_provedor(contexto, monkeypatch, 'cep', ProvedorFalso({'00000000': None}))
+
+    assert contexto.consultar_geo('cep', '00000000') is None
+    assert contexto.consultar_geo('cep', '00000000') is None
+    assert provedor.chamadas == ['00000000']
+    entrada = GeoCache.query.one()
+    # Não encontrado fica pouco tempo em cache
+    assert entrada.expira_em - entrada.criado_em == timedelta(hours=contexto.GEO_CACHE_NEGATIVO_HORAS)
+
+
+def test_consultas_simultaneas_viram_uma_chamada(contexto, monkeypatch):
+    liberar = threading.Event()
+    chamado = threading.Event()
+    provedor = ProvedorFalso()
+
+    def bloqueante(chave):
+        chamado.set()
+        liberar.wait(5)
+        return provedor(chave)
+
+    trocar_provedor(contexto, monkeypatch, 'geocode', bloqueante)
+    lock = LockContado()
+    monkeypatch.setattr(contexto, 'geo_pendentes_lock', lock)
+
+    resultados = {}
+
+    def consultar(nome):
+        with app.app_context():
+            try:
+                resultados[nome] = contexto.consultar_geo('geocode', 'rua x, sao luis')
+            finally:
+                db.session.remove()
+
+    primeira = threading.Thread(target=consultar, args=('primeira',))
+    primeira.start()
+    assert chamado.wait(5)
+    segunda = threading.Thread(target=consultar, args=('segunda',))
+    segunda.start()
+    # A segunda já passou pelo registro de pendentes (achou o Future da primeira)
+    limite = time.monotonic() + 5
+    while lock.entradas < 2 and time.monotonic() < limite:
+        time.sleep(0.01)
+    liberar.set()
+    primeira.join(5)
+    segunda.join(5)
+
+    assert provedor.chamadas == ['rua x, sao luis']
+    assert resultados['primeira'] == resultados['segunda'] == {"latitude": -2.5, "longitude": -44.3}
+    assert contexto.geo_pendentes == {}
+
+
+def test_provedor_indisponivel(contexto, monkeypatch):
+    provedor = trocar_provedor(contexto, monkeypatch, 'cep', ProvedorFalso({'65000000': GeoIndisponivel("HTTP 503")}))
+
+    with pytest.raises(GeoIndisponivel):
+        contexto.consultar_geo('cep', '65000000')
+    # Falha não vai para o cache nem deixa a chave presa em pendentes
+    assert GeoCache.query.count() == 0
+    assert contexto.geo_pendentes == {}
+
+    resposta = app.test_client().get('/api/geo/cep/65000-000')
+    assert resposta.status_code == 502
+    assert resposta.get_json() == {"erro": "Servico de CEP indisponivel"}
+    assert len(provedor.chamadas) == 2
+
+
+def test_lote_limita_chamadas_simultaneas(contexto, monkeypatch):
+    falha = 'rua 7, sao luis - ma, brasil'
+    provedor = trocar_provedor(contexto, monkeypatch, 'geocode',
+                               ProvedorFalso({falha: GeoIndisponivel("timeout")}, atraso=0.05))
+    for i in range(8):
+        db.session.add(Celula(nome=f"Celula {i}", endereco=f"Rua {i}", cidade="Sao Luis", estado="MA"))
+    # Mesmo endereço de outra célula: uma consulta só
+    db.session.add(Celula(nome="Celula repetida", endereco="Rua 0", cidade="Sao Luis", estado="MA"))
+    db.session.commit()
+
+    estatisticas = contexto.geocodificar_pendentes(workers=3)
+
+    assert provedor.maximo_simultaneas == 3
+    assert sorted(provedor.chamadas) == sorted(f"rua {i}, sao luis - ma, brasil" for i in range(8))
+    assert estatisticas == {"consultas": 8, "em_cache": 0, "consultados": 7, "falhas": 1, "atualizados": 8}
+    sem_coordenadas = [c.nome for c in Celula.query.filter(Celula.latitude.is_(None))]
+    assert sem_coordenadas == ["Celula 7"]
+
+    # Segunda rodada: o que deu certo está em cache, só a falha volta ao provedor
+    estatisticas = contexto.geocodificar_pendentes(workers=3)
+    assert estatisticas["consultas"] == 1 and estatisticas["em_cache"] == 0
+    assert provedor.chamadas.count(falha) == 2
@@ -0,0 +1,96 @@
+"""JSON_NO_BANCO: o JSON montado no PostgreSQL tem que sair idêntico ao do to_json
+(detalhe da célula, mural de avisos e threads de comentários)."""
+import pytest
+
+from app import app, db, Rede, Geracao, Celula, Membro, Aviso, Evento, emitir_token, json_no_banco
+
+
+@pytest.fixture
+def dados(contexto):
+    rede = Rede(nome="Rede Ágape")
+    db.session.add(rede)
+    db.session.flush()
+    geracao = Geracao(nome="Geração 1", rede_id=rede.id)
+    db.session.add(geracao)
+    db.session.flush()
+    celula = Celula(nome="Célula Centro", rede_id=rede.id, geracao_id=geracao.id, lider="Ana")
+    db.session.add(celula)
+    db.session.flush()
+    lider = Membro(nome="Ana", email="ana@teste", tipo="Lider", celula_id=celula.id)
+    outros = [Membro(nome=f"Membro {i}", email=f"m{i}@teste", celula_id=celula.id) for i in range(3)]
+    db.session.add_all([lider] + outros)
+    db.session.flush()
+    avisos = [Aviso(titulo=f"Aviso {i}", mensagem="...", autor_id=lider.id, celula_id=celula.id) for i in range(3)]
+    avisos.append(Aviso(titulo="Aviso da rede", mensagem="...", autor_id=lider.id, rede_id=rede.id))
+    evento = Evento(titulo="Culto")
+    db.session.add_all(avisos + [evento])
+    db.session.commit()
+
+    # Interações pelas rotas, para os contadores ficarem como em produção
+    cliente = app.test_client()
+    tokens = [{"Authorization": f"Bearer {emitir_token(m)[0]}"} for m in [lider] + outros]
+    raiz = cliente.post(f"/api/avisos/{avisos[0].id}/comentar", json={"texto": "Amém"}, headers=tokens[1]).get_json()
+    resposta = cliente.post(f"/api/comentarios/{raiz['id']}/responder", json={"texto": "Glória"}, headers=tokens[2]).get_json()
+    cliente.post(f"/api/comentarios/{resposta['id']}/responder", json={"texto": "Aleluia"}, headers=tokens[0])
+    cliente.post(f"/api/eventos/{evento.id}/comentar", json={"texto": "Estarei lá"}, headers=tokens[3])
+    cliente.post(f"/api/avisos/{avisos[0].id}/curtir", headers=tokens[0])
+    cliente.post(f"/api/avisos/{avisos[1].id}/curtir", headers=tokens[2])
+    cliente.post(f"/api/comentarios/{raiz['id']}/curtir", headers=tokens[0])
+    cliente.post(f"/api/eventos/{evento.id}/curtir", headers=tokens[1])
+
+    return {
+        "token": tokens[0],
+        "urls": [
+            f"/api/celulas/{celula.id}",
+            f"/api/celulas/{celula.id}?fields=nome,rede,membros.nome",
+            f"/api/celulas/{celula.id}/avisos",
+            f"/api/celulas/{celula.id}/avisos?limit=2",
+            "/api/avisos",
+            "/api/avisos?limit=2",
+            "/api/avisos?fields=titulo,autor_nome,curtido_por_mim",
+            f"/api/avisos/{avisos[0].id}/comentarios",
+            f"/api/eventos/{evento.id}/comentarios",
+            f"/api/eventos/{evento.id}/comentarios?fields=texto,respostas",
+            f"/api/comentarios/{raiz['id']}/respostas?limite=5",
+        ],
+    }
+
+
+def saidas(url, cabecalhos):
+    cliente = app.test_client()
+    resultado = []
+    for modo in (True, False):
+        app.config['JSON_NO_BANCO'] = modo
+        res = cliente.get(url, headers=cabecalhos)
+        resultado.append((res.status_code, res.get_json()))
+    app.config['JSON_NO_BANCO'] = True
+    return resultado
+
+
+def comparar(dados):
+    for cabecalhos in ({}, dados["token"]):
+        for url in dados["urls"]:
+            no_banco, to_json = saidas(url, cabecalhos)
+            assert no_banco[0] == 200, url
+            assert no_banco == to_json, url
+
+
+def test_json_no_banco_igual_ao_to_json(dados):
+    if db.engine.dialect.name != 'postgresql':
+        pytest.skip("JSON no banco só roda em PostgreSQL (use TEST_DATABASE_URL)")
+    app.config['JSON_NO_BANCO'] = True
+    assert json_no_banco()
+    comparar(dados)
+
+
+def test_sqlite_segue_pelo_to_json(dados):
+    if db.engine.dialect.name == 'postgresql':
+        pytest.skip("caso do SQLite")
+    app.config['JSON_NO_BANCO'] = True
+    assert not json_no_banco()
+    comparar(dados)
+    # Sanidade: a thread veio completa pelo caminho de fallback
+    thread = app.test_client().get(dados["urls"][7]).get_json()
+    comentarios = thread["comentarios"] if isinstance(thread, dict) else thread
+    assert comentarios[0]["texto"] == "Amém"
+    assert comentarios[0]["respostas"][0]["respostas"][0]["texto"] == "Aleluia"
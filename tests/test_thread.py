@@ -0,0 +1,39 @@
+"""arvore_thread: comentários excluídos não contam na paginação das raízes nem no
+limite de respostas por pai."""
+from datetime import datetime, timedelta
+
+import pytest
+
+from app import db, Aviso, Comentario
+
+
+@pytest.fixture
+def thread(contexto, membros):
+    aviso = Aviso(titulo="Aviso", mensagem="...", autor_id=membros[0])
+    db.session.add(aviso)
+    db.session.commit()
+    inicio = datetime(2026, 1, 1)
+
+    def comentar(texto, minuto, parent_id=None, excluido=False):
+        com = Comentario(texto=texto, aviso_id=aviso.id, membro_id=membros[0], parent_id=parent_id,
+                         data_criacao=inicio + timedelta(minutes=minuto),
+                         excluido_em=datetime.utcnow() if excluido else None)
+        db.session.add(com)
+        db.session.commit()
+        return com.id
+
+    comentar("raiz excluída", 10, excluido=True)
+    raiz = comentar("raiz", 1)
+    for minuto, texto in enumerate(("a", "b", "c", "d"), start=2):
+        comentar(texto, minuto, raiz, excluido=texto == "a")
+    return aviso.id, raiz
+
+
+def textos(arvore):
+    return [(com["texto"], [r["texto"] for r in com.get("respostas", [])]) for com in arvore]
+
+
+def test_excluidos_nao_ocupam_lugar(contexto, thread):
+    aviso_id, raiz = thread
+    assert textos(contexto.carregar_thread(aviso_id=aviso_id, limite=1, limite_respostas=2)) == [("raiz", ["b", "c"])]
+    assert textos(contexto.carregar_thread(raiz_id=raiz, limite=2)) == [("b", []), ("c", [])]